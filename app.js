@@ -1,4 +1,30 @@
-var app = require('./server/server').app;
-require('./server/presence');
+var cluster = require('cluster');
+var os = require('os');
+var config = require('./server/config').config;
+var logger = require('./server/logger');
 
-app.start(process.env.PORT || 5000);
+var port = process.env.PORT || 5000;
+
+// With CLUSTER_WORKERS, the server runs in that many worker processes (0
+// for one per CPU core) sharing the port, and the master relays the
+// messages they exchange about their users (see server/bus.js).
+if (config.CLUSTER_WORKERS !== undefined && cluster.isMaster) {
+  var workers = config.CLUSTER_WORKERS || os.cpus().length;
+
+  require('./server/bus').relay(cluster);
+
+  cluster.on('exit', function(worker, code, signal) {
+    logger.error({type: "cluster", worker: worker.id, code: code,
+                  signal: signal}, "worker died, starting another one");
+    cluster.fork();
+  });
+
+  console.log("Starting " + workers + " workers");
+  for (var i = 0; i < workers; i++)
+    cluster.fork();
+} else {
+  var app = require('./server/server').app;
+  require('./server/presence');
+
+  app.start(port);
+}
@@ -0,0 +1,672 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Drives a large number of virtual users against a Talkilla server.
+
+Each virtual user is a greenlet with its own keep-alive connections and
+session cookie, so a single process can keep tens of thousands of users
+parked in /stream long polls while pairs of users place calls::
+
+    $ bin/python driver.py --idle 20000 --callers 50 -d 120
+
+With --transport events, users get their events pushed over /events
+instead of long polling.
+
+The /metrics api of the server is scraped during the run, and the peak
+values of its users, pending requests, queues, event loop lag and heap
+are added to the report.
+
+Without --server, a local server is started for the run.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import errno
+import httplib
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urlparse
+import uuid
+
+import gevent
+from gevent.event import Event
+from gevent.fileobject import FileObject
+from gevent.queue import Empty, Queue
+
+from local import LocalServer, read_defaults
+import metrics
+from scenario import ICE_BURST, TalkillaScenario
+from stats import Stats
+
+
+# Long polls are held for LONG_POLLING_TIMEOUT (20s in production) so
+# the socket timeout has to be larger than that.
+SOCKET_TIMEOUT = 60
+
+# How the users get their events: long polling /stream, or pushed over
+# /events as Server-Sent Events.
+TRANSPORTS = ('stream', 'events')
+
+# What writing to an idle keep-alive connection the server closed fails
+# with.
+STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+# Delay before an user tries again after a failure, so that a server
+# which is down doesn't turn the driver into a busy loop.
+RETRY_DELAY = 1
+
+
+class Response(object):
+    """The subset of requests' Response used by the scenario."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class StaleConnection(Exception):
+    """An idle keep-alive connection the server had closed, which it
+    didn't get the request on: it is safe to send it again."""
+
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+def _no_status_line(error):
+    # httplib raises BadStatusLine with the line it read, and a message
+    # which depends on the Python version when it didn't read anything.
+    line = error.line.strip("'")
+    return not line or line.startswith('No status line')
+
+
+class Session(object):
+    """HTTP keep-alive connections and session cookie of one user.
+
+    Connections are pooled: a user can have a long poll pending while it
+    posts a call offer, every other request reuses an idle connection.
+
+    A request on an idle connection the server closed in the meantime is
+    sent again on a new one, and `on_retry` called with the path and the
+    time lost, in milliseconds. Any other failure, timeouts included, is
+    raised: the request may have reached the server.
+    """
+
+    def __init__(self, host, port, timeout=SOCKET_TIMEOUT, on_retry=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.on_retry = on_retry
+        self.cookie = None
+        self._idle = []
+
+    def _request(self, conn, path, body, headers):
+        try:
+            conn.request('POST', path, body, headers)
+        except socket.error as e:
+            # timeouts have no errno
+            if e.errno in STALE_ERRNOS:
+                raise StaleConnection(e)
+            raise
+        try:
+            res = conn.getresponse()
+        except httplib.BadStatusLine as e:
+            if _no_status_line(e):
+                raise StaleConnection(e)
+            raise
+        return res, res.read()
+
+    def post(self, url, data=None, headers=None):
+        path = urlparse.urlparse(url).path
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        if self._idle:
+            conn = self._idle.pop()
+            start = time.time()
+            try:
+                res, content = self._request(conn, path, data, headers)
+            except StaleConnection:
+                # the server closed the idle connection, try a new one.
+                conn.close()
+                conn = None
+                if self.on_retry is not None:
+                    self.on_retry(path, (time.time() - start) * 1000)
+            except Exception:
+                conn.close()
+                raise
+        else:
+            conn = None
+
+        if conn is None:
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+            try:
+                res, content = self._request(conn, path, data, headers)
+            except StaleConnection as e:
+                conn.close()
+                raise e.error
+            except Exception:
+                conn.close()
+                raise
+
+        cookie = res.getheader('set-cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+
+        if res.will_close:
+            conn.close()
+        else:
+            self._idle.append(conn)
+        return Response(res.status, content)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class EventStream(object):
+    """The /events connection of one user.
+
+    A greenlet reads the messages pushed by the server as they come in;
+    `read` returns them in order, an empty list of events for heartbeats,
+    like a /stream response which timed out.
+    """
+
+    def __init__(self, host, port, cookie, timeout=SOCKET_TIMEOUT):
+        self.timeout = timeout
+        self.messages = Queue()
+        self.conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        try:
+            self.conn.request('GET', '/events', None,
+                              {'Cookie': cookie,
+                               'Accept': 'text/event-stream'})
+            self.res = self.conn.getresponse()
+        except Exception:
+            self.conn.close()
+            raise
+        self.status_code = self.res.status
+        self.reader = None
+        if self.status_code == 200:
+            self.reader = gevent.spawn(self._read_messages)
+
+    def _chunks(self):
+        # Express sends the stream chunked: httplib would wait for a whole
+        # `amt` of data, so read the chunks ourselves.
+        fp = self.res.fp
+        if not self.res.chunked:
+            for line in iter(fp.readline, ''):
+                yield line
+            return
+        while True:
+            size = int(fp.readline().split(';', 1)[0], 16)
+            if size == 0:
+                return
+            chunk = fp.read(size)
+            fp.readline()
+            yield chunk
+
+    def _read_messages(self):
+        data = ''
+        try:
+            for chunk in self._chunks():
+                data += chunk
+                while '\n\n' in data:
+                    message, data = data.split('\n\n', 1)
+                    self.messages.put(self._parse(message))
+        except (httplib.HTTPException, socket.error, ValueError):
+            pass
+        # the connection is gone: readers get an error
+        self.messages.put(None)
+
+    def _parse(self, message):
+        events = []
+        for line in message.split('\n'):
+            if line.startswith('data:'):
+                events.extend(json.loads(line[5:]))
+        return events
+
+    def read(self):
+        """Returns the events of the next message."""
+        try:
+            events = self.messages.get(timeout=self.timeout)
+        except Empty:
+            events = None
+        if events is None:
+            self.messages.put(None)
+            raise IOError('/events connection lost')
+        return events
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.kill(block=False)
+        self.conn.close()
+
+
+class VirtualUsers(TalkillaScenario):
+    """Runs scenario steps, each nick with its own Session.
+
+    With the 'events' transport, `_stream` reads the messages pushed over
+    the /events connection of the user instead of long polling, so the
+    scenario steps run the same with both transports.
+
+    `root` can also be a list of the urls of several nodes sharing their
+    users (see multinode.py): each user then talks to one of them, picked
+    with `place` or from their nick.
+    """
+
+    def __init__(self, root, stats, candidates=0, burst=ICE_BURST,
+                 transport='stream'):
+        self.roots = root if isinstance(root, list) else [root]
+        self.root = self.roots[0]
+        self.stats = stats
+        # ICE candidates exchanged during each call
+        self.candidates = candidates
+        self.burst = burst
+        self.transport = transport
+        self.nodes = []
+        for url in self.roots:
+            parsed = urlparse.urlparse(url)
+            self.nodes.append((parsed.hostname, parsed.port or 80))
+        self.placement = {}
+        self.sessions = {}
+        self.streams = {}
+
+    def place(self, nick, index):
+        """Makes `nick` talk to the node at `index`, modulo the number of
+        nodes."""
+        self.placement[nick] = index % len(self.nodes)
+
+    def node(self, nick):
+        """Returns the (host, port) of the node `nick` talks to."""
+        index = self.placement.get(nick)
+        if index is None:
+            index = hash(nick) % len(self.nodes)
+        return self.nodes[index]
+
+    def _post(self, nick, url, body, headers):
+        if nick not in self.sessions:
+            host, port = self.node(nick)
+            self.sessions[nick] = Session(host, port,
+                                          on_retry=self._retried)
+        return self.sessions[nick].post(url, body, headers)
+
+    def _retried(self, path, ms):
+        # not a request the scenario made, but it took that long
+        self.stats.measure('retry', ms)
+
+    def _stream(self, nick, first=False):
+        if self.transport == 'stream':
+            return super(VirtualUsers, self)._stream(nick, first)
+        if first:
+            self._connect(nick)
+        return self.streams[nick].read()
+
+    def _connect(self, nick):
+        """Opens the /events connection of `nick`, and records how long
+        it takes to get its response headers."""
+        old = self.streams.pop(nick, None)
+        if old is not None:
+            old.close()
+        start = time.time()
+        try:
+            host, port = self.node(nick)
+            stream = EventStream(host, port, self.sessions[nick].cookie)
+        except Exception:
+            self.stats.record('events', (time.time() - start) * 1000,
+                              error=True)
+            raise
+        self.stats.record('events', (time.time() - start) * 1000,
+                          error=stream.status_code != 200)
+        if stream.status_code != 200:
+            stream.close()
+        self.assertEqual(stream.status_code, 200)
+        self.streams[nick] = stream
+
+    def assertEqual(self, first, second):
+        if first != second:
+            raise AssertionError('%r != %r' % (first, second))
+
+    def assertTrue(self, expr, msg=None):
+        if not expr:
+            raise AssertionError(msg or '%r is not true' % (expr,))
+
+    def forget(self, nick):
+        session = self.sessions.pop(nick, None)
+        if session is not None:
+            session.close()
+        stream = self.streams.pop(nick, None)
+        if stream is not None:
+            stream.close()
+
+    def park(self, nick, stop, watcher=None):
+        """Signs in and keeps reading its events until `stop` is set.
+
+        `watcher`, when given, is told when the user is signed in with
+        `signed_in(nick)` and gets the events it receives afterwards with
+        `received(nick, events)`.
+        """
+        while not stop.is_set():
+            try:
+                self._signin(nick)
+                if watcher is not None:
+                    watcher.signed_in(nick)
+                while not stop.is_set():
+                    events = self._stream(nick)
+                    if watcher is not None:
+                        watcher.received(nick, events)
+            except Exception:
+                self.forget(nick)
+                stop.wait(RETRY_DELAY)
+
+    def call(self, caller, callee, stop):
+        """Signs two users in and have them call each other until `stop`
+        is set."""
+        while not stop.is_set():
+            try:
+                self._signin(caller)
+                self._signin(callee)
+                while not stop.is_set():
+                    start = time.time()
+                    try:
+                        if self.candidates:
+                            self._call_with_candidates(caller, callee,
+                                                       self.candidates,
+                                                       self.burst)
+                        else:
+                            self._call(caller, callee)
+                    except Exception:
+                        self.stats.measure('call', (time.time() - start) *
+                                           1000, error=True)
+                        raise
+                    self.stats.measure('call', (time.time() - start) * 1000)
+            except Exception:
+                self.forget(caller)
+                self.forget(callee)
+                stop.wait(RETRY_DELAY)
+
+
+def raise_fd_limit():
+    """Every parked user holds a socket; allow as many as we can."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def nicks(count, prefix):
+    return ['%s-%s' % (prefix, uuid.uuid4()) for i in range(count)]
+
+
+def parse_steps(value):
+    """Parses a loads-like user count, e.g. `10:20:30`."""
+    return [int(step) for step in str(value).split(':')]
+
+
+def split(count, parts):
+    """Splits `count` users in `parts` shares as even as possible."""
+    share, extra = divmod(count, parts)
+    return [share + (1 if i < extra else 0) for i in range(parts)]
+
+
+class Load(object):
+    """Virtual users running against a server.
+
+    The load is grown step by step with `step`; users started by a step
+    keep running during the following ones, until `close` is called.
+    """
+
+    def __init__(self, root, rate=500, candidates=0, burst=ICE_BURST,
+                 transport='stream'):
+        self.users = VirtualUsers(root, Stats(), candidates, burst,
+                                  transport)
+        self.rate = rate
+        self.stop = Event()
+        self.greenlets = []
+        self.callers = 0
+        self.idle = 0
+
+    def _grow(self, callers, idle):
+        new = max(callers - self.callers, 0)
+        pairs = zip(nicks(new, 'caller'), nicks(new, 'callee'))
+        for caller, callee in pairs:
+            # with several nodes, peers are on different ones.
+            self.users.place(caller, self.callers)
+            self.users.place(callee, self.callers + 1)
+            self.greenlets.append(gevent.spawn(self.users.call, caller,
+                                               callee, self.stop))
+            self.callers += 1
+        for i, nick in enumerate(nicks(max(idle - self.idle, 0), 'idle')):
+            self.greenlets.append(gevent.spawn(self.users.park, nick,
+                                               self.stop))
+            self.idle += 1
+            # users are started at `rate` per second so the server doesn't
+            # get all the signins at once.
+            if self.rate and i % self.rate == self.rate - 1:
+                gevent.sleep(1)
+
+    def step(self, callers, idle, duration):
+        """Grows the load to `callers` pairs and `idle` parked users and
+        lets it run for `duration` seconds.
+
+        Returns the `stats.Stats` of the step.
+        """
+        stats = self.users.stats = Stats()
+        starter = gevent.spawn(self._grow, callers, idle)
+        gevent.sleep(duration)
+        starter.kill()
+        return stats
+
+    def close(self):
+        self.stop.set()
+        # parked users may be waiting for a long poll to return, no need
+        # to wait for them.
+        gevent.killall(self.greenlets, block=True, timeout=5)
+        for nick in list(self.users.sessions):
+            self.users.forget(nick)
+
+
+def run(root, steps, duration=60, rate=500, candidates=0, burst=ICE_BURST,
+        transport='stream'):
+    """Runs the `(callers, idle)` steps against `root`, `duration`
+    seconds each, and returns the list of their `stats.Stats`.
+
+    When `candidates` is not 0, every call exchanges that many ICE
+    candidates, `burst` at a time. `transport` is one of TRANSPORTS.
+    """
+    load = Load(root, rate, candidates, burst, transport)
+    try:
+        return [load.step(callers, idle, duration)
+                for callers, idle in steps]
+    finally:
+        load.close()
+
+
+def run_worker(root, rate, candidates=0, burst=ICE_BURST,
+               transport='stream'):
+    """Runs steps read from stdin and answers with their stats.
+
+    This is how the processes started by `run_processes` are driven: each
+    line of input is a JSON `[callers, idle, duration]` step, each line of
+    output the JSON stats of that step.
+    """
+    # read stdin without blocking the users running between two steps
+    stdin = FileObject(sys.stdin, 'r')
+    load = Load(root, rate, candidates, burst, transport)
+    try:
+        for line in iter(stdin.readline, ''):
+            callers, idle, duration = json.loads(line)
+            stats = load.step(callers, idle, duration)
+            sys.stdout.write(stats.to_json() + '\n')
+            sys.stdout.flush()
+    finally:
+        load.close()
+
+
+def run_processes(root, steps, processes, duration=60, rate=500,
+                  candidates=0, burst=ICE_BURST, transport='stream'):
+    """Same as `run`, but shards the users across `processes` worker
+    processes.
+
+    Every step is started on all workers at the same time, once all of
+    them are done with the previous one; their stats are merged.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker',
+           '--server', urlparse.urlparse(root).netloc,
+           '--rate', str(max(rate // processes, 1)),
+           '--candidates', str(candidates), '--burst', str(burst),
+           '--transport', transport]
+    workers = [subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+               for i in range(processes)]
+    results = []
+    try:
+        for callers, idle in steps:
+            shares = zip(split(callers, processes), split(idle, processes))
+            for worker, (worker_callers, worker_idle) in zip(workers,
+                                                              shares):
+                step = [worker_callers, worker_idle, duration]
+                worker.stdin.write(json.dumps(step) + '\n')
+                worker.stdin.flush()
+            stats = Stats()
+            for worker in workers:
+                line = worker.stdout.readline()
+                if not line:
+                    raise RuntimeError("Worker %d died" % worker.pid)
+                stats.merge(Stats.from_json(line))
+            results.append(stats)
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+        for worker in workers:
+            worker.wait()
+    return results
+
+
+def main(args=sys.argv[1:]):
+    defaults = read_defaults()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s', '--server', default=None,
+                        help='host:port of the server to test (default: '
+                             'start a local one)')
+    parser.add_argument('-i', '--idle', default='1000',
+                        help='users parked in long polls, or steps like '
+                             '1000:5000 (default: %(default)s)')
+    parser.add_argument('-c', '--callers', default=defaults['users'],
+                        help='pairs of users calling each other, or steps '
+                             'like 10:20:30 (default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=int,
+                        default=int(defaults['duration'] or 60),
+                        help='duration of each step in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=int, default=500,
+                        help='users started per second '
+                             '(default: %(default)s)')
+    parser.add_argument('--candidates', type=int, default=0,
+                        help='ICE candidates each peer sends during a call '
+                             '(default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=ICE_BURST,
+                        help='ICE candidates posted at the same time '
+                             '(default: %(default)s)')
+    parser.add_argument('-t', '--transport', choices=TRANSPORTS,
+                        default='stream',
+                        help='how users get their events: long polling '
+                             '/stream or pushed over /events '
+                             '(default: %(default)s)')
+    parser.add_argument('--coalescing-window', type=int, default=None,
+                        help='LONG_POLLING_COALESCING_WINDOW of the local '
+                             'server, in ms (default: from the config)')
+    parser.add_argument('--timer-resolution', type=int, default=None,
+                        help='TIMER_RESOLUTION of the local server, in ms, '
+                             '0 for native timers (default: from the '
+                             'config)')
+    parser.add_argument('--cluster-workers', type=int, default=None,
+                        help='CLUSTER_WORKERS of the local server, 0 for '
+                             'one per CPU core (default: from the config)')
+    parser.add_argument('--metrics-interval', type=float,
+                        default=metrics.INTERVAL,
+                        help='seconds between two scrapes of the server '
+                             'metrics, 0 to not scrape them (default: '
+                             '%(default)s)')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of processes generating the load, 0 '
+                             'for one per CPU core (default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write the latency report as JSON to this file')
+    parser.add_argument('--worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    limit = raise_fd_limit()
+    if options.worker:
+        return run_worker('http://%s/' % options.server, options.rate,
+                          options.candidates, options.burst,
+                          options.transport)
+
+    callers, idle = parse_steps(options.callers), parse_steps(options.idle)
+    # the shorter list of steps keeps its last value
+    count = max(len(callers), len(idle))
+    callers += callers[-1:] * (count - len(callers))
+    idle += idle[-1:] * (count - len(idle))
+    steps = zip(callers, idle)
+    processes = options.processes or multiprocessing.cpu_count()
+
+    if processes == 1 and limit < max(idle) + max(callers) * 4:
+        print("Warning: only %d file descriptors available" % limit)
+
+    def drive(root):
+        scraper = metrics.Scraper(root, options.metrics_interval)
+        if options.metrics_interval:
+            scraper.start()
+        if processes > 1:
+            results = run_processes(root, steps, processes,
+                                    duration=options.duration,
+                                    rate=options.rate,
+                                    candidates=options.candidates,
+                                    burst=options.burst,
+                                    transport=options.transport)
+        else:
+            results = run(root, steps, duration=options.duration,
+                          rate=options.rate, candidates=options.candidates,
+                          burst=options.burst, transport=options.transport)
+        total = Stats()
+        for (step_callers, step_idle), stats in zip(steps, results):
+            if len(steps) > 1:
+                print("\n%d calling pairs, %d idle users" % (step_callers,
+                                                             step_idle))
+                print(stats.format_table())
+            total.merge(stats)
+        total.metrics = scraper.stop()
+        print("\nTotal")
+        print(total.format_table())
+        if options.report:
+            total.dump(options.report)
+
+    if options.server:
+        drive('http://%s/' % options.server)
+    else:
+        env = {}
+        if options.coalescing_window is not None:
+            env['LONG_POLLING_COALESCING_WINDOW'] = \
+                str(options.coalescing_window)
+        if options.timer_resolution is not None:
+            env['TIMER_RESOLUTION'] = str(options.timer_resolution)
+        if options.cluster_workers is not None:
+            env['CLUSTER_WORKERS'] = str(options.cluster_workers)
+        with LocalServer(env=env) as server:
+            print("Talkilla running on %s" % server.root)
+            drive(server.root)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures how presence broadcasts scale with the number of users.
+
+Every signin and signout is broadcast to all the connected users, so
+their cost grows with the number of users online. This grows a
+population of users parked in /stream long polls step by step; at each
+step a probe user signs in and out a few times and we measure the signin
+latency, how long it takes for the userJoined and userLeft events to
+reach every parked user and for the probe to get the presence list::
+
+    $ bin/python fanout.py --steps 100:1000:10000:50000
+
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import sys
+import time
+import uuid
+
+import gevent
+from gevent.event import Event
+
+from driver import VirtualUsers, nicks, parse_steps, raise_fd_limit
+from local import LocalServer
+from scenario import MAX_POLLS
+from stats import Stats
+
+
+DEFAULT_STEPS = '100:500:1000:5000:10000:20000:50000'
+
+# Longest we wait for parked users to be signed in, or for a broadcast
+# to reach all of them, in seconds.
+TIMEOUT = 120
+
+CHART_WIDTH = 50
+
+
+class Watcher(object):
+    """Keeps track of the parked users and of the events they get."""
+
+    def __init__(self):
+        self.parked = set()
+        self.expected = None
+        self.times = []
+        self.done = Event()
+        self.all_parked = Event()
+        self.population = 0
+
+    def signed_in(self, nick):
+        self.parked.add(nick)
+        if len(self.parked) >= self.population:
+            self.all_parked.set()
+
+    def wait_for_users(self, population, timeout=TIMEOUT):
+        self.population = population
+        if len(self.parked) < population:
+            self.all_parked.clear()
+            self.all_parked.wait(timeout)
+        return len(self.parked)
+
+    def expect(self, topic, data):
+        """Starts recording when the parked users get the given event."""
+        self.expected = (topic, data)
+        self.times = []
+        self.done.clear()
+
+    def received(self, nick, events):
+        now = time.time()
+        for event in events:
+            if (event['topic'], event['data']) == self.expected:
+                self.times.append(now)
+        if len(self.times) >= len(self.parked):
+            self.done.set()
+
+
+def probe(users, watcher, stats, timeout=TIMEOUT):
+    """Signs a new user in and out, and records the time it takes and
+    how long it takes for the others to know about it."""
+    nick = 'probe-%s' % uuid.uuid4()
+
+    watcher.expect('userJoined', nick)
+    start = time.time()
+    users._signin(nick)
+    stats.measure('probe:signin', (time.time() - start) * 1000)
+    watcher.done.wait(timeout)
+    broadcast(stats, 'userJoined', start, watcher.times, len(watcher.parked))
+
+    presence(users, nick, stats)
+
+    watcher.expect('userLeft', nick)
+    start = time.time()
+    users._signout(nick)
+    watcher.done.wait(timeout)
+    broadcast(stats, 'userLeft', start, watcher.times, len(watcher.parked))
+    users.forget(nick)
+
+
+def presence(users, nick, stats, polls=MAX_POLLS):
+    """Asks for the list of users, and records how long it takes to get
+    it and how many users it has."""
+    start = time.time()
+    res = users._post_json(nick, 'presenceRequest', {'nick': nick})
+    users.assertEqual(res.status_code, 204)
+    for i in range(polls):
+        for event in users._stream(nick):
+            if event['topic'] == 'users':
+                stats.measure('probe:presence', (time.time() - start) * 1000)
+                stats.observe('presence:users', len(event['data']))
+                return
+    stats.measure('probe:presence', (time.time() - start) * 1000, error=True)
+
+
+def broadcast(stats, topic, start, times, expected):
+    """Records how long it took for each user to get the event, and for
+    the last one to get it (the whole broadcast)."""
+    for received in times:
+        stats.measure('%s:user' % topic, (received - start) * 1000)
+    if times:
+        stats.measure('%s:all' % topic, (max(times) - start) * 1000,
+                      error=len(times) < expected)
+
+
+def run(root, steps, probes=3, rate=1000):
+    """Runs the probes at each step and returns `(users, stats)` tuples.
+    """
+    users = VirtualUsers(root, Stats())
+    watcher = Watcher()
+    stop = Event()
+    greenlets = []
+    results = []
+    try:
+        for population in steps:
+            new = nicks(max(population - len(greenlets), 0), 'idle')
+            for i, nick in enumerate(new):
+                greenlets.append(gevent.spawn(users.park, nick, stop,
+                                              watcher))
+                if rate and i % rate == rate - 1:
+                    gevent.sleep(1)
+            parked = watcher.wait_for_users(population)
+            # let the userJoined notifications of the ramp up settle
+            gevent.sleep(1)
+
+            stats = users.stats = Stats()
+            for i in range(probes):
+                probe(users, watcher, stats)
+            results.append((parked, stats))
+            print(format_step(parked, stats))
+    finally:
+        stop.set()
+        gevent.killall(greenlets, block=True, timeout=5)
+        for nick in list(users.sessions):
+            users.forget(nick)
+    return results
+
+
+def format_step(population, stats):
+    values = [stats.percentile('probe:signin', 50),
+              stats.percentile('userJoined:user', 50),
+              stats.percentile('userJoined:all', 50),
+              stats.percentile('userLeft:all', 50),
+              stats.percentile('probe:presence', 50)]
+    return '%8d users  signin %s  userJoined p50 %s / all %s  ' \
+           'userLeft all %s  presence %s' % ((population,) + tuple(
+               '-' if v is None else '%.1fms' % v for v in values))
+
+
+def format_chart(results, name='userJoined:all', width=CHART_WIDTH):
+    """Draws the median of `name` for each step as a bar chart."""
+    points = [(population, stats.percentile(name, 50))
+              for population, stats in results]
+    top = max([value for population, value in points if value] or [1])
+    lines = ['%s (median, ms)' % name]
+    for population, value in points:
+        bar = '#' * int(round((value or 0) * width / top))
+        lines.append('%8d |%s %s' % (population, bar.ljust(width),
+                                     '-' if value is None else
+                                     '%.1f' % value))
+    return '\n'.join(lines)
+
+
+def to_json(results):
+    return json.dumps([{'users': population, 'stats': stats.to_dict()}
+                       for population, stats in results],
+                      indent=2, sort_keys=True)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s', '--server', default=None,
+                        help='host:port of the server to test (default: '
+                             'start a local one)')
+    parser.add_argument('--steps', default=DEFAULT_STEPS,
+                        help='numbers of parked users to measure with '
+                             '(default: %(default)s)')
+    parser.add_argument('--probes', type=int, default=3,
+                        help='probe signins at each step '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=int, default=1000,
+                        help='users started per second '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write the stats of each step as JSON to this '
+                             'file')
+    options = parser.parse_args(args)
+
+    steps = parse_steps(options.steps)
+    limit = raise_fd_limit()
+    if limit < max(steps) + 10:
+        print("Warning: only %d file descriptors available" % limit)
+
+    def measure(root):
+        results = run(root, steps, probes=options.probes, rate=options.rate)
+        print('')
+        print(format_chart(results, 'userJoined:all'))
+        print('')
+        print(format_chart(results, 'probe:signin'))
+        print('')
+        print(format_chart(results, 'probe:presence'))
+        if options.report:
+            with open(options.report, 'w') as f:
+                f.write(to_json(results))
+
+    if options.server:
+        measure('http://%s/' % options.server)
+    else:
+        with LocalServer() as server:
+            print("Talkilla running on %s" % server.root)
+            measure(server.root)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
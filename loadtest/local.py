@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Runs the Talkilla load test against a local, throw-away server.
+
+This boots app.js in test mode (so Persona assertions are not checked),
+runs the TestTalkilla scenarios against it with loads-runner and tears
+everything down afterwards. No remote host is needed::
+
+    $ bin/python local.py -u 10:20:30 -d 60
+
+"""
+import argparse
+import ConfigParser
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib2
+
+from stats import Stats
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+SERVER_COMMAND = ("node", "app.js")
+HUB_COMMAND = ("node", "server/hub.js")
+SERVER_ENV = os.environ.copy()
+SERVER_ENV.update({"NO_LOCAL_CONFIG": "true",
+                   "NODE_ENV": "test",
+                   "SESSION_SECRET": "unguessable"})
+
+DEFAULT_TEST = 'test_talkilla.TestTalkilla.test_call'
+STARTUP_TIMEOUT = 10
+
+
+def free_port():
+    """Returns a TCP port nobody is listening on right now."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class LocalServer(object):
+    """A Talkilla server running as a child process.
+
+    Can be used as a context manager; the server is stopped when the
+    block exits, even if the load test blew up.
+    """
+
+    command = SERVER_COMMAND
+    # environment variable the port is given in
+    port_variable = "PORT"
+
+    def __init__(self, port=None, log=None, env=None):
+        self.port = port or free_port()
+        self.log = log
+        self.env = env or {}
+        self.process = None
+
+    @property
+    def host(self):
+        return 'localhost:%d' % self.port
+
+    @property
+    def root(self):
+        return 'http://%s/' % self.host
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        env = SERVER_ENV.copy()
+        env.update(self.env)
+        env[self.port_variable] = str(self.port)
+        self.process = subprocess.Popen(self.command, cwd=ROOT, env=env,
+                                        stdout=self.log, stderr=self.log)
+        self.wait_until_ready(timeout)
+        return self
+
+    def wait_until_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Server exited with status %d" %
+                                   self.process.returncode)
+            if self.is_ready():
+                return
+            time.sleep(.1)
+        self.stop()
+        raise RuntimeError("Server not ready after %ds" % timeout)
+
+    def is_ready(self):
+        try:
+            urllib2.urlopen(self.root + 'config.js', timeout=1).read()
+            return True
+        except (urllib2.URLError, socket.error):
+            return False
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.kill(self.process.pid, signal.SIGTERM)
+        self.process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class LocalHub(LocalServer):
+    """A presence hub (see server/hub.js) running as a child process, for
+    local servers using the "network" presence backend."""
+
+    command = HUB_COMMAND
+    port_variable = "HUB_PORT"
+
+    @property
+    def host(self):
+        return '127.0.0.1:%d' % self.port
+
+    def is_ready(self):
+        try:
+            socket.create_connection(('127.0.0.1', self.port), 1).close()
+            return True
+        except socket.error:
+            return False
+
+
+def read_defaults(path=os.path.join(HERE, 'talkilla.ini')):
+    """Reads the default users/duration from the loads configuration."""
+    config = ConfigParser.ConfigParser()
+    config.read(path)
+    defaults = {'users': '1', 'duration': None}
+    for option in defaults:
+        if config.has_option('loads', option):
+            defaults[option] = config.get('loads', option)
+    return defaults
+
+
+def loads_runner():
+    local = os.path.join(HERE, 'bin', 'loads-runner')
+    if os.path.exists(local):
+        return local
+    return 'loads-runner'
+
+
+def run(server, test, users, duration=None, hits=None, report=None):
+    """Runs loads-runner against `server` and returns its exit status.
+
+    When `report` is given, the per-endpoint stats of the run are written
+    there as JSON.
+    """
+    cmd = [loads_runner(), test, '-u', str(users)]
+    if duration:
+        cmd += ['-d', str(duration)]
+    elif hits:
+        cmd += ['-n', str(hits)]
+
+    fd, stats_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    env = os.environ.copy()
+    env['AWS_SERVER'] = server.host
+    env['TALKILLA_STATS'] = stats_file
+    try:
+        status = subprocess.call(cmd, cwd=HERE, env=env)
+        if os.path.getsize(stats_file):
+            stats = Stats.load(stats_file)
+            print(stats.format_table())
+            if report:
+                stats.dump(report)
+    finally:
+        os.remove(stats_file)
+    return status
+
+
+def main(args=sys.argv[1:]):
+    defaults = read_defaults()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('test', nargs='?', default=DEFAULT_TEST,
+                        help='test to run (default: %(default)s)')
+    parser.add_argument('-u', '--users', default=defaults['users'],
+                        help='concurrent users, or cycles like 10:20:30 '
+                             '(default: %(default)s)')
+    parser.add_argument('-d', '--duration', default=defaults['duration'],
+                        help='duration of each cycle in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-n', '--hits', default=None,
+                        help='number of hits per user, when no duration '
+                             'is given')
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help='port for the local server (default: random)')
+    parser.add_argument('--report', default=None,
+                        help='write the latency report as JSON to this file')
+    parser.add_argument('--server-log', default=os.devnull,
+                        help='where to write the server output '
+                             '(default: %(default)s)')
+    options = parser.parse_args(args)
+
+    with open(options.server_log, 'a') as log:
+        with LocalServer(options.port, log=log) as server:
+            print("Talkilla running on %s" % server.root)
+            return run(server, options.test, options.users,
+                       duration=options.duration, hits=options.hits,
+                       report=options.report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures what logging costs the signaling during call setup.
+
+Runs the same ICE candidate heavy load against a new local server for
+each logging mode, and reports the /icecandidate throughput and latency,
+the time candidates took to get to the peer, the CPU time the server
+used and how many lines it logged::
+
+    $ bin/python logcost.py --callers 20 --candidates 50
+
+The modes are:
+
+- off: only errors are logged;
+- sync: every record is written as it comes, like before log records
+  were buffered;
+- buffered: the production settings, with records written in batches and
+  ICE candidates sampled.
+
+The server logs to a temporary file. Its usage is read from /proc, so
+this only runs on Linux.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import sys
+import tempfile
+
+import driver
+from local import LocalServer
+from stats import format_ms
+from transports import Sampler
+
+
+MODES = (
+    ('off', {'LOG_LEVEL': 'error'}),
+    ('sync', {'LOG_LEVEL': 'info',
+              'LOG_FLUSH_INTERVAL': '0',
+              'LOG_RATE_LIMIT': '0',
+              'LOG_SAMPLING': '{}'}),
+    ('buffered', {'LOG_LEVEL': 'info',
+                  'LOG_FLUSH_INTERVAL': '100',
+                  'LOG_RATE_LIMIT': '1000',
+                  'LOG_SAMPLING': '{"ice:candidate": 100}'}),
+)
+
+
+def measure(env, callers, idle, duration, rate, candidates, burst):
+    """Runs the load against a new local server with the logging options
+    in `env`.
+
+    Returns the `stats.Stats` of the users, the `Sampler` of the server
+    and the number of lines it logged.
+    """
+    with tempfile.TemporaryFile() as log:
+        with LocalServer(log=log, env=env) as server:
+            sampler = Sampler(server.process.pid).start()
+            try:
+                stats, = driver.run(server.root, [(callers, idle)],
+                                    duration=duration, rate=rate,
+                                    candidates=candidates, burst=burst)
+            finally:
+                sampler.stop()
+        log.seek(0)
+        lines = sum(1 for line in log)
+    return stats, sampler, lines
+
+
+def _rps(stats, name):
+    return stats.rps(name) if name in stats.endpoints else 0.
+
+
+def format_results(results):
+    lines = ['%-10s %14s %22s %16s %10s %10s' % (
+        'logging', 'icecandidate/s', 'icecandidate p50/95/99',
+        'ice:delivery p95', 'server CPU', 'log lines')]
+    for mode, stats, sampler, logged in results:
+        latency = '/'.join(format_ms(stats.percentile('icecandidate', pct))
+                           for pct in (50, 95, 99))
+        lines.append('%-10s %14.1f %22s %16s %9.1f%% %10d' % (
+            mode, _rps(stats, 'icecandidate'), latency,
+            format_ms(stats.percentile('ice:delivery', 95)),
+            sampler.cpu_percent, logged))
+    return '\n'.join(lines)
+
+
+def to_json(results):
+    return json.dumps([{'logging': mode,
+                        'server': {'cpu': sampler.cpu,
+                                   'elapsed': sampler.elapsed,
+                                   'lines': logged},
+                        'stats': stats.to_dict()}
+                       for mode, stats, sampler, logged in results],
+                      indent=2, sort_keys=True)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-m', '--mode', action='append',
+                        choices=[name for name, env in MODES],
+                        help='logging mode to run with, can be repeated '
+                             '(default: all of them)')
+    parser.add_argument('-i', '--idle', type=int, default=100,
+                        help='users parked waiting for events '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--callers', type=int, default=20,
+                        help='pairs of users calling each other '
+                             '(default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=int, default=60,
+                        help='duration of each run in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=int, default=500,
+                        help='users started per second '
+                             '(default: %(default)s)')
+    parser.add_argument('--candidates', type=int, default=50,
+                        help='ICE candidates each peer sends during a call '
+                             '(default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=driver.ICE_BURST,
+                        help='ICE candidates posted at the same time '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write the results as JSON to this file')
+    options = parser.parse_args(args)
+
+    driver.raise_fd_limit()
+
+    results = []
+    for mode, env in MODES:
+        if options.mode and mode not in options.mode:
+            continue
+        print("Running with logging %s" % mode)
+        stats, sampler, logged = measure(env, options.callers,
+                                         options.idle, options.duration,
+                                         options.rate, options.candidates,
+                                         options.burst)
+        results.append((mode, stats, sampler, logged))
+
+    print('')
+    print(format_results(results))
+    if options.report:
+        with open(options.report, 'w') as f:
+            f.write(to_json(results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
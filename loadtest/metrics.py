@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Scrapes the /metrics api of Talkilla servers during a run.
+
+The server only has it with the METRICS setting, which the local servers
+started by the load tests have (they use config/test.json). Samples are
+kept as a time series in the `metrics` of `stats.Stats`, and summarized
+at the end of its table.
+"""
+import httplib
+import json
+import socket
+import time
+import urlparse
+
+import gevent
+
+
+# Seconds between two scrapes.
+INTERVAL = 1
+
+
+def sample(node, report):
+    """Returns the part of a /metrics `report` kept in the time series,
+    with the `node` it comes from and the local time it was taken at."""
+    return {'node': node,
+            'time': time.time(),
+            'users': report['users']['connected'],
+            'remote': report['users']['remote'],
+            'anons': report['users']['anons'],
+            'pushed': report['users']['pushed'],
+            'waiters': report['waiters'],
+            'events': report['queues']['events'],
+            'maxDepth': report['queues']['maxDepth'],
+            'depths': report['queues']['depths'],
+            'dropped': report['queues']['dropped'],
+            'lag': report['eventLoop']['lag'],
+            'maxLag': report['eventLoop']['maxLag'],
+            'heapUsed': report['memory']['heapUsed'],
+            'rss': report['memory']['rss']}
+
+
+class Scraper(object):
+    """Polls the /metrics api of the server at `root` every `interval`
+    seconds, in a greenlet, until `stop` is called.
+
+    A server without the api (a 404) isn't polled again; one which
+    doesn't answer is just tried again later.
+    """
+
+    def __init__(self, root, interval=INTERVAL):
+        url = urlparse.urlparse(root)
+        self.node = url.netloc
+        self.host, self.port = url.hostname, url.port or 80
+        self.interval = interval
+        self.samples = []
+        self.greenlet = None
+
+    def scrape(self):
+        """Returns the current report of the server, or None if it doesn't
+        have the metrics api."""
+        conn = httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.interval * 5)
+        try:
+            conn.request('GET', '/metrics')
+            res = conn.getresponse()
+            content = res.read()
+        finally:
+            conn.close()
+        if res.status == 404:
+            return None
+        return json.loads(content)
+
+    def _run(self):
+        while True:
+            try:
+                report = self.scrape()
+            except (httplib.HTTPException, socket.error, ValueError):
+                report = {}
+            if report is None:
+                print("No metrics api on %s, see the METRICS setting" %
+                      self.node)
+                return
+            if report:
+                self.samples.append(sample(self.node, report))
+            gevent.sleep(self.interval)
+
+    def start(self):
+        self.greenlet = gevent.spawn(self._run)
+        return self
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+        return self.samples
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Runs the load against several Talkilla nodes sharing their users.
+
+Starts a presence hub and local servers using the "network" presence
+backend, then the virtual users of driver.py, spread over the nodes. The
+two peers of every call are on different nodes, so their offers, answers,
+hangups and ICE candidates all go through the hub::
+
+    $ bin/python multinode.py --nodes 3 --idle 3000 --callers 30
+
+Once the load is running, a checker user signs in on each node and asks
+for the list of users, which should have all the users of all the nodes.
+The run fails if calls failed or if a node didn't list all the users.
+
+The /metrics api of every node is scraped during the run, see driver.py.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import contextlib
+import sys
+import uuid
+
+import gevent
+
+import driver
+import metrics
+from local import LocalHub, LocalServer
+from scenario import MAX_POLLS
+
+
+# How long the users get to sign in, on top of the time it takes to start
+# them, before we check the lists of users, in seconds.
+SETTLE_TIME = 5
+
+
+@contextlib.contextmanager
+def local_nodes(count, env=None):
+    """Starts a hub and `count` servers sharing it, and yields their
+    urls."""
+    with LocalHub() as hub:
+        nodes = []
+        try:
+            for i in range(count):
+                node_env = dict(env or {}, PRESENCE_BACKEND='network',
+                                PRESENCE_HUB=hub.host)
+                nodes.append(LocalServer(env=node_env).start())
+            yield [node.root for node in nodes]
+        finally:
+            for node in nodes:
+                node.stop()
+
+
+def listed_users(users, nick, polls=MAX_POLLS):
+    """Returns how many users the list sent to `nick` has, or None if it
+    didn't get it."""
+    res = users._post_json(nick, 'presenceRequest', {'nick': nick})
+    users.assertEqual(res.status_code, 204)
+    for i in range(polls):
+        for event in users._stream(nick):
+            if event['topic'] == 'users':
+                return len(event['data'])
+    return None
+
+
+def check_presence(users, expected):
+    """Signs a checker user in on each node in turn and compares the
+    number of users they see with `expected` (not counting them).
+
+    Returns the list of `(node, listed)` which didn't match.
+    """
+    failures = []
+    for index, (host, port) in enumerate(users.nodes):
+        nick = 'checker-%d-%s' % (index, uuid.uuid4())
+        users.place(nick, index)
+        users._signin(nick)
+        try:
+            listed = listed_users(users, nick)
+        finally:
+            users._signout(nick)
+            users.forget(nick)
+        node = '%s:%d' % (host, port)
+        print("%s lists %s users out of %d" % (node, listed, expected))
+        if listed is None or listed - 1 != expected:
+            failures.append((node, listed))
+        # let the other nodes know the checker left
+        gevent.sleep(.5)
+    return failures
+
+
+def run(roots, callers, idle, duration, rate=500, candidates=0,
+        burst=driver.ICE_BURST, transport='stream'):
+    """Runs the load against the nodes at `roots`, and checks their lists
+    of users once all the users are in.
+
+    Returns the `stats.Stats` of the run and the presence failures.
+    """
+    load = driver.Load(roots, rate, candidates, burst, transport)
+    ramp_up = (callers * 2 + idle) / max(rate, 1) + SETTLE_TIME
+    try:
+        load.step(callers, idle, ramp_up)
+        failures = check_presence(load.users, callers * 2 + idle)
+        stats = load.step(callers, idle, duration)
+        return stats, failures
+    finally:
+        load.close()
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--nodes', type=int, default=2,
+                        help='number of local servers (default: '
+                             '%(default)s)')
+    parser.add_argument('-i', '--idle', type=int, default=1000,
+                        help='users parked waiting for events '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--callers', type=int, default=10,
+                        help='pairs of users calling each other '
+                             '(default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=int, default=60,
+                        help='duration of the run in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=int, default=500,
+                        help='users started per second '
+                             '(default: %(default)s)')
+    parser.add_argument('--candidates', type=int, default=0,
+                        help='ICE candidates each peer sends during a call '
+                             '(default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=driver.ICE_BURST,
+                        help='ICE candidates posted at the same time '
+                             '(default: %(default)s)')
+    parser.add_argument('-t', '--transport', choices=driver.TRANSPORTS,
+                        default='stream',
+                        help='how users get their events '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write the latency report as JSON to this file')
+    options = parser.parse_args(args)
+
+    limit = driver.raise_fd_limit()
+    if limit < options.idle + options.callers * 4:
+        print("Warning: only %d file descriptors available" % limit)
+
+    with local_nodes(options.nodes) as roots:
+        print("Talkilla running on %s" % ', '.join(roots))
+        scrapers = [metrics.Scraper(root).start() for root in roots]
+        try:
+            stats, failures = run(roots, options.callers, options.idle,
+                                  options.duration, options.rate,
+                                  options.candidates, options.burst,
+                                  options.transport)
+        finally:
+            for scraper in scrapers:
+                scraper.stop()
+        stats.metrics = sorted(
+            sum([scraper.samples for scraper in scrapers], []),
+            key=lambda sample: sample['time'])
+
+    print('')
+    print(stats.format_table())
+    if options.report:
+        stats.dump(options.report)
+
+    call = stats.endpoints.get('call')
+    if call is None or call.errors:
+        print("\nCalls between nodes failed")
+        return 1
+    if failures:
+        print("\n%d nodes didn't list all the users" % len(failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
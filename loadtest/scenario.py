@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Signaling steps shared by the load test and the load drivers."""
+import json
+import os
+import time
+
+import gevent
+
+
+# How many /stream responses we go through while looking for an event,
+# as they may also carry unrelated presence notifications.
+MAX_POLLS = 5
+
+# ICE candidates each peer sends during a call setup, and how many of
+# them are posted at the same time.
+ICE_CANDIDATES = int(os.environ.get('TALKILLA_ICE_CANDIDATES', 20))
+ICE_BURST = int(os.environ.get('TALKILLA_ICE_BURST', 5))
+
+SESSION_COOKIE = 'talkilla-session'
+
+
+class TalkillaScenario(object):
+    """Mixin providing the steps of a Talkilla session.
+
+    Every step takes the nick of the user it runs as, as the server
+    identifies users by their session cookie. Classes using it provide:
+
+    - `root`, the url of the server;
+    - `stats`, a `stats.Stats` instance requests are recorded in;
+    - `_post(nick, url, body, headers)`, sending a request with the
+      session of `nick` and returning a requests-like response;
+    - `assertEqual` and `assertTrue`.
+    """
+
+    def _post_json(self, nick, url, data):
+        headers = {'Content-type': 'application/json'}
+        start = time.time()
+        try:
+            res = self._post(nick, self.root + url, json.dumps(data),
+                             headers)
+        except Exception:
+            self.stats.record(url, (time.time() - start) * 1000,
+                              error=True)
+            raise
+        self.stats.record(url, (time.time() - start) * 1000,
+                          error=res.status_code >= 400)
+        return res
+
+    def _signin(self, nick):
+        # fake persona assertion for now
+        data = {'assertion': nick}
+        res = self._post_json(nick, 'signin', data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['nick'], nick)
+
+        # like the sidebar, open the stream first so that the server knows
+        # about us, then ask for the presence list and collect it.
+        self._stream(nick, first=True)
+        data = {'nick': nick}
+        res = self._post_json(nick, 'presenceRequest', data)
+        self.assertEqual(res.status_code, 204)
+        self._stream(nick)
+
+    def _signout(self, nick):
+        data = {'nick': nick}
+        res = self._post_json(nick, 'signout', data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.json(), True)
+
+    def _stream(self, nick, first=False):
+        data = {'nick': nick}
+        if first:
+            data['firstRequest'] = True
+        res = self._post_json(nick, 'stream', data)
+        self.assertEqual(res.status_code, 200)
+        return res.json()
+
+    def _find_event(self, res, topic, peer):
+        for line in res:
+            if line['topic'] == topic and line['data']['peer'] == peer:
+                return True
+        return False
+
+    def _wait_for_event(self, nick, topic, peer, polls=MAX_POLLS):
+        for i in range(polls):
+            if self._find_event(self._stream(nick), topic, peer):
+                return True
+        return False
+
+    def _send(self, nick, url, peer):
+        data = {'nick': nick, 'data': {'peer': peer}}
+        res = self._post_json(nick, url, data)
+        self.assertEqual(res.status_code, 204)
+
+    def _call(self, caller, callee):
+        """Runs a whole call between two signed in users."""
+        # sending a call
+        self._send(caller, 'calloffer', callee)
+
+        # callee accepts the call
+        self.assertTrue(self._wait_for_event(callee, 'offer', caller))
+        self._send(callee, 'callaccepted', caller)
+
+        # caller gets the ack
+        self.assertTrue(self._wait_for_event(caller, 'answer', callee))
+
+        # >>>> webrtc goodness here <<<<
+
+        # caller hangs up
+        self._send(caller, 'callhangup', callee)
+
+        # callee gets the ack
+        self.assertTrue(self._wait_for_event(callee, 'hangup', caller))
+
+    def _send_candidates(self, nick, peer, count, burst):
+        """Posts `count` ICE candidates to `peer`, `burst` at a time."""
+        def send(seq):
+            candidate = {
+                'candidate': 'candidate:%d 1 UDP 2130706431 10.0.%d.%d %d '
+                             'typ host' % (seq, seq // 254, seq % 254 + 1,
+                                           50000 + seq),
+                'sdpMid': 'sdparta_0',
+                'sdpMLineIndex': 0
+            }
+            # `sent` goes through the server untouched, we use it to
+            # measure the delivery latency.
+            data = {'peer': peer, 'candidate': candidate, 'seq': seq,
+                    'sent': time.time()}
+            res = self._post_json(nick, 'icecandidate',
+                                  {'nick': nick, 'data': data})
+            self.assertEqual(res.status_code, 204)
+
+        for first in range(0, count, burst):
+            jobs = [gevent.spawn(send, seq)
+                    for seq in range(first, min(first + burst, count))]
+            gevent.joinall(jobs, raise_error=True)
+
+    def _receive_candidates(self, nick, peer, count):
+        """Reads the stream of `nick` until it got `count` ICE candidates
+        from `peer`, recording how long each one took to get there.
+
+        Returns the number of /stream requests it took.
+        """
+        received = set()
+        for polls in range(1, count + MAX_POLLS + 1):
+            for event in self._stream(nick):
+                if event['topic'] != 'ice:candidate' or \
+                        event['data']['peer'] != peer:
+                    continue
+                latency = (time.time() - event['data']['sent']) * 1000
+                self.stats.measure('ice:delivery', latency)
+                received.add(event['data']['seq'])
+            if len(received) == count:
+                return polls
+        raise AssertionError('%s got %d out of %d candidates from %s' % (
+            nick, len(received), count, peer))
+
+    def _call_with_candidates(self, caller, callee, count=ICE_CANDIDATES,
+                              burst=ICE_BURST):
+        """Runs a call where both peers exchange `count` ICE candidates
+        right after the offer and answer, like browsers do."""
+        self._send(caller, 'calloffer', callee)
+        self.assertTrue(self._wait_for_event(callee, 'offer', caller))
+        self._send(callee, 'callaccepted', caller)
+        self.assertTrue(self._wait_for_event(caller, 'answer', callee))
+
+        jobs = [gevent.spawn(self._send_candidates, caller, callee, count,
+                             burst),
+                gevent.spawn(self._send_candidates, callee, caller, count,
+                             burst),
+                gevent.spawn(self._receive_candidates, callee, caller, count),
+                gevent.spawn(self._receive_candidates, caller, callee, count)]
+        try:
+            gevent.joinall(jobs, raise_error=True)
+        finally:
+            gevent.killall(jobs)
+        # with events coalescing on the server, this should be about one
+        # poll per burst for each peer.
+        self.stats.observe('ice:polls', jobs[2].value + jobs[3].value)
+
+        self._send(caller, 'callhangup', callee)
+        self.assertTrue(self._wait_for_event(callee, 'hangup', caller))
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Latency and throughput accounting for the load tests.
+
+Latencies are kept in histograms rather than as raw samples, so a long
+run doesn't grow memory and reports from several runs (or processes) can
+be merged.
+"""
+import json
+import sys
+import time
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def _bucket(ms):
+    # three significant digits is plenty for latencies and keeps the
+    # number of buckets small.
+    return float('%.3g' % ms)
+
+
+class Histogram(object):
+    def __init__(self, buckets=None):
+        self.buckets = dict(buckets or {})
+
+    def add(self, ms):
+        bucket = _bucket(ms)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, pct):
+        total = self.count
+        if not total:
+            return None
+        threshold = total * pct / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= threshold:
+                return bucket
+        return bucket
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        return self
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self.histogram = Histogram()
+
+    def record(self, ms, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.histogram.add(ms)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct):
+        value = self.histogram.percentile(pct)
+        if value is None:
+            return None
+        # buckets are rounded, don't report more than what we've seen.
+        return min(max(value, self.min), self.max)
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        for attr, pick in (('min', min), ('max', max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if theirs is not None:
+                setattr(self, attr,
+                        theirs if mine is None else pick(mine, theirs))
+        self.histogram.merge(other.histogram)
+        return self
+
+    def to_dict(self):
+        data = {'count': self.count,
+                'errors': self.errors,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.mean,
+                'histogram': [[bucket, count] for bucket, count in
+                              sorted(self.histogram.buckets.items())]}
+        for pct in PERCENTILES:
+            data['p%d' % pct] = self.percentile(pct)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data['count']
+        stats.errors = data['errors']
+        stats.total = data['total']
+        stats.min = data['min']
+        stats.max = data['max']
+        stats.histogram = Histogram(
+            (bucket, count) for bucket, count in data['histogram'])
+        return stats
+
+
+class Stats(object):
+    """Per-endpoint latencies and overall throughput of a run.
+
+    Call `record` with the endpoint name and the time it took, in
+    milliseconds. Throughput is computed over the time between the first
+    and the last recorded request.
+
+    Timings that are not requests (e.g. how long a whole call took) are
+    recorded with `measure`; they are reported like endpoints but don't
+    count in the overall throughput. Other quantities, like a number of
+    requests, are recorded with `observe`.
+
+    `metrics` is the time series of the samples of the server metrics
+    taken during the run, if any (see metrics.py).
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.measures = set()
+        self.values = {}
+        self.metrics = []
+        self.first = None
+        self.last = None
+
+    def record(self, endpoint, ms, error=False):
+        now = time.time()
+        if self.first is None:
+            self.first = now - ms / 1000.
+        self.last = now
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        self.endpoints[endpoint].record(ms, error)
+
+    def measure(self, name, ms, error=False):
+        self.measures.add(name)
+        self.record(name, ms, error)
+
+    def percentile(self, name, pct):
+        """Returns the `pct` percentile of the endpoint or measure `name`,
+        or None if it wasn't recorded."""
+        endpoint = self.endpoints.get(name)
+        if endpoint is None:
+            return None
+        return endpoint.percentile(pct)
+
+    def observe(self, name, value):
+        if name not in self.values:
+            self.values[name] = EndpointStats()
+        self.values[name].record(value)
+
+    @property
+    def elapsed(self):
+        if self.first is None:
+            return 0.
+        return self.last - self.first
+
+    def rps(self, endpoint=None):
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.
+        if endpoint is None:
+            count = sum(e.count for name, e in self.endpoints.items()
+                        if name not in self.measures)
+        else:
+            count = self.endpoints[endpoint].count
+        return count / elapsed
+
+    def merge(self, other):
+        for name, endpoint in other.endpoints.items():
+            if name not in self.endpoints:
+                self.endpoints[name] = EndpointStats()
+            self.endpoints[name].merge(endpoint)
+        self.measures.update(other.measures)
+        for name, value in other.values.items():
+            if name not in self.values:
+                self.values[name] = EndpointStats()
+            self.values[name].merge(value)
+        self.metrics = sorted(self.metrics + other.metrics,
+                              key=lambda sample: sample['time'])
+        if other.first is not None:
+            self.first = other.first if self.first is None else \
+                min(self.first, other.first)
+            self.last = other.last if self.last is None else \
+                max(self.last, other.last)
+        return self
+
+    def to_dict(self):
+        endpoints = {}
+        for name, endpoint in self.endpoints.items():
+            endpoints[name] = endpoint.to_dict()
+            endpoints[name]['rps'] = self.rps(name)
+        return {'first': self.first,
+                'last': self.last,
+                'elapsed': self.elapsed,
+                'rps': self.rps(),
+                'endpoints': endpoints,
+                'measures': sorted(self.measures),
+                'values': dict((name, value.to_dict())
+                               for name, value in self.values.items()),
+                'metrics': self.metrics}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.first = data['first']
+        stats.last = data['last']
+        stats.measures = set(data.get('measures', []))
+        stats.metrics = data.get('metrics', [])
+        for name, value in data.get('values', {}).items():
+            stats.values[name] = EndpointStats.from_dict(value)
+        for name, endpoint in data['endpoints'].items():
+            stats.endpoints[name] = EndpointStats.from_dict(endpoint)
+        return stats
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data))
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json(indent=2, sort_keys=True))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_json(f.read())
+
+    def format_table(self):
+        """Returns the stats as a human readable table (times in ms)."""
+        header = ('endpoint', 'count', 'errors', 'rps', 'mean', 'p50',
+                  'p95', 'p99', 'max')
+        rows = [header]
+        for name in sorted(self.endpoints):
+            endpoint = self.endpoints[name]
+            rows.append([name, str(endpoint.count), str(endpoint.errors),
+                         '%.1f' % self.rps(name)] + _summary(endpoint))
+        lines = _format_rows(rows)
+
+        if self.values:
+            lines.append('')
+            rows = [('value', 'count', 'mean', 'p50', 'p95', 'p99', 'max')]
+            for name in sorted(self.values):
+                value = self.values[name]
+                rows.append([name, str(value.count)] + _summary(value))
+            lines += _format_rows(rows)
+
+        if self.metrics:
+            lines.append('')
+            lines += _format_rows(_metrics_rows(self.metrics))
+
+        lines.append('')
+        lines.append('%.1f requests/s over %.1fs' % (self.rps(),
+                                                     self.elapsed))
+        return '\n'.join(lines)
+
+
+def format_ms(ms):
+    """Formats a time in ms, or a missing one (None) as '-'."""
+    return '-' if ms is None else '%.1f' % ms
+
+
+def _summary(stats):
+    values = [stats.mean] + [stats.percentile(p) for p in PERCENTILES] + \
+        [stats.max]
+    return [format_ms(v) for v in values]
+
+
+def _metrics_rows(samples):
+    # peak values of the server metrics, per node
+    rows = [('server', 'samples', 'users', 'waiters', 'queued', 'depth',
+             'lag', 'heap MB')]
+    for node in sorted(set(sample['node'] for sample in samples)):
+        mine = [sample for sample in samples if sample['node'] == node]
+
+        def peak(key):
+            return max(sample[key] for sample in mine)
+
+        rows.append([node, str(len(mine)), str(peak('users')),
+                     str(peak('waiters')), str(peak('events')),
+                     str(peak('maxDepth')), str(peak('maxLag')),
+                     '%.1f' % (peak('heapUsed') / 1024. / 1024.)])
+    return rows
+
+
+def _format_rows(rows):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width)
+                  for cell, width in zip(row[1:], widths[1:])]
+        lines.append('  '.join(cells))
+    lines.insert(1, '-' * len(lines[0]))
+    return lines
+
+
+if __name__ == '__main__':
+    # Prints the tables of previously saved JSON reports, e.g. to compare
+    # two runs.
+    for path in sys.argv[1:]:
+        print(path)
+        print(Stats.load(path).format_table())
+        print('')
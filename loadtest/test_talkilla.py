@@ -1,45 +1,43 @@
-import gevent
-import random
+import atexit
 import os
-import time
-import json
 import uuid
 
 from loads.case import TestCase
+from scenario import SESSION_COOKIE, TalkillaScenario
+from stats import Stats
 
 from gevent import monkey
 monkey.patch_all(httplib=True)
 DEFAULT = 'ec2-54-237-86-107.compute-1.amazonaws.com'
 
+# Latencies of every request made by the tests of this process. When
+# TALKILLA_STATS is set, they are written there as JSON on exit.
+stats = Stats()
 
-class TestTalkilla(TestCase):
+
+@atexit.register
+def _dump_stats():
+    path = os.environ.get('TALKILLA_STATS')
+    if path:
+        stats.dump(path)
+
+
+class TestTalkilla(TalkillaScenario, TestCase):
 
     root = 'http://%s/' % os.environ.get('AWS_SERVER', DEFAULT)
+    stats = stats
+
+    def setUp(self):
+        super(TestTalkilla, self).setUp()
+        # session cookie of each signed in user
+        self._cookies = {}
 
-    def _signin(self, nick):
-        # fake persona assertion for now
-        data = {'assertion': nick}
-        res = self._post_json('signin', data)
-        self.assertEqual(res.status_code, 200)
-        self.assertEqual(res.json()['nick'], nick)
-
-        # we want to call presenceRequest & stream once
-        data = {'nick': nick}
-        res = self._post_json('presenceRequest', data)
-        self.assertEqual(res.status_code, 204)
-        self._stream(nick)
-
-    def _signout(self, nick):
-        data = {'nick': nick}
-        res = self._post_json('signout', data)
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(res.json(), True)
-
-    def _stream(self, nick):
-        data = {'nick': nick}
-        res = self._post_json('stream', data)
-        self.assertEqual(res.status_code, 200)
-        return res.json()
+    def _post(self, nick, url, body, headers):
+        res = self.session.post(url, data=body, headers=headers,
+                                cookies=self._cookies.get(nick))
+        if SESSION_COOKIE in res.cookies:
+            self._cookies[nick] = {SESSION_COOKIE: res.cookies[SESSION_COOKIE]}
+        return res
 
     def test_simple_signin(self):
         # signing in
@@ -53,17 +51,6 @@ class TestTalkilla(TestCase):
         # bye !
         self._signout('user1')
 
-    def _post_json(self, url, data):
-        headers = {'Content-type': 'application/json'}
-        return self.session.post(self.root + url, data=json.dumps(data),
-                                 headers=headers)
-
-    def _find_event(self, res, topic, peer):
-        for line in res:
-            if line['topic'] == topic and line['data']['peer'] == peer:
-                return True
-        return False
-
     def test_call(self):
         user1 = str(uuid.uuid4())
         user2 = str(uuid.uuid4())
@@ -72,34 +59,20 @@ class TestTalkilla(TestCase):
         self._signin(user1)
         self._signin(user2)
 
-        # sending a call
-        data = {'nick': user1, 'data': {'peer': user2}}
-        res = self._post_json('calloffer', data)
-        self.assertEqual(res.status_code, 204)
-
-        # user2 accepts the call
-        res = self._stream(user2)
-        self.assertTrue(self._find_event(res, 'offer', user1))
-
-        data = {'nick': user2, 'data': {'peer': user1}}
-        res = self._post_json('callaccepted', data)
-        self.assertEqual(res.status_code, 204)
+        self._call(user1, user2)
 
-        # user1 gets the ack
-        res = self._stream(user1)
-        self.assertTrue(self._find_event(res, 'answer', user2))
+        # bye !
+        self._signout(user1)
+        self._signout(user2)
 
-        # >>>> webrtc goodness here <<<<
+    def test_ice_storm(self):
+        user1 = str(uuid.uuid4())
+        user2 = str(uuid.uuid4())
 
-        # user1 hang up
-        data = {'nick': user1, 'data': {'peer': user2}}
-        res = self._post_json('callhangup', data)
-        self.assertEqual(res.status_code, 204)
+        self._signin(user1)
+        self._signin(user2)
 
-        # user2 gets the ack
-        res = self._stream(user2)
-        self.assertTrue(self._find_event(res, 'hangup', user1))
+        self._call_with_candidates(user1, user2)
 
-        # bye !
         self._signout(user1)
         self._signout(user2)
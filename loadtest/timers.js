@@ -0,0 +1,75 @@
+/* jshint node:true */
+"use strict";
+
+/**
+ * Compares the cost of the timers of the long polling on the server: a
+ * timer wheel against one runtime timer per timer.
+ *
+ * For each number of users, every user holds a presence timer and then
+ * goes through a number of /stream requests, which each reset the
+ * presence timer and add and cancel a long polling timer. The heap is
+ * only accurate when the garbage collector is exposed:
+ *
+ *     $ node --expose-gc timers.js 1000 10000 50000
+ */
+var timers = require("../server/timers");
+
+var PRESENCE_TIMEOUT = 40000;
+var LONG_POLLING_TIMEOUT = 20000;
+var REQUESTS = 10;
+
+function noop() {}
+
+function measure(impl, users) {
+  var presence = [];
+  var start, elapsed, heap;
+  var i, j;
+
+  for (i = 0; i < users; i++)
+    presence.push(impl.add(PRESENCE_TIMEOUT, noop));
+
+  start = process.hrtime();
+  for (j = 0; j < REQUESTS; j++) {
+    for (i = 0; i < users; i++) {
+      impl.cancel(presence[i]);
+      presence[i] = impl.add(PRESENCE_TIMEOUT, noop);
+      impl.cancel(impl.add(LONG_POLLING_TIMEOUT, noop));
+    }
+  }
+  elapsed = process.hrtime(start);
+  if (global.gc)
+    global.gc();
+  heap = process.memoryUsage().heapUsed;
+
+  presence.forEach(impl.cancel, impl);
+  impl.clear();
+
+  return {
+    // per /stream request, in microseconds
+    request: (elapsed[0] * 1e9 + elapsed[1]) / (users * REQUESTS) / 1000,
+    heap: heap
+  };
+}
+
+function main(counts) {
+  var impls = {
+    native: new timers.NativeTimers(),
+    wheel: timers.create(250)
+  };
+
+  console.log("users\timpl\tus/request\theap (MB)");
+  counts.forEach(function(users) {
+    Object.keys(impls).forEach(function(name) {
+      var result = measure(impls[name], users);
+      console.log([
+        users,
+        name,
+        result.request.toFixed(3),
+        (result.heap / 1024 / 1024).toFixed(1)
+      ].join("\t"));
+    });
+  });
+}
+
+main(process.argv.length > 2 ?
+     process.argv.slice(2).map(Number) : [1000, 10000, 50000]);
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares long polling /stream with events pushed over /events.
+
+Runs the same load once with each transport, against a new local server
+each time, and reports the requests the users made, the CPU time and
+sockets the server used and how long events took to get to the users::
+
+    $ bin/python transports.py --idle 5000 --callers 20 --candidates 20
+
+The server usage is read from /proc, so this only runs on Linux.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import gevent
+
+import driver
+from local import LocalServer
+from stats import Stats, format_ms
+
+
+# How often the server usage is sampled, in seconds.
+SAMPLE_INTERVAL = 1
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def cpu_time(pid):
+    """Returns the CPU time used by the process so far, in seconds."""
+    with open('/proc/%d/stat' % pid) as f:
+        # the command name is in parentheses and may contain spaces
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime are the 14th and 15th fields of the whole line
+    return (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+
+
+def sockets(pid):
+    """Returns the number of sockets the process has open."""
+    fds = '/proc/%d/fd' % pid
+    count = 0
+    for fd in os.listdir(fds):
+        try:
+            if os.readlink(os.path.join(fds, fd)).startswith('socket:'):
+                count += 1
+        except OSError:
+            # closed while we were looking
+            pass
+    return count
+
+
+class Sampler(object):
+    """Samples the CPU time and sockets of a server process while the
+    load runs."""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.greenlet = None
+        self.cpu = 0.
+        self.elapsed = 0.
+        self.sockets = Stats()
+
+    def _sample(self):
+        while True:
+            gevent.sleep(self.interval)
+            self.sockets.observe('sockets', sockets(self.pid))
+
+    def start(self):
+        self._start_cpu = cpu_time(self.pid)
+        self._start = time.time()
+        self.greenlet = gevent.spawn(self._sample)
+        return self
+
+    def stop(self):
+        self.greenlet.kill()
+        self.cpu = cpu_time(self.pid) - self._start_cpu
+        self.elapsed = time.time() - self._start
+
+    @property
+    def cpu_percent(self):
+        if not self.elapsed:
+            return 0.
+        return self.cpu * 100 / self.elapsed
+
+    @property
+    def max_sockets(self):
+        values = self.sockets.values.get('sockets')
+        return values.max if values is not None else 0
+
+
+def measure(transport, callers, idle, duration, rate, candidates, burst):
+    """Runs the load with `transport` against a new local server.
+
+    Returns the `stats.Stats` of the users and the `Sampler` of the
+    server.
+    """
+    with LocalServer() as server:
+        sampler = Sampler(server.process.pid).start()
+        try:
+            stats, = driver.run(server.root, [(callers, idle)],
+                                duration=duration, rate=rate,
+                                candidates=candidates, burst=burst,
+                                transport=transport)
+        finally:
+            sampler.stop()
+    return stats, sampler
+
+
+def format_results(results):
+    lines = ['%-10s %10s %10s %8s %24s %10s' % (
+        'transport', 'requests/s', 'server CPU', 'sockets',
+        'ice:delivery p50/95/99', 'call p50')]
+    for transport, stats, sampler in results:
+        delivery = '/'.join(format_ms(stats.percentile('ice:delivery', pct))
+                            for pct in (50, 95, 99))
+        lines.append('%-10s %10.1f %9.1f%% %8d %24s %10s' % (
+            transport, stats.rps(), sampler.cpu_percent,
+            sampler.max_sockets, delivery,
+            format_ms(stats.percentile('call', 50))))
+    return '\n'.join(lines)
+
+
+def to_json(results):
+    return json.dumps([{'transport': transport,
+                        'server': {'cpu': sampler.cpu,
+                                   'elapsed': sampler.elapsed,
+                                   'sockets': sampler.max_sockets},
+                        'stats': stats.to_dict()}
+                       for transport, stats, sampler in results],
+                      indent=2, sort_keys=True)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-i', '--idle', type=int, default=1000,
+                        help='users parked waiting for events '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--callers', type=int, default=10,
+                        help='pairs of users calling each other '
+                             '(default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=int, default=60,
+                        help='duration of each run in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=int, default=500,
+                        help='users started per second '
+                             '(default: %(default)s)')
+    parser.add_argument('--candidates', type=int, default=20,
+                        help='ICE candidates each peer sends during a call '
+                             '(default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=driver.ICE_BURST,
+                        help='ICE candidates posted at the same time '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write the results as JSON to this file')
+    options = parser.parse_args(args)
+
+    limit = driver.raise_fd_limit()
+    if limit < options.idle + options.callers * 4:
+        print("Warning: only %d file descriptors available" % limit)
+
+    results = []
+    for transport in driver.TRANSPORTS:
+        print("Running with %s" % transport)
+        stats, sampler = measure(transport, options.callers, options.idle,
+                                 options.duration, options.rate,
+                                 options.candidates, options.burst)
+        results.append((transport, stats, sampler))
+
+    print('')
+    print(format_results(results))
+    if options.report:
+        with open(options.report, 'w') as f:
+            f.write(to_json(results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"use strict";
+var util = require("util");
+var cluster = require("cluster");
+var net = require("net");
+var os = require("os");
+var EventEmitter = require("events").EventEmitter;
+
+var config = require('./config').config;
+var logger = require('./logger');
+var readMessages = require('./hub').readMessages;
+
+/**
+ * Presence backends, i.e. how the nodes sharing their users talk to each
+ * other:
+ *
+ * - "memory": users are only kept in memory, by the node they are
+ *   connected to; the workers of a cluster talk to each other through the
+ *   master;
+ * - "network": nodes, possibly on different hosts, talk to each other
+ *   through a hub server (see hub.js) at config.PRESENCE_HUB.
+ */
+var BACKENDS = ["memory", "network"];
+
+// Delay before a node tries to connect to the hub again, in ms.
+var RECONNECT_DELAY = 1000;
+
+/**
+ * Message buses connect the Talkilla nodes (the workers of a cluster, or
+ * the servers sharing a hub) which share the users (see directory.js).
+ *
+ * A bus has the `id` of its node and:
+ *
+ * - `publish(message)` sends a message to all the other nodes;
+ * - `send(node, message)` sends a message to the given node only;
+ * - "message" events are emitted with the messages the node gets, and the
+ *   id of the node which sent them.
+ *
+ * Messages are JSON serializable objects, and those from a given node are
+ * received in the order they were sent.
+ */
+
+/**
+ * In-process hub, connecting buses of the same process: nodes can be
+ * tested together without forking workers.
+ */
+function LocalHub() {
+  this.buses = {};
+}
+
+/**
+ * Connect a new node to the hub.
+ *
+ * @param {String} id the id of the node
+ * @return {LocalBus}
+ */
+LocalHub.prototype.connect = function(id) {
+  var bus = new LocalBus(this, id);
+  this.buses[id] = bus;
+  return bus;
+};
+
+/**
+ * Disconnect a node from the hub, and tell the other ones it is gone,
+ * like the master of a cluster does when a worker dies.
+ *
+ * @param {String} id the id of the node
+ */
+LocalHub.prototype.disconnect = function(id) {
+  delete this.buses[id];
+  this._deliver(undefined, null, {type: "gone", node: id});
+};
+
+LocalHub.prototype._deliver = function(to, from, message) {
+  Object.keys(this.buses).forEach(function(id) {
+    if (id === String(from) || (to !== undefined && id !== String(to)))
+      return;
+
+    // Like over IPC, the message is a copy and it is delivered after the
+    // current tick.
+    var bus = this.buses[id];
+    var copy = JSON.parse(JSON.stringify(message));
+    process.nextTick(function() {
+      bus.emit("message", copy, from);
+    });
+  }, this);
+};
+
+function LocalBus(hub, id) {
+  this.hub = hub;
+  this.id = id;
+}
+
+util.inherits(LocalBus, EventEmitter);
+
+LocalBus.prototype.publish = function(message) {
+  this.hub._deliver(undefined, this.id, message);
+};
+
+LocalBus.prototype.send = function(node, message) {
+  this.hub._deliver(node, this.id, message);
+};
+
+/**
+ * Bus of a cluster worker: messages go through the IPC channel of the
+ * worker to the master, which relays them (see `relay`).
+ *
+ * @param {Object} channel the process, or a stand-in for tests
+ * @param {Number} id the id of the worker
+ */
+function ClusterBus(channel, id) {
+  this.channel = channel;
+  this.id = id;
+
+  channel.on("message", function(envelope) {
+    if (envelope && envelope.talkillaBus)
+      this.emit("message", envelope.message, envelope.from);
+  }.bind(this));
+}
+
+util.inherits(ClusterBus, EventEmitter);
+
+ClusterBus.prototype.publish = function(message) {
+  this.channel.send({talkillaBus: true, from: this.id, message: message});
+};
+
+ClusterBus.prototype.send = function(node, message) {
+  this.channel.send({talkillaBus: true, from: this.id, to: node,
+                     message: message});
+};
+
+/**
+ * Bus of a node connected to a hub (see hub.js) over TCP.
+ *
+ * Messages sent while the hub can't be reached are kept until it can;
+ * the node reconnects every RECONNECT_DELAY, and emits a `reconnect`
+ * event once it did, as the other nodes were told it was gone meanwhile.
+ *
+ * @param {String} address host:port of the hub
+ * @param {String} id the id of the node
+ */
+function NetworkBus(address, id) {
+  var parts = address.split(":");
+
+  this.host = parts[0];
+  this.port = parseInt(parts[1], 10);
+  this.id = id;
+  this.socket = undefined;
+  this.connected = false;
+  this._queue = [];
+  this._connections = 0;
+  this._closed = false;
+  this._connect();
+}
+
+util.inherits(NetworkBus, EventEmitter);
+
+NetworkBus.prototype._connect = function() {
+  var socket = this.socket = net.connect(this.port, this.host);
+
+  socket.setNoDelay(true);
+  readMessages(socket, function(envelope) {
+    this.emit("message", envelope.message, envelope.from);
+  }.bind(this));
+
+  socket.on("connect", function() {
+    this._write({register: this.id});
+    this.connected = true;
+    this._queue.splice(0).forEach(this._write, this);
+    if (this._connections++)
+      this.emit("reconnect");
+  }.bind(this));
+
+  socket.on("error", function(err) {
+    logger.error({err: err}, "presence hub connection error");
+  });
+
+  socket.on("close", function() {
+    this.connected = false;
+    if (!this._closed)
+      setTimeout(this._connect.bind(this), RECONNECT_DELAY);
+  }.bind(this));
+};
+
+NetworkBus.prototype._write = function(envelope) {
+  this.socket.write(JSON.stringify(envelope) + "\n");
+};
+
+NetworkBus.prototype._post = function(envelope) {
+  if (this.connected)
+    this._write(envelope);
+  else
+    this._queue.push(envelope);
+};
+
+NetworkBus.prototype.publish = function(message) {
+  this._post({from: this.id, message: message});
+};
+
+NetworkBus.prototype.send = function(node, message) {
+  this._post({from: this.id, to: node, message: message});
+};
+
+NetworkBus.prototype.close = function() {
+  this._closed = true;
+  this.socket.end();
+};
+
+/**
+ * Relay the messages of the workers of a cluster to each other, in the
+ * master. The other workers are told when one dies.
+ *
+ * @param {Object} master the cluster module, or a stand-in for tests
+ */
+function relay(master) {
+  function deliver(envelope) {
+    Object.keys(master.workers).forEach(function(id) {
+      var worker = master.workers[id];
+      if (worker.id === envelope.from ||
+          (envelope.to !== undefined && worker.id !== envelope.to))
+        return;
+      worker.send(envelope);
+    });
+  }
+
+  master.on("fork", function(worker) {
+    worker.on("message", function(envelope) {
+      if (envelope && envelope.talkillaBus)
+        deliver(envelope);
+    });
+  });
+
+  master.on("exit", function(worker) {
+    deliver({talkillaBus: true, from: null,
+             message: {type: "gone", node: worker.id}});
+  });
+}
+
+/**
+ * Get the bus of this process for the configured presence backend. With
+ * the "memory" one, cluster workers get one and a server running on its
+ * own doesn't need any.
+ *
+ * @return {NetworkBus|ClusterBus|undefined}
+ */
+function create() {
+  var backend = config.PRESENCE_BACKEND || "memory";
+
+  if (BACKENDS.indexOf(backend) === -1)
+    throw new Error("Unknown presence backend: " + backend);
+
+  if (backend === "network")
+    return new NetworkBus(config.PRESENCE_HUB,
+                          os.hostname() + "/" + process.pid);
+
+  if (cluster.isWorker)
+    return new ClusterBus(process, cluster.worker.id);
+}
+
+module.exports.LocalHub = LocalHub;
+module.exports.LocalBus = LocalBus;
+module.exports.ClusterBus = ClusterBus;
+module.exports.NetworkBus = NetworkBus;
+module.exports.relay = relay;
+module.exports.create = create;
@@ -45,6 +45,113 @@ function setupUrls(config) {
   return config;
 }
 
+/**
+ * Sets up the long polling options on a configuration object.
+ *
+ * The LONG_POLLING_COALESCING_WINDOW and TIMER_RESOLUTION environment
+ * variables override the ones from the config, which is handy to compare
+ * load test runs.
+ *
+ * @param  {Object} config The configuration object to modify
+ * @return {Object}
+ */
+function setupLongPolling(config) {
+  var coalescingWindow = process.env.LONG_POLLING_COALESCING_WINDOW;
+  var timerResolution = process.env.TIMER_RESOLUTION;
+
+  if (coalescingWindow !== undefined)
+    config.LONG_POLLING_COALESCING_WINDOW = parseInt(coalescingWindow, 10);
+
+  if (timerResolution !== undefined)
+    config.TIMER_RESOLUTION = parseInt(timerResolution, 10);
+
+  return config;
+}
+
+/**
+ * Sets up the cluster mode on a configuration object.
+ *
+ * The CLUSTER_WORKERS environment variable overrides the one from the
+ * config.
+ *
+ * @param  {Object} config The configuration object to modify
+ * @return {Object}
+ */
+function setupCluster(config) {
+  var workers = process.env.CLUSTER_WORKERS;
+
+  if (workers !== undefined)
+    config.CLUSTER_WORKERS = parseInt(workers, 10);
+
+  return config;
+}
+
+/**
+ * Sets up the presence backend on a configuration object.
+ *
+ * The PRESENCE_BACKEND and PRESENCE_HUB environment variables override
+ * the ones from the config, so that several local servers can share a
+ * hub.
+ *
+ * @param  {Object} config The configuration object to modify
+ * @return {Object}
+ */
+function setupPresence(config) {
+  if (process.env.PRESENCE_BACKEND)
+    config.PRESENCE_BACKEND = process.env.PRESENCE_BACKEND;
+
+  if (process.env.PRESENCE_HUB)
+    config.PRESENCE_HUB = process.env.PRESENCE_HUB;
+
+  return config;
+}
+
+/**
+ * Sets up the metrics api on a configuration object.
+ *
+ * The METRICS environment variable ("1" or "true" to enable it, anything
+ * else to disable it) overrides the one from the config.
+ *
+ * @param  {Object} config The configuration object to modify
+ * @return {Object}
+ */
+function setupMetrics(config) {
+  var metrics = process.env.METRICS;
+
+  if (metrics !== undefined)
+    config.METRICS = metrics === "1" || metrics === "true";
+
+  return config;
+}
+
+/**
+ * Sets up the logging options on a configuration object.
+ *
+ * The LOG_LEVEL, LOG_FLUSH_INTERVAL, LOG_RATE_LIMIT and LOG_SAMPLING (as
+ * JSON) environment variables override the ones from the config, which is
+ * handy to measure the cost of logging under load.
+ *
+ * @param  {Object} config The configuration object to modify
+ * @return {Object}
+ */
+function setupLogging(config) {
+  var env = process.env;
+
+  if (env.LOG_LEVEL)
+    config.LOG_LEVEL = env.LOG_LEVEL;
+
+  if (env.LOG_FLUSH_INTERVAL !== undefined)
+    config.LOG_FLUSH_INTERVAL = parseInt(env.LOG_FLUSH_INTERVAL, 10);
+
+  if (env.LOG_RATE_LIMIT !== undefined)
+    config.LOG_RATE_LIMIT = parseInt(env.LOG_RATE_LIMIT, 10);
+
+  if (env.LOG_SAMPLING !== undefined)
+    config.LOG_SAMPLING = JSON.parse(env.LOG_SAMPLING);
+
+  return config;
+}
+
 function setupSPA(config) {
   // Default to talkilla's spa
   var spaName = 'talkilla';
@@ -82,6 +189,11 @@ function getConfigFromFile(file) {
   }
 
   config = setupSPA(config);
+  config = setupLongPolling(config);
+  config = setupCluster(config);
+  config = setupPresence(config);
+  config = setupMetrics(config);
+  config = setupLogging(config);
 
   return setupUrls(config);
 }
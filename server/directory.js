@@ -0,0 +1,295 @@
+"use strict";
+var util = require("util");
+var EventEmitter = require("events").EventEmitter;
+
+var logger = require('./logger');
+
+/**
+ * A user connected to another node: the events sent to them are
+ * forwarded there.
+ *
+ * @param {String} nick the nick of the user
+ * @param {Number} node the node the user is connected to
+ * @param {Object} bus the bus to the other nodes
+ */
+function RemoteUser(nick, node, bus) {
+  this.nick = nick;
+  this.node = node;
+  this.bus = bus;
+}
+
+/**
+ * Send data to the user, like `User#send` does.
+ *
+ * @param {String} topic The type of the event to send
+ * @param {Object} data An abitrary JSON serializable object
+ * @return {RemoteUser} chainable
+ */
+RemoteUser.prototype.send = function(topic, data) {
+  this.bus.send(this.node, {type: "send", nick: this.nick, topic: topic,
+                            data: data});
+  return this;
+};
+
+RemoteUser.prototype.disconnect = function() {
+  this.bus.send(this.node, {type: "disconnect", nick: this.nick});
+};
+
+RemoteUser.prototype.toJSON = function() {
+  return {nick: this.nick};
+};
+
+/**
+ * The users of all the nodes sharing a bus (see bus.js): those of the
+ * local `UserList`, and those connected to the other nodes. This is the
+ * presence store the api uses, whatever the presence backend is.
+ *
+ * Nodes tell each other when users join and leave them. A user whose
+ * requests reach another node (e.g. a long polling request handled by
+ * another worker of the cluster) moves there: their previous node hands
+ * their queued events over and forgets them without telling anybody
+ * they left.
+ *
+ * Emits `join` and `leave` events with the nick of the user when a user
+ * joins or leaves any node.
+ *
+ * @param {UserList} users the users of this node
+ * @param {Object} bus the bus to the other nodes, if any
+ */
+function Directory(users, bus) {
+  this.users = users;
+  this.bus = bus;
+
+  // `this.remote` is the node of each user connected to another node.
+  this.remote = {};
+
+  // `this._moving` has the nicks of the local users being handed over to
+  // another node.
+  this._moving = {};
+
+  // `this._snapshot` is the last presence list handed out, reused until
+  // a user joins or leaves (see `presence`).
+  this._snapshot = undefined;
+
+  users.on("add", this._onAdd.bind(this));
+  users.on("remove", this._onRemove.bind(this));
+
+  if (bus) {
+    bus.on("message", this._onMessage.bind(this));
+    bus.on("reconnect", this._onReconnect.bind(this));
+    // Ask the other nodes for their users.
+    bus.publish({type: "hello"});
+  }
+}
+
+util.inherits(Directory, EventEmitter);
+
+/**
+ * Retrieve a user via its nick, on this node or another one.
+ *
+ * @param {String} nick the nick of the user to find
+ * @return {User|RemoteUser}
+ */
+Directory.prototype.get = function(nick) {
+  var user = this.users.get(nick);
+
+  if (!user && nick in this.remote)
+    user = new RemoteUser(nick, this.remote[nick], this.bus);
+
+  return user;
+};
+
+/**
+ * Get the list of the users of all the nodes, as sent to the clients (see
+ * `UserList#presence`). Don't modify it.
+ *
+ * @return {Array}
+ */
+Directory.prototype.presence = function() {
+  if (this._snapshot)
+    return this._snapshot;
+
+  var remote = Object.keys(this.remote);
+  if (!remote.length)
+    return this.users.presence();
+
+  this._snapshot = this.users.presence().concat(remote.map(function(nick) {
+    return {nick: nick};
+  }));
+  Object.defineProperty(this._snapshot, "_json", {
+    value: JSON.stringify(this._snapshot)
+  });
+  return this._snapshot;
+};
+
+Directory.prototype._onAdd = function(user) {
+  var moved = user.nick in this.remote;
+
+  delete this.remote[user.nick];
+  this._snapshot = undefined;
+
+  if (this.bus)
+    this.bus.publish({type: "join", nick: user.nick});
+
+  // Users moving from another node were already there.
+  if (!moved)
+    this.emit("join", user.nick);
+};
+
+Directory.prototype._onRemove = function(user) {
+  if (!user)
+    return;
+
+  this._snapshot = undefined;
+  if (this._moving[user.nick])
+    return;
+
+  if (this.bus)
+    this.bus.publish({type: "leave", nick: user.nick});
+  this.emit("leave", user.nick);
+};
+
+/**
+ * The other nodes were told this one was gone while it couldn't reach
+ * them, and it may have missed users leaving: start over.
+ */
+Directory.prototype._onReconnect = function() {
+  var nicks = Object.keys(this.users.users);
+
+  Object.keys(this.remote).forEach(function(nick) {
+    this._leave(nick);
+  }, this);
+
+  if (nicks.length)
+    this.bus.publish({type: "users", nicks: nicks});
+  this.bus.publish({type: "hello"});
+};
+
+Directory.prototype._onMessage = function(message, from) {
+  var nicks, user;
+
+  switch (message.type) {
+  case "hello":
+    nicks = Object.keys(this.users.users);
+    if (nicks.length)
+      this.bus.send(from, {type: "users", nicks: nicks});
+    break;
+
+  case "users":
+    nicks = [];
+    message.nicks.forEach(function(nick) {
+      if (this.users.get(nick) && this._keeps(from))
+        nicks.push(nick);
+      else
+        this._join(nick, from);
+    }, this);
+    // Have the other node hand over the users we both have.
+    if (nicks.length)
+      this.bus.send(from, {type: "users", nicks: nicks});
+    break;
+
+  case "join":
+    this._join(message.nick, from);
+    break;
+
+  case "leave":
+    if (this.remote[message.nick] === from)
+      this._leave(message.nick);
+    break;
+
+  case "gone":
+    Object.keys(this.remote).forEach(function(nick) {
+      if (this.remote[nick] === message.node)
+        this._leave(nick);
+    }, this);
+    break;
+
+  case "send":
+    this._deliver(message);
+    break;
+
+  case "disconnect":
+    user = this.users.get(message.nick);
+    if (user)
+      user.disconnect();
+    break;
+  }
+};
+
+/**
+ * Whether this node keeps the local users `node` says it has too, which
+ * happens when nodes exchange their lists of users at the same time
+ * (e.g. when the hub restarts). The node with the lowest id keeps them
+ * and the other one hands them over, rather than both handing them over
+ * to each other.
+ *
+ * @param {String|Number} node
+ * @return {Boolean}
+ */
+Directory.prototype._keeps = function(node) {
+  var id = this.bus.id;
+
+  if (typeof id === "number" && typeof node === "number")
+    return id < node;
+  return String(id) < String(node);
+};
+
+Directory.prototype._join = function(nick, node) {
+  var user = this.users.get(nick);
+  var known = user || nick in this.remote;
+
+  this.remote[nick] = node;
+  this._snapshot = undefined;
+
+  if (user)
+    this._handOver(user, node);
+  else if (!known)
+    this.emit("join", nick);
+};
+
+Directory.prototype._leave = function(nick) {
+  delete this.remote[nick];
+  this._snapshot = undefined;
+  this.emit("leave", nick);
+};
+
+/**
+ * Forget a local user who moved to `node`, and send their queued events
+ * there.
+ */
+Directory.prototype._handOver = function(user, node) {
+  var events = user._dequeue();
+
+  // The client isn't waiting on this node anymore.
+  if (user._pending && !user._pending.resolved)
+    user._pending.resolve([]);
+
+  this._moving[user.nick] = true;
+  user.disconnect();
+  if (this.users.get(user.nick) === user)
+    this.users.remove(user.nick);
+  delete this._moving[user.nick];
+
+  events.forEach(function(event) {
+    this.bus.send(node, {type: "send", nick: user.nick, topic: event.topic,
+                         data: event.data, forwarded: true});
+  }, this);
+};
+
+Directory.prototype._deliver = function(message) {
+  var user = this.users.get(message.nick);
+
+  if (user)
+    user.send(message.topic, message.data);
+  else if (message.nick in this.remote && !message.forwarded) {
+    // The user moved in the meantime.
+    message.forwarded = true;
+    this.bus.send(this.remote[message.nick], message);
+  } else
+    // Note: be careful not to expose user data here.
+    logger.warn("Could not forward event " + message.topic +
+                " to non present peer");
+};
+
+module.exports.Directory = Directory;
+module.exports.RemoteUser = RemoteUser;
@@ -0,0 +1,112 @@
+"use strict";
+var net = require("net");
+
+/**
+ * Call `callback` with each message read from `socket`, where they are
+ * written as lines of JSON. The connection is closed if one isn't valid.
+ *
+ * @param {net.Socket} socket
+ * @param {Function} callback
+ */
+function readMessages(socket, callback) {
+  var buffer = "";
+
+  socket.setEncoding("utf8");
+  socket.on("data", function(data) {
+    var lines = (buffer + data).split("\n");
+    buffer = lines.pop();
+    for (var i = 0; i < lines.length; i++) {
+      var message;
+      try {
+        message = JSON.parse(lines[i]);
+      } catch (err) {
+        return socket.destroy(err);
+      }
+      callback(message);
+    }
+  });
+}
+
+/**
+ * Hub of the "network" presence backend: relays the messages of the
+ * Talkilla nodes connected to it (see NetworkBus in bus.js), like the
+ * master of a cluster does for its workers, and tells them when one is
+ * gone.
+ *
+ * It is run on its own, next to the nodes:
+ *
+ *     $ HUB_PORT=5100 node server/hub.js
+ *
+ * It listens on localhost unless HUB_HOST says otherwise. The hub doesn't
+ * check who connects to it: only make it reachable from the nodes.
+ */
+function Hub() {
+  this.nodes = {};
+  this.server = net.createServer(this._onConnection.bind(this));
+}
+
+/**
+ * Start listening, see net.Server#listen.
+ *
+ * @return {Hub} chainable
+ */
+Hub.prototype.listen = function() {
+  this.server.listen.apply(this.server, arguments);
+  return this;
+};
+
+Hub.prototype.close = function(callback) {
+  Object.keys(this.nodes).forEach(function(id) {
+    this.nodes[id].destroy();
+  }, this);
+  this.server.close(callback);
+};
+
+Hub.prototype._onConnection = function(socket) {
+  var id;
+
+  socket.setNoDelay(true);
+  readMessages(socket, function(envelope) {
+    if (envelope.register === undefined)
+      return this._deliver(envelope);
+
+    id = String(envelope.register);
+    // A node reconnecting before its previous connection was closed
+    // replaces it.
+    if (this.nodes[id])
+      this.nodes[id].destroy();
+    this.nodes[id] = socket;
+  }.bind(this));
+
+  // Errors are followed by `close`.
+  socket.on("error", function() {});
+
+  socket.on("close", function() {
+    if (id === undefined || this.nodes[id] !== socket)
+      return;
+
+    delete this.nodes[id];
+    this._deliver({from: null, message: {type: "gone", node: id}});
+  }.bind(this));
+};
+
+Hub.prototype._deliver = function(envelope) {
+  var line = JSON.stringify(envelope) + "\n";
+
+  Object.keys(this.nodes).forEach(function(id) {
+    if (id === String(envelope.from) ||
+        (envelope.to !== undefined && id !== String(envelope.to)))
+      return;
+    this.nodes[id].write(line);
+  }, this);
+};
+
+module.exports.Hub = Hub;
+module.exports.readMessages = readMessages;
+
+if (require.main === module) {
+  var port = process.env.HUB_PORT || 5100;
+  new Hub().listen(port, process.env.HUB_HOST || "127.0.0.1", function() {
+    console.log("Presence hub running on port " + port);
+  });
+}
@@ -1,11 +1,24 @@
 var config = require('./config').config;
 var bunyan = require('bunyan');
+var LogSink = require('./logsink').LogSink;
+
+// Log records are buffered, and the noisy ones sampled and rate limited,
+// so that logging doesn't slow down the signaling (see logsink.js).
+var sink = new LogSink(process.stdout, {
+  flushInterval: config.LOG_FLUSH_INTERVAL,
+  sampling: config.LOG_SAMPLING,
+  rateLimit: config.LOG_RATE_LIMIT
+});
 
 // Logging
 var logger = bunyan.createLogger({
   name: 'talkilla',
   level: config.LOG_LEVEL,
+  streams: [{type: 'raw', stream: sink}],
   serializers: {err: bunyan.stdSerializers.err}
 });
 
+// Don't lose the last buffered records.
+process.on('exit', sink.flush.bind(sink));
+
 module.exports = logger;
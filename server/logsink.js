@@ -0,0 +1,186 @@
+"use strict";
+
+/**
+ * Bunyan levels the sink cares about: warnings and above are never
+ * sampled nor rate limited, errors and above are written right away.
+ */
+var WARN = 40;
+var ERROR = 50;
+
+/**
+ * How many lines are kept while the stream can't take more, after which
+ * new ones are dropped.
+ */
+var BUFFER_MAX = 10000;
+
+/**
+ * How many buffered lines make the sink flush without waiting for the
+ * flush interval.
+ */
+var BATCH_SIZE = 1000;
+
+/**
+ * Period the rate limits apply to, in ms.
+ */
+var RATE_WINDOW = 1000;
+
+/**
+ * Buffered, sampled and rate limited bunyan "raw" stream.
+ *
+ * Records are serialized as they come but written to `stream` in batches,
+ * every `flushInterval` ms, so that a burst of signaling costs a few
+ * writes instead of one per record. While `stream` can't take more (its
+ * `write` returned false), lines are kept until it drains, up to
+ * BUFFER_MAX, and then dropped: logging never holds up the server.
+ *
+ * Records below WARN are sampled and rate limited by type (their `type`
+ * field, or their message if they have none):
+ *
+ * - `sampling` is the number of records of a type out of which one is
+ *   kept, e.g. `{"ice:candidate": 100}`; kept records have a `sampled`
+ *   field with that number, so counts can be scaled back;
+ * - `rateLimit` is the number of records of a type kept per second at
+ *   most.
+ *
+ * Dropped records are counted, and a "log:dropped" warning with the count
+ * per type is logged once per second while records are being dropped.
+ *
+ * With a `flushInterval` of 0 records are written as they come, like a
+ * regular bunyan stream.
+ *
+ * @param {stream.Writable} stream
+ * @param {Object} options flushInterval, sampling and rateLimit
+ */
+function LogSink(stream, options) {
+  options = options || {};
+  this.stream = stream;
+  this.flushInterval = options.flushInterval || 0;
+  this.sampling = options.sampling || {};
+  this.rateLimit = options.rateLimit || 0;
+
+  this.buffer = [];
+  // `this.seen` is the number of records seen per sampled type,
+  // `this.counts` the records kept per type in the current rate window.
+  this.seen = {};
+  this.counts = {};
+  this.windowStart = 0;
+  // `this.dropped` is the number of records dropped per type since the
+  // last "log:dropped" warning.
+  this.dropped = {};
+  this._congested = false;
+  this._timer = undefined;
+}
+
+/**
+ * Called by bunyan with each record.
+ *
+ * @param {Object} record
+ */
+LogSink.prototype.write = function(record) {
+  var type = record.type || record.msg;
+
+  this._rollWindow(record);
+
+  if (record.level < WARN) {
+    var rate = this.sampling[type];
+    if (rate > 1) {
+      this.seen[type] = (this.seen[type] || 0) + 1;
+      if ((this.seen[type] - 1) % rate !== 0)
+        return;
+      record.sampled = rate;
+    }
+
+    if (this.rateLimit) {
+      this.counts[type] = (this.counts[type] || 0) + 1;
+      if (this.counts[type] > this.rateLimit)
+        return this._drop(type);
+    }
+  }
+
+  if (this.buffer.length >= BUFFER_MAX)
+    return this._drop(type);
+
+  this.buffer.push(JSON.stringify(record) + "\n");
+
+  if (record.level >= ERROR || this.buffer.length >= BATCH_SIZE)
+    this.flush();
+  else
+    this._schedule();
+};
+
+LogSink.prototype._drop = function(type) {
+  this.dropped[type] = (this.dropped[type] || 0) + 1;
+};
+
+/**
+ * Start a new rate window if the current one is over, and log the
+ * records dropped during the last one.
+ *
+ * @param {Object} record The record being written, which the warning
+ *                        takes its name, hostname and pid from
+ */
+LogSink.prototype._rollWindow = function(record) {
+  var now = Date.now();
+
+  if (now - this.windowStart < RATE_WINDOW)
+    return;
+
+  this.windowStart = now;
+  this.counts = {};
+
+  if (!Object.keys(this.dropped).length)
+    return;
+
+  this.buffer.push(JSON.stringify({
+    name: record.name,
+    hostname: record.hostname,
+    pid: record.pid,
+    level: WARN,
+    type: "log:dropped",
+    dropped: this.dropped,
+    msg: "log records dropped",
+    time: new Date(now),
+    v: record.v
+  }) + "\n");
+  this.dropped = {};
+
+  // The record being written may be dropped too: don't wait for the next
+  // one to write the warning.
+  this._schedule();
+};
+
+/**
+ * Flush now, or in `flushInterval` milliseconds if records are buffered.
+ */
+LogSink.prototype._schedule = function() {
+  if (!this.flushInterval)
+    this.flush();
+  else if (this._timer === undefined)
+    this._timer = setTimeout(this.flush.bind(this), this.flushInterval);
+};
+
+/**
+ * Write the buffered lines, unless the stream is still draining the last
+ * ones.
+ */
+LogSink.prototype.flush = function() {
+  clearTimeout(this._timer);
+  this._timer = undefined;
+
+  if (this._congested || !this.buffer.length)
+    return;
+
+  var data = this.buffer.join("");
+  this.buffer = [];
+
+  if (this.stream.write(data) === false) {
+    this._congested = true;
+    this.stream.once("drain", function() {
+      this._congested = false;
+      this.flush();
+    }.bind(this));
+  }
+};
+
+module.exports.LogSink = LogSink;
+module.exports.BUFFER_MAX = BUFFER_MAX;
@@ -0,0 +1,157 @@
+"use strict";
+
+/**
+ * How often the event loop lag is measured, in ms.
+ */
+var LAG_INTERVAL = 500;
+
+/**
+ * How many lag measures are kept, i.e. the last 10 seconds.
+ */
+var LAG_SAMPLES = 20;
+
+/**
+ * Upper bounds of the latency buckets of the routes, in ms.
+ */
+var LATENCY_BUCKETS = [1, 5, 10, 50, 100, 500, 1000, 5000, 30000];
+
+/**
+ * Request count and latencies of a route.
+ */
+function RouteStats() {
+  this.count = 0;
+  this.errors = 0;
+  this.total = 0;
+  this.max = 0;
+  // the last one is for the requests slower than all the bounds
+  this.buckets = LATENCY_BUCKETS.map(function() {
+    return 0;
+  }).concat([0]);
+}
+
+RouteStats.prototype.record = function(ms, error) {
+  var i = 0;
+
+  this.count += 1;
+  if (error)
+    this.errors += 1;
+  this.total += ms;
+  this.max = Math.max(this.max, ms);
+
+  while (i < LATENCY_BUCKETS.length && ms > LATENCY_BUCKETS[i])
+    i++;
+  this.buckets[i] += 1;
+};
+
+RouteStats.prototype.toJSON = function() {
+  var buckets = {};
+
+  LATENCY_BUCKETS.forEach(function(bound, i) {
+    buckets["<=" + bound] = this.buckets[i];
+  }, this);
+  buckets[">" + LATENCY_BUCKETS[LATENCY_BUCKETS.length - 1]] =
+    this.buckets[LATENCY_BUCKETS.length];
+
+  return {
+    count: this.count,
+    errors: this.errors,
+    mean: this.count ? this.total / this.count : 0,
+    max: this.max,
+    buckets: buckets
+  };
+};
+
+/**
+ * Runtime metrics of the server: requests per route, event loop lag and
+ * memory. The signaling state (users, queues) is added by the metrics
+ * api (see presence.js).
+ *
+ * Requests are only recorded by `middleware`, and the event loop lag
+ * measured once `start` is called, which the server only does when
+ * config.METRICS is set.
+ */
+function Metrics() {
+  this.routes = {};
+  this.lag = [];
+  this._lagTimer = undefined;
+}
+
+/**
+ * Record the time it took to answer a request to `route`.
+ *
+ * @param {String} route
+ * @param {Number} ms
+ * @param {Boolean} error
+ */
+Metrics.prototype.record = function(route, ms, error) {
+  if (!this.routes[route])
+    this.routes[route] = new RouteStats();
+  this.routes[route].record(ms, error);
+};
+
+/**
+ * Express middleware recording the requests by route. Requests which
+ * didn't match a route (e.g. static files) are recorded as "other", and
+ * the ones the client gave up on aren't.
+ */
+Metrics.prototype.middleware = function(req, res, next) {
+  var start = Date.now();
+
+  res.on("finish", function() {
+    var route = req.route ? req.method + " " + req.route.path : "other";
+    this.record(route, Date.now() - start, res.statusCode >= 400);
+  }.bind(this));
+
+  next();
+};
+
+/**
+ * Start measuring the event loop lag, i.e. how late a timer fires.
+ */
+Metrics.prototype.start = function() {
+  var expected = Date.now() + LAG_INTERVAL;
+
+  this._lagTimer = setInterval(function() {
+    var now = Date.now();
+
+    this.lag.push(Math.max(now - expected, 0));
+    if (this.lag.length > LAG_SAMPLES)
+      this.lag.shift();
+    expected = now + LAG_INTERVAL;
+  }.bind(this), LAG_INTERVAL);
+
+  // Don't keep the process alive just for this.
+  if (this._lagTimer.unref)
+    this._lagTimer.unref();
+};
+
+Metrics.prototype.stop = function() {
+  clearInterval(this._lagTimer);
+  this._lagTimer = undefined;
+};
+
+/**
+ * Get the metrics.
+ *
+ * `eventLoop.lag` is the last measure of the lag, `eventLoop.maxLag` the
+ * largest over the last few seconds, in ms. The routes have their counts
+ * and latencies since the server started.
+ *
+ * @return {Object}
+ */
+Metrics.prototype.report = function() {
+  return {
+    time: Date.now(),
+    uptime: process.uptime(),
+    eventLoop: {
+      lag: this.lag.length ? this.lag[this.lag.length - 1] : 0,
+      maxLag: this.lag.length ? Math.max.apply(Math, this.lag) : 0
+    },
+    memory: process.memoryUsage(),
+    routes: this.routes
+  };
+};
+
+module.exports.Metrics = Metrics;
+module.exports.RouteStats = RouteStats;
+module.exports.metrics = new Metrics();
@@ -11,22 +11,29 @@ var config = require('./config').config;
 var logger = require('./logger');
 var UserList = require('./users').UserList;
 var User = require('./users').User;
+var serializeEvents = require('./users').serializeEvents;
+var Directory = require('./directory').Directory;
+var bus = require('./bus');
+var metrics = require('./metrics').metrics;
 
 var users = new UserList();
 var anons = new UserList();
+// The users of all the workers when running as a cluster, only the local
+// ones otherwise.
+var directory = new Directory(users, bus.create());
 var api;
 
-users.on("add", function(user) {
+directory.on("join", function(nick) {
   users.forEach(function(peer) {
-    if (peer !== user)
-      peer.send("userJoined", user.nick);
+    if (peer.nick !== nick)
+      peer.send("userJoined", nick);
   });
 });
 
-users.on("remove", function(user) {
+directory.on("leave", function(nick) {
   users.forEach(function(peer) {
-    if (peer !== user)
-      peer.send("userLeft", user.nick);
+    if (peer.nick !== nick)
+      peer.send("userLeft", nick);
   });
 });
 
@@ -91,7 +98,7 @@ api = {
     // Remove the user's session
     req.session.reset();
 
-    var user = users.get(nick);
+    var user = directory.get(nick);
     if (user) {
       // notify the client
       user.send("disconnect", null);
@@ -123,22 +130,83 @@ api = {
       return res.send(400);
 
     var user = api._setupUser(users, req.session.email, firstRequest);
+    // The client went back to long polling: stop pushing to the previous
+    // connection.
+    user.detach();
     user.touch();
 
     if (firstRequest)
       res.send(200, JSON.stringify([]));
+    else if (user.overflowed) {
+      // Events were dropped from the queue of the user: make the client
+      // reconnect, which gets it the presence list again.
+      user.overflowed = false;
+      res.send(409);
+    }
     else
       user.waitForEvents(function(events) {
-        logger.trace({to: user.nick, events: events}, "long polling send");
-        res.send(200, JSON.stringify(events));
+        // not the events themselves: offers and answers carry whole SDPs
+        logger.trace({to: user.nick, count: events.length},
+                     "long polling send");
+        res.send(200, serializeEvents(events));
       });
   },
 
+  /*
+   * Push API
+   *
+   * This API streams the events of the user as Server-Sent Events, as
+   * soon as they are sent, over a single long lived response. Each
+   * message is a list of events, like the responses of /stream, and
+   * comments are sent as heartbeats.
+   *
+   * Clients which can't use it fall back to /stream.
+   */
+  events: function(req, res) {
+    if (!req.session.email)
+      return res.send(400);
+
+    var user = api._setupUser(users, req.session.email, true);
+
+    function push(events) {
+      if (events.length)
+        res.write("data: " + serializeEvents(events) + "\n\n");
+      else
+        res.write(":\n\n");
+    }
+
+    function close() {
+      user.detach(push);
+      user.removeListener("disconnect", end);
+    }
+
+    function end() {
+      close();
+      res.end();
+    }
+
+    // The connection is kept open for as long as the user is there.
+    req.socket.setTimeout(0);
+    res.writeHead(200, {
+      "Content-Type": "text/event-stream",
+      "Cache-Control": "no-cache",
+      "Connection": "keep-alive"
+    });
+    res.write(":\n\n");
+
+    user.on("disconnect", end);
+    req.on("close", close);
+    // Another /events or /stream request replacing this one ends it.
+    user.attach(push, end);
+    logger.info({type: "push"});
+  },
+
   _setupUser: function(userList, id, firstRequest) {
     var user = userList.get(id);
 
     if (user && firstRequest) {
       user.clearPending();
+      user.overflowed = false;
       logger.info({type: "reconnection"});
     }
 
@@ -166,7 +234,7 @@ api = {
 
     var nick = req.session.email;
     var data = req.body.data;
-    var peer = users.get(data.peer);
+    var peer = directory.get(data.peer);
 
     if (!peer) {
       // XXX This could happen in the case of the user disconnecting
@@ -188,7 +256,7 @@ api = {
 
     var nick = req.session.email;
     var data = req.body.data;
-    var peer = users.get(data.peer);
+    var peer = directory.get(data.peer);
 
     if (!peer) {
       // XXX This could happen in the case of the user disconnecting
@@ -210,7 +278,7 @@ api = {
 
     var nick = req.session.email;
     var data = req.body.data;
-    var peer = users.get(data.peer);
+    var peer = directory.get(data.peer);
 
     if (!peer) {
       // XXX This could happen in the case of the user disconnecting
@@ -233,7 +301,7 @@ api = {
     logger.info({type: "ice:candidate"});
     var nick = req.session.email;
     var data = req.body.data;
-    var peer = users.get(data.peer);
+    var peer = directory.get(data.peer);
 
     if (!peer) {
       // XXX This could happen in the case of the user disconnecting
@@ -253,19 +321,53 @@ api = {
       return res.send(400);
 
     var nick = req.session.email;
-    var user = users.get(nick);
-    var presentUsers = users.toJSON();
+    var user = directory.get(nick);
 
-    user.send("users", presentUsers);
+    user.send("users", directory.presence());
     return res.send(204);
   },
 
+  /*
+   * Metrics API
+   *
+   * Reports the runtime metrics of the server (see metrics.js) and the
+   * state of the signaling: users, pending long polling requests and
+   * event queues. Only available with config.METRICS, which is off in
+   * production.
+   */
+  metrics: function(req, res) {
+    if (!config.METRICS)
+      return res.send(404);
+
+    var queues = users.queueStats();
+    var report = metrics.report();
+
+    report.users = {
+      connected: queues.users,
+      remote: Object.keys(directory.remote).length,
+      anons: anons.all().length,
+      pushed: queues.pushed
+    };
+    report.waiters = queues.pending;
+    report.queues = {
+      events: queues.events,
+      maxDepth: queues.maxDepth,
+      bytes: queues.bytes,
+      dropped: queues.dropped,
+      maxLength: queues.maxLength,
+      depths: queues.depths
+    };
+
+    res.header('Content-Type', 'application/json');
+    res.send(200, JSON.stringify(report));
+  },
+
   instantShare: function(req, res) {
     res.sendfile(path.join(__dirname, "..", "static", "instant-share.html"));
   },
 
   instantSharePingBack: function(req, res) {
-    var user = users.get(req.session.email);
+    var user = directory.get(req.session.email);
 
     if (!user) {
       logger.error({type: "instantshare"},
@@ -282,14 +384,17 @@ api = {
 app.post('/signin', api.signin);
 app.post('/signout', api.signout);
 app.post('/stream', api.stream);
+app.get('/events', api.events);
 app.post('/calloffer', api.callOffer);
 app.post('/callaccepted', api.callAccepted);
 app.post('/callhangup', api.callHangup);
 app.post('/icecandidate', api.iceCandidate);
 app.post('/presenceRequest', api.presenceRequest);
+app.get('/metrics', api.metrics);
 app.get('/instant-share/:email', api.instantShare);
 app.post('/instant-share/:email', api.instantSharePingBack);
 
 module.exports.api = api;
 module.exports._users = users;
 module.exports._anons = anons;
+module.exports._directory = directory;
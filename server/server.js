@@ -6,8 +6,15 @@ var http     = require('http');
 var sessions = require("client-sessions");
 var config   = require('./config').config;
 var logger   = require('./logger');
+var metrics  = require('./metrics').metrics;
 var app      = express();
 
+// Runtime metrics, reported by the /metrics api (see presence.js).
+if (config.METRICS) {
+  app.use(metrics.middleware.bind(metrics));
+  metrics.start();
+}
+
 app.use(express.bodyParser());
 
 var useSSL = config.ROOTURL.indexOf("https") === 0;
@@ -65,13 +72,40 @@ function uncaughtError(err, req, res, next) {
 }
 app.use(uncaughtError);
 
+/**
+ * The settings the clients use, which are the only ones sent to them: the
+ * others are for the server alone, e.g. the address of the presence hub.
+ */
+var CLIENT_CONFIG = [
+  "DEBUG",
+  "ROOTURL",
+  "PERSONA_INCLUDE_URL",
+  "FAKE_MEDIA_STREAMS",
+  "PENDING_CALL_TIMEOUT",
+  "CONVERSATION_IGNORE_DISPLAY_TIME",
+  "SPA"
+];
+
+/**
+ * Get the part of the configuration sent to the clients.
+ *
+ * @return {Object}
+ */
+function clientConfig() {
+  return CLIENT_CONFIG.reduce(function(clientConfig, key) {
+    if (config[key] !== undefined)
+      clientConfig[key] = config[key];
+    return clientConfig;
+  }, {});
+}
+
 var api = {
   config: function(req, res) {
     res.header('Content-Type', 'application/javascript');
     // This generates a function because importScripts in the worker doesn't
     // allow access to global variables.
-    res.send(200, 'function loadConfig() { return ' + JSON.stringify(config) +
-                  '; }');
+    res.send(200, 'function loadConfig() { return ' +
+                  JSON.stringify(clientConfig()) + '; }');
   }
 };
 
@@ -96,3 +130,4 @@ module.exports.app = app;
 module.exports.api = api;
 module.exports.server = server;
 module.exports.middlewares = middlewares;
+module.exports.clientConfig = clientConfig;
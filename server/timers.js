@@ -0,0 +1,214 @@
+"use strict";
+
+/**
+ * TimerWheel class constructor
+ *
+ * A hashed timer wheel: timers are kept in `slots` buckets according to
+ * when they expire, and a single timeout sweeps the buckets every
+ * `resolution` milliseconds while there are timers left. Adding and
+ * cancelling a timer are O(1) and don't touch the timers of the runtime,
+ * which matters as every connected user has one or two timers which are
+ * reset on each long polling request.
+ *
+ * Timers never fire early, but can fire up to `resolution` milliseconds
+ * late.
+ *
+ * @param {Number} resolution How often the wheel is swept, in ms
+ * @param {Number} slots      The number of buckets (default: 512)
+ */
+function TimerWheel(resolution, slots) {
+  this.resolution = resolution;
+  this.slots = [];
+  for (var i = 0; i < (slots || 512); i++)
+    this.slots.push([]);
+
+  // `this.size` is the number of timers which are still to fire.
+  this.size = 0;
+
+  // `this._next` is the next tick to sweep, in number of `resolution`
+  // since the epoch.
+  this._next = undefined;
+  this._timeout = undefined;
+}
+
+/**
+ * Call `callback` in `delay` milliseconds.
+ *
+ * @param  {Number}   delay
+ * @param  {Function} callback
+ * @return {Object}   a timer which can be given to `cancel`
+ */
+TimerWheel.prototype.add = function(delay, callback) {
+  var now = Date.now();
+  var timer = {expires: now + delay, callback: callback};
+  var tick;
+
+  if (!this._timeout)
+    this._next = Math.floor(now / this.resolution);
+
+  // Slots are swept once their tick is over: put the timer in the first
+  // one that's not earlier than its expiry.
+  tick = Math.max(Math.ceil(timer.expires / this.resolution), this._next);
+  this._insert(timer, tick % this.slots.length);
+  this.size += 1;
+
+  if (!this._timeout)
+    this._schedule(now);
+
+  return timer;
+};
+
+/**
+ * Cancel a timer. Does nothing if it already fired or was cancelled.
+ *
+ * @param {Object} timer A timer returned by `add`
+ */
+TimerWheel.prototype.cancel = function(timer) {
+  if (!timer || !timer.callback)
+    return;
+
+  if (timer.slot !== undefined)
+    this._remove(timer);
+  timer.callback = undefined;
+  this.size -= 1;
+};
+
+/**
+ * Cancel all the timers and stop sweeping.
+ */
+TimerWheel.prototype.clear = function() {
+  clearTimeout(this._timeout);
+  this._timeout = undefined;
+  this.slots = this.slots.map(function(timers) {
+    timers.forEach(function(timer) {
+      timer.slot = undefined;
+      timer.callback = undefined;
+    });
+    return [];
+  });
+  this.size = 0;
+};
+
+TimerWheel.prototype._insert = function(timer, slot) {
+  timer.slot = slot;
+  timer.index = this.slots[slot].length;
+  this.slots[slot].push(timer);
+};
+
+TimerWheel.prototype._remove = function(timer) {
+  // Move the last timer of the slot in place of the removed one, so that
+  // cancelling doesn't have to shift the slot.
+  var timers = this.slots[timer.slot];
+  var last = timers.pop();
+
+  if (last !== timer) {
+    timers[timer.index] = last;
+    last.index = timer.index;
+  }
+  timer.slot = undefined;
+};
+
+TimerWheel.prototype._schedule = function(now) {
+  var delay = Math.max(this._next * this.resolution - now, 0);
+  this._timeout = setTimeout(this._sweep.bind(this), delay);
+};
+
+TimerWheel.prototype._sweep = function() {
+  var now = Date.now();
+  var last = Math.floor(now / this.resolution);
+  var due = [];
+
+  // If we're late by more than a round, every slot has to be swept once.
+  if (last - this._next >= this.slots.length)
+    this._next = last - this.slots.length + 1;
+
+  for (; this._next <= last; this._next++) {
+    var index = this._next % this.slots.length;
+    var timers = this.slots[index];
+
+    this.slots[index] = [];
+    for (var i = 0; i < timers.length; i++) {
+      var timer = timers[i];
+      if (timer.expires <= now) {
+        timer.slot = undefined;
+        due.push(timer);
+      } else
+        // More than a round away, keep it for a later turn.
+        this._insert(timer, index);
+    }
+  }
+
+  this._timeout = undefined;
+  if (this.size - due.length > 0)
+    this._schedule(now);
+
+  due.forEach(function(timer) {
+    var callback = timer.callback;
+    // It may have been cancelled by the callback of another timer.
+    if (!callback)
+      return;
+    this.cancel(timer);
+    callback();
+  }, this);
+};
+
+/**
+ * NativeTimers class constructor
+ *
+ * Same interface as TimerWheel, using a timer of the runtime for each
+ * timer.
+ */
+function NativeTimers() {
+  // `this.handles` are the handles of the runtime timers which are still
+  // to fire, by timer id.
+  this.handles = {};
+  this.size = 0;
+  this._lastId = 0;
+}
+
+NativeTimers.prototype.add = function(delay, callback) {
+  var id = ++this._lastId;
+
+  this.handles[id] = setTimeout(function() {
+    delete this.handles[id];
+    this.size -= 1;
+    callback();
+  }.bind(this), delay);
+  this.size += 1;
+
+  return id;
+};
+
+NativeTimers.prototype.cancel = function(timer) {
+  if (!(timer in this.handles))
+    return;
+
+  clearTimeout(this.handles[timer]);
+  delete this.handles[timer];
+  this.size -= 1;
+};
+
+NativeTimers.prototype.clear = function() {
+  Object.keys(this.handles).forEach(function(id) {
+    clearTimeout(this.handles[id]);
+  }, this);
+  this.handles = {};
+  this.size = 0;
+};
+
+/**
+ * Create the timers for the given resolution: a TimerWheel, or
+ * NativeTimers when the resolution is 0.
+ *
+ * @param  {Number} resolution
+ * @return {TimerWheel|NativeTimers}
+ */
+function create(resolution) {
+  if (resolution)
+    return new TimerWheel(resolution);
+  return new NativeTimers();
+}
+
+module.exports.TimerWheel = TimerWheel;
+module.exports.NativeTimers = NativeTimers;
+module.exports.create = create;
@@ -4,9 +4,42 @@ var EventEmitter = require("events").EventEmitter;
 
 var config = require('./config').config;
 var logger = require('./logger');
+var timers = require('./timers').create(config.TIMER_RESOLUTION);
+
+/**
+ * Topics of the presence events, of which only the last one about a given
+ * user matters to the client.
+ */
+var PRESENCE_TOPICS = ["userJoined", "userLeft"];
+
+/**
+ * Only keep the last presence event about each user in a list of events.
+ *
+ * @param {Array} events
+ * @return {Array} the collapsed list of events
+ */
+function collapsePresence(events) {
+  var seen = Object.create(null);
+  var collapsed = [];
+
+  for (var i = events.length - 1; i >= 0; i--) {
+    var event = events[i];
+    if (PRESENCE_TOPICS.indexOf(event.topic) !== -1) {
+      if (seen[event.data])
+        continue;
+      seen[event.data] = true;
+    }
+    collapsed.push(event);
+  }
+
+  return collapsed.reverse();
+}
 
 function Waiter(callback) {
   this.timeout = undefined;
+  // `this.flushTimeout` is set while the waiter waits for more events
+  // before resolving (see `resolveSoon`).
+  this.flushTimeout = undefined;
   this.callback = callback;
   // resolved is the fact the connection has closed / the waiter
   // is no longer active.
@@ -14,20 +47,50 @@ function Waiter(callback) {
 }
 
 Waiter.prototype.after = function(timeout, data) {
-  this.timeout = setTimeout(function() {
+  this.timeout = timers.add(timeout, function() {
+    if (this.resolved)
+      return;
+    clearTimeout(this.flushTimeout);
     this.resolved = true;
     this.callback(data);
-  }.bind(this), timeout);
+  }.bind(this));
 };
 
+/**
+ * Call the callback with `data`, unless the waiter was already resolved:
+ * it answers a single request.
+ *
+ * @param {Any} data
+ */
 Waiter.prototype.resolve = function(data) {
-  clearTimeout(this.timeout);
+  if (this.resolved)
+    return;
+  timers.cancel(this.timeout);
+  clearTimeout(this.flushTimeout);
   this.resolved = true;
   this.callback(data);
 };
 
+/**
+ * Resolve the waiter in `delay` milliseconds with the data returned by
+ * `getData` at that time. Does nothing if it is already going to.
+ *
+ * @param {Number} delay
+ * @param {Function} getData
+ */
+Waiter.prototype.resolveSoon = function(delay, getData) {
+  if (this.flushTimeout)
+    return;
+
+  this.flushTimeout = setTimeout(function() {
+    if (!this.resolved)
+      this.resolve(getData());
+  }.bind(this), delay);
+};
+
 Waiter.prototype.clear = function() {
-  clearTimeout(this.timeout);
+  timers.cancel(this.timeout);
+  clearTimeout(this.flushTimeout);
 };
 
 /**
@@ -47,11 +110,24 @@ function User(nick) {
   // receives events between two long-polling connections.
   this.events = [];
 
+  // `this.overflowed` is set when events were dropped from the queue and
+  // the client has to reconnect to get back in sync (see `_enqueue`).
+  this.overflowed = false;
+
   // `this._pending` is an object carrying the current pending
   // long-polling timeout and callback.
   // Beware, `this._pending.timeout` and `this.timeout` have different
   // purposes.
   this._pending = undefined;
+
+  // `this._push` is set while the events of the user are pushed to them
+  // as they are sent rather than kept for the next long polling request
+  // (see `attach`), `this._end` ends the push connection, and
+  // `this._heartbeat` is the timer keeping the push connection and the
+  // user alive.
+  this._push = undefined;
+  this._end = undefined;
+  this._heartbeat = undefined;
 }
 
 util.inherits(User, EventEmitter);
@@ -66,16 +142,28 @@ util.inherits(User, EventEmitter);
 User.prototype.send = function(topic, data) {
   var event = {topic: topic, data: data};
 
-  if (this._pending && !this._pending.resolved) {
+  if (this._push) {
+    logger.trace({to: this.nick, topic: topic}, "User.prototype.send pushed");
+    this._push([event]);
+  }
+  else if (this._pending && !this._pending.resolved) {
     logger.trace({to: this.nick, topic: topic}, "User.prototype.send resolved");
-    // If there is an existing timeout, we resolve it with the
-    // provided data.
-    this._pending.resolve([event]);
+    if (config.LONG_POLLING_COALESCING_WINDOW) {
+      // Events often come in bursts (ICE candidates, presence updates).
+      // Wait a bit for the next ones so that they all go in the same
+      // response instead of costing a long polling request each.
+      this._enqueue(event);
+      this._pending.resolveSoon(config.LONG_POLLING_COALESCING_WINDOW,
+                                this._dequeue.bind(this));
+    } else
+      // If there is an existing timeout, we resolve it with the
+      // provided data.
+      this._pending.resolve([event]);
   }
   else if (this.timeout) {
     logger.trace({to: this.nick, topic: topic}, "User.prototype.send queued");
     // Otherwise, if the user is present, we queue the data.
-    this.events.push(event);
+    this._enqueue(event);
   }
   else
     // if we try to send data to a non present user we do not fail but
@@ -87,9 +175,9 @@ User.prototype.send = function(topic, data) {
 };
 
 User.prototype.connect = function() {
-  this.timeout = setTimeout(function() {
+  this.timeout = timers.add(config.LONG_POLLING_TIMEOUT * 2, function() {
     this.disconnect();
-  }.bind(this), config.LONG_POLLING_TIMEOUT * 2);
+  }.bind(this));
 };
 
 /**
@@ -99,13 +187,14 @@ User.prototype.connect = function() {
  * @return {User} chainable
  */
 User.prototype.touch = function() {
-  clearTimeout(this.timeout);
+  timers.cancel(this.timeout);
   this.connect();
   return this;
 };
 
 User.prototype.disconnect = function() {
-  clearTimeout(this.timeout);
+  this.detach();
+  timers.cancel(this.timeout);
   this.timeout = undefined;
   this.emit("disconnect");
 };
@@ -119,6 +208,121 @@ User.prototype.toJSON = function() {
   return {nick: this.nick};
 };
 
+/**
+ * Push the events of the user to `push` as they are sent, starting with
+ * the queued ones, instead of keeping them for the next long polling
+ * request.
+ *
+ * `push` is also called with an empty list of events every
+ * config.LONG_POLLING_TIMEOUT, which keeps the user connected as long as
+ * they are attached.
+ *
+ * `end` is called when the user is detached from `push` by something
+ * else than its own connection closing, e.g. a new long polling request
+ * or push connection replacing it, so that the connection is ended
+ * rather than left open without events.
+ *
+ * @param {Function} push Called with a list of events
+ * @param {Function} end Ends the push connection
+ * @return {User} chainable
+ */
+User.prototype.attach = function(push, end) {
+  this.clearPending();
+  this.detach();
+  this._push = push;
+  this._end = end;
+  this._beat();
+
+  if (this.events.length)
+    push(this._dequeue());
+  return this;
+};
+
+User.prototype._beat = function() {
+  this.touch();
+  this._heartbeat = timers.add(config.LONG_POLLING_TIMEOUT, function() {
+    this._push([]);
+    this._beat();
+  }.bind(this));
+};
+
+/**
+ * Stop pushing events: they are queued again until the next long polling
+ * request or push connection, and the user times out if there's none.
+ *
+ * The push connection is ended (see `attach`) unless `push` is given,
+ * i.e. unless it is the one detaching itself.
+ *
+ * @param {Function} push Only detach this one, if given
+ * @return {User} chainable
+ */
+User.prototype.detach = function(push) {
+  if (!this._push || (push && push !== this._push))
+    return this;
+
+  var end = this._end;
+
+  timers.cancel(this._heartbeat);
+  this._heartbeat = undefined;
+  this._push = undefined;
+  this._end = undefined;
+
+  if (!push && end)
+    end();
+  return this;
+};
+
+/**
+ * Empty the queue of events.
+ *
+ * @return {Array} the events which were queued
+ */
+User.prototype._dequeue = function() {
+  var events = this.events;
+  this.events = [];
+  return events;
+};
+
+/**
+ * Add an event to the queue, keeping it under
+ * config.EVENT_QUEUE_MAX_LENGTH events.
+ *
+ * When the queue is full, config.EVENT_QUEUE_OVERFLOW tells what to do:
+ *
+ * - "drop-oldest": drop the oldest events;
+ * - "collapse-presence": only keep the last presence event about each
+ *   user, then drop the oldest events if that's not enough;
+ * - "reconnect": drop all the events and flag the user so that the
+ *   client is asked to reconnect.
+ *
+ * Emits an `overflow` event with the number of dropped events.
+ *
+ * @param {Object} event
+ */
+User.prototype._enqueue = function(event) {
+  var max = config.EVENT_QUEUE_MAX_LENGTH;
+  var length;
+
+  this.events.push(event);
+  if (!max || this.events.length <= max)
+    return;
+
+  length = this.events.length;
+  if (config.EVENT_QUEUE_OVERFLOW === "reconnect") {
+    this.events = [];
+    this.overflowed = true;
+  } else {
+    if (config.EVENT_QUEUE_OVERFLOW === "collapse-presence")
+      this.events = collapsePresence(this.events);
+    if (this.events.length > max)
+      this.events.splice(0, this.events.length - max);
+  }
+
+  logger.debug({type: "overflow", policy: config.EVENT_QUEUE_OVERFLOW},
+               "event queue overflow");
+  this.emit("overflow", length - this.events.length);
+};
+
 User.prototype.clearPending = function() {
   if (this._pending) {
     this._pending.clear();
@@ -141,6 +345,9 @@ User.prototype.clearPending = function() {
  *
  */
 User.prototype.waitForEvents = function(callback) {
+  // A previous waiter must not dequeue events for a stale request.
+  this.clearPending();
+
   // Setup a timeout with an empty list of events as the default
   // behaviour.
   this._pending = new Waiter(callback);
@@ -148,10 +355,8 @@ User.prototype.waitForEvents = function(callback) {
 
   // If there is available events in the queue, resolve the timeout
   // immediately.
-  if (this.events.length) {
-    this._pending.resolve(this.events);
-    this.events = [];
-  }
+  if (this.events.length)
+    this._pending.resolve(this._dequeue());
 };
 
 /**
@@ -159,6 +364,20 @@ User.prototype.waitForEvents = function(callback) {
  */
 function UserList() {
   this.users = {};
+
+  // `this._presence` is the list of the users as sent to the clients,
+  // kept up to date as users are added and removed, and
+  // `this._presenceIndex` is the position of each user in it.
+  this._presence = [];
+  this._presenceIndex = {};
+
+  // `this._snapshot` is the last copy of `this._presence` which was
+  // handed out, reused until the list changes (see `presence`).
+  this._snapshot = undefined;
+
+  // `this.dropped` counts the events dropped from the queues of the
+  // users because they were full.
+  this.dropped = 0;
 }
 
 util.inherits(UserList, EventEmitter);
@@ -182,7 +401,16 @@ UserList.prototype.hasNick = function(nick) {
  * @return {UserList} chainable
  */
 UserList.prototype.add = function(nick) {
+  if (!(nick in this.users)) {
+    this._presenceIndex[nick] = this._presence.length;
+    this._presence.push({nick: nick});
+    this._snapshot = undefined;
+  }
+
   this.users[nick] = new User(nick);
+  this.users[nick].on("overflow", function(dropped) {
+    this.dropped += dropped;
+  }.bind(this));
   this.emit("add", this.users[nick]);
   return this;
 };
@@ -214,6 +442,21 @@ UserList.prototype.all = function() {
  */
 UserList.prototype.remove = function(nick) {
   var user = this.users[nick];
+  var index = this._presenceIndex[nick];
+  var last;
+
+  if (index !== undefined) {
+    // Move the last user in place of the removed one, so that the list
+    // doesn't have to be shifted.
+    last = this._presence.pop();
+    if (last.nick !== nick) {
+      this._presence[index] = last;
+      this._presenceIndex[last.nick] = index;
+    }
+    delete this._presenceIndex[nick];
+    this._snapshot = undefined;
+  }
+
   delete this.users[nick];
   this.emit("remove", user);
   return this;
@@ -246,6 +489,110 @@ UserList.prototype.toJSON = function(users) {
   });
 };
 
+/**
+ * Get the list of the users, as sent to the clients.
+ *
+ * The same list is returned until a user is added or removed, along with
+ * its serialized form in a `_json` property (see `serializeEvents`), so
+ * that sending it to many users costs neither allocations nor
+ * serializations. Don't modify it.
+ *
+ * @return {Array}
+ */
+UserList.prototype.presence = function() {
+  if (!this._snapshot) {
+    this._snapshot = this._presence.slice();
+    Object.defineProperty(this._snapshot, "_json", {
+      value: JSON.stringify(this._snapshot)
+    });
+  }
+
+  return this._snapshot;
+};
+
+/**
+ * Get the bucket of the distribution of the queue depths a depth falls
+ * in: "0", "1", "2-3", "4-7", etc.
+ *
+ * @param {Number} depth
+ * @return {String}
+ */
+function depthBucket(depth) {
+  var low = 1;
+
+  if (depth < 2)
+    return String(depth);
+
+  while (low * 2 <= depth)
+    low *= 2;
+  return low + "-" + (low * 2 - 1);
+}
+
+/**
+ * Get statistics about the event queues of the users, i.e. how many
+ * events are waiting to be sent and roughly how much memory they use.
+ *
+ * `bytes` is the size of the queued events once serialized, which is
+ * computed on demand: don't call this for every request.
+ *
+ * `depths` is the number of users for each range of queue depths (see
+ * `depthBucket`), `pending` the number of users with a pending long
+ * polling request, and `pushed` the number of users their events are
+ * pushed to.
+ *
+ * @return {Object}
+ */
+UserList.prototype.queueStats = function() {
+  var stats = {
+    users: 0,
+    events: 0,
+    maxDepth: 0,
+    bytes: 0,
+    dropped: this.dropped,
+    maxLength: config.EVENT_QUEUE_MAX_LENGTH,
+    depths: {},
+    pending: 0,
+    pushed: 0
+  };
+
+  this.forEach(function(user) {
+    var depth = user.events.length;
+    var bucket = depthBucket(depth);
+    stats.users += 1;
+    stats.events += depth;
+    stats.maxDepth = Math.max(stats.maxDepth, depth);
+    stats.depths[bucket] = (stats.depths[bucket] || 0) + 1;
+    if (depth)
+      stats.bytes += JSON.stringify(user.events).length;
+    if (user._pending && !user._pending.resolved)
+      stats.pending += 1;
+    if (user._push)
+      stats.pushed += 1;
+  });
+
+  return stats;
+};
+
+/**
+ * Serialize a list of events, like JSON.stringify does, but reusing the
+ * serialized form of their data when it is available (see
+ * `UserList#presence`).
+ *
+ * @param {Array} events
+ * @return {String}
+ */
+function serializeEvents(events) {
+  return "[" + events.map(function(event) {
+    if (!event.data || event.data._json === undefined)
+      return JSON.stringify(event);
+
+    return '{"topic":' + JSON.stringify(event.topic) +
+           ',"data":' + event.data._json + '}';
+  }).join(",") + "]";
+}
+
+module.exports.serializeEvents = serializeEvents;
 module.exports.Waiter = Waiter;
+module.exports._timers = timers;
 module.exports.UserList = UserList;
 module.exports.User = User;
@@ -1,4 +1,4 @@
-/* global importScripts, BackboneEvents, HTTP */
+/* global importScripts, BackboneEvents, HTTP, EventSource */
 /* jshint unused:false */
 
 /**
@@ -11,6 +11,12 @@ var Server = (function() {
     this.options = options;
     this.http = new HTTP();
     this.currentXHR = undefined;
+    this.currentSource = undefined;
+
+    // Get the events pushed over /events where EventSource is available,
+    // else long poll /stream.
+    this.push = options && options.push !== undefined ?
+      options.push : typeof EventSource !== "undefined";
 
     this.connectionAttempts = 0;
     this.reconnectOnError = options && options.reconnectOnError;
@@ -25,6 +31,9 @@ var Server = (function() {
 
   Server.prototype = {
     connect: function() {
+      if (this.push)
+        return this._connectPush();
+
       // XXX Timeout value to depend on LONG_POLLING_TIMEOUT.
       var xhr = this.http.post("/stream", {firstRequest: true, timeout: 21000},
         function(err, response) {
@@ -71,22 +80,69 @@ var Server = (function() {
     disconnect: function() {
       if (this.currentXHR)
         this.currentXHR.abort();
+      if (this.currentSource) {
+        this.currentSource.close();
+        this.currentSource = undefined;
+      }
     },
 
     signout: function() {
       this.http.post("/signout", {});
     },
 
-    _longPolling: function(events) {
+    /**
+     * Connect to /events, which pushes the events as they happen.
+     *
+     * If the connection can't be opened at all (e.g. a proxy in the way,
+     * or the user isn't signed in), fall back to long polling for good,
+     * which also tells the two apart. Once it was opened, errors are
+     * handled like long polling ones rather than by the automatic
+     * reconnection of EventSource.
+     */
+    _connectPush: function() {
+      var source = new EventSource("/events");
+      var opened = false;
+      this.currentSource = source;
+
+      source.onopen = function() {
+        opened = true;
+        this.trigger("connected");
+        this.connectionAttempts = 0;
+      }.bind(this);
+
+      source.onmessage = function(event) {
+        this._dispatch(JSON.parse(event.data));
+      }.bind(this);
+
+      source.onerror = function() {
+        source.close();
+        this.currentSource = undefined;
+        if (opened)
+          return this.trigger("network-error");
+
+        this.push = false;
+        this.connect();
+      }.bind(this);
+    },
+
+    _dispatch: function(events) {
       events.forEach(function(event) {
         this.trigger("message", event.topic, event.data);
       }.bind(this));
+    },
+
+    _longPolling: function(events) {
+      this._dispatch(events);
 
       // XXX Timeout value to depend on LONG_POLLING_TIMEOUT.
       this.currentXHR =
         this.http.post("/stream", {timeout: 21000}, function(err, response) {
           if (err === 400)
             return this.trigger("unauthorized", response);
+          // The server dropped events it couldn't keep for us: start over
+          // with a first request, which gets us back in sync.
+          if (err === 409)
+            return this.connect();
           if (err !== null)
             return this.trigger("network-error", response);
 
@@ -0,0 +1,83 @@
+/* global mocha */
+/* jshint unused:false */
+"use strict";
+
+/**
+ * Exposes the results of a mocha test page as `window.testReport`, so that
+ * the test runner (test_frontend_all.py) can read them in one go rather
+ * than scraping the DOM of the HTML reporter.
+ *
+ * Once the tests are done, the report has:
+ *
+ * - complete: true
+ * - passes, failures: the number of tests which passed and failed
+ * - errors: the full title and message of each failure
+ * - coverage: for each file covered by blanket, the number of lines which
+ *   can be covered, and the numbers of the lines which were
+ */
+var testReport = (function() {
+  var report = {
+    complete: false,
+    passes: 0,
+    failures: 0,
+    errors: [],
+    coverage: {}
+  };
+  var callbacks = [];
+
+  function getCoverage() {
+    var files = window._$blanket || {};
+    var coverage = {};
+
+    Object.keys(files).forEach(function(name) {
+      var lines = files[name];
+      var file = coverage[name] = {lines: 0, covered: []};
+
+      for (var line = 0; line < lines.length; line++) {
+        if (lines[line] === undefined)
+          continue;
+        file.lines += 1;
+        if (lines[line] > 0)
+          file.covered.push(line);
+      }
+    });
+
+    return coverage;
+  }
+
+  /**
+   * Call `callback` with the report once the tests are done.
+   *
+   * @param {Function} callback
+   */
+  report.whenComplete = function(callback) {
+    if (report.complete)
+      return callback(report);
+    callbacks.push(callback);
+  };
+
+  var originalReporter = mocha._reporter;
+
+  mocha.reporter(function(runner) {
+    originalReporter(runner);
+
+    runner.on('pass', function() {
+      report.passes += 1;
+    });
+
+    runner.on('fail', function(test, err) {
+      report.failures += 1;
+      report.errors.push({title: test.fullTitle(), message: String(err)});
+    });
+
+    runner.on('end', function() {
+      report.coverage = getCoverage();
+      report.complete = true;
+      callbacks.forEach(function(callback) {
+        callback(report);
+      });
+    });
+  });
+
+  return report;
+})();
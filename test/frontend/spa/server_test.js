@@ -8,7 +8,7 @@ describe("Server", function() {
   beforeEach(function() {
     sandbox = sinon.sandbox.create();
     sandbox.stub(window, "WebSocket").returns({send: sinon.spy()});
-    server = new Server({reconnectOnError: false});
+    server = new Server({reconnectOnError: false, push: false});
   });
 
   afterEach(function() {
@@ -80,10 +80,86 @@ describe("Server", function() {
 
   });
 
+  describe("#connect with push", function() {
+    var source;
+
+    beforeEach(function() {
+      source = {close: sinon.spy()};
+      sandbox.stub(window, "EventSource").returns(source);
+      server = new Server({reconnectOnError: false, push: true});
+    });
+
+    it("should open an event source on /events", function() {
+      server.connect();
+
+      sinon.assert.calledOnce(window.EventSource);
+      sinon.assert.calledWithExactly(window.EventSource, "/events");
+    });
+
+    it("should trigger a connected event once the source is open",
+      function(done) {
+        server.on("connected", function() {
+          done();
+        });
+
+        server.connect();
+        source.onopen();
+      });
+
+    it("should trigger a message event for each pushed event",
+      function() {
+        var messages = [];
+        server.on("message", function(topic, data) {
+          messages.push([topic, data]);
+        });
+
+        server.connect();
+        source.onmessage({data: JSON.stringify([
+          {topic: "first", data: "event 1"},
+          {topic: "second", data: "event 2"}
+        ])});
+
+        expect(messages).to.deep.equal([["first", "event 1"],
+                                        ["second", "event 2"]]);
+      });
+
+    it("should trigger a network-error event if the source fails after " +
+      "being opened", function(done) {
+        server.on("network-error", function() {
+          sinon.assert.calledOnce(source.close);
+          done();
+        });
+
+        server.connect();
+        source.onopen();
+        source.onerror();
+      });
+
+    it("should fall back to long polling if the source can't be opened",
+      function() {
+        sandbox.stub(server.http, "post");
+
+        server.connect();
+        source.onerror();
+
+        expect(server.push).to.equal(false);
+        sinon.assert.calledOnce(server.http.post);
+        sinon.assert.calledWith(server.http.post, "/stream");
+      });
+
+    it("should close the source on disconnect", function() {
+      server.connect();
+      server.disconnect();
+
+      sinon.assert.calledOnce(source.close);
+    });
+
+  });
+
   describe("#reconnect", function() {
 
     beforeEach(function() {
-      server = new Server();
+      server = new Server({push: false});
       // Monkey-patch setTimeout to be a sync operation.
       sandbox.stub(window, "setTimeout", function(fn) {
         fn();
@@ -164,6 +240,34 @@ describe("Server", function() {
         server._longPolling([]);
       });
 
+    it("should connect again if the request returns a 409", function() {
+      var networkError = sinon.spy();
+      sandbox.stub(server, "connect");
+      sandbox.stub(server.http, "post", function(method, data, callback) {
+        callback(409, "conflict");
+      });
+      server.on("network-error", networkError);
+
+      server._longPolling([]);
+
+      sinon.assert.calledOnce(server.connect);
+      sinon.assert.notCalled(networkError);
+    });
+
+    it("should send a first request when connecting again after a 409",
+      function() {
+        sandbox.stub(server.http, "post", function(method, data, callback) {
+          if (!data.firstRequest)
+            callback(409, "conflict");
+        });
+
+        server._longPolling([]);
+
+        sinon.assert.calledTwice(server.http.post);
+        sinon.assert.calledWith(server.http.post, "/stream",
+                                sinon.match({firstRequest: true}));
+      });
+
     it("should trigger a message event for each event", function(done) {
       var nbCall = 1;
       var events = [
@@ -11,7 +11,7 @@ describe("TalkillaSPA", function() {
   beforeEach(function() {
     sandbox = sinon.sandbox.create();
     port = new SPAPort();
-    server = new Server();
+    server = new Server({push: false});
     spa = new TalkillaSPA(port, server, {capabilities: ["call", "move"]});
   });
 
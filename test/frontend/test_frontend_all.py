@@ -1,6 +1,7 @@
+import json
 import os
-import signal
-import subprocess
+import Queue
+import threading
 import unittest
 
 # some of our helper models are in the test/functional dir, so we need to add
@@ -8,84 +9,173 @@ import unittest
 import sys
 sys.path.insert(1, sys.path[0] + "/../functional")
 import driver
-
-
-SERVER_PREFIX = 'http://localhost:3000/test/frontend/'
+from node_server import NodeServer
+
+
+SERVER_PREFIX = driver.BASE_APP_URL + '/test/frontend/'
+
+PAGES = ["index.html",
+         "addressbook/index.html",
+         "chat/index.html",
+         "appport/index.html",
+         "sidebar/index.html",
+         "webrtc/index.html",
+         "worker/index.html",
+         "spa/index.html",
+         "instant-share/index.html"]
+
+# How many browsers run the pages at the same time. With more than one, all
+# the pages are run as the suite starts, and the tests check their results.
+FRONTEND_JOBS = int(os.getenv("FRONTEND_JOBS", 1))
+
+# How long the tests of a page may take, in seconds.
+PAGE_TIMEOUT = 60
+
+# Gets the report of the page once its tests are done, see report.js.
+REPORT_SCRIPT = """
+    var done = arguments[0];
+    testReport.whenComplete(function(report) {
+      done(JSON.stringify(report));
+    });
+"""
+
+
+def create_driver():
+    drvr = driver.create()
+    drvr.set_script_timeout(PAGE_TIMEOUT)
+    return drvr
+
+
+def run_page(drvr, page):
+    """Loads a test page and returns its report once its tests are done."""
+    drvr.get(SERVER_PREFIX + page)
+    return json.loads(drvr.execute_async_script(REPORT_SCRIPT))
+
+
+def run_pages(pages, jobs):
+    """Runs the pages in `jobs` browsers at the same time.
+
+    Returns a dict of the reports by page, or of the exception raised while
+    running the page.
+    """
+    queue = Queue.Queue()
+    for page in pages:
+        queue.put(page)
+    reports = {}
+
+    def work(drvr):
+        while True:
+            try:
+                page = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                reports[page] = run_page(drvr, page)
+            except Exception as e:
+                reports[page] = e
+
+    drivers = [create_driver() for i in range(min(jobs, len(pages)))]
+    try:
+        threads = [threading.Thread(target=work, args=(drvr,))
+                   for drvr in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for drvr in drivers:
+            drvr.quit()
+    return reports
+
+
+def merge_coverage(reports):
+    """Merges the coverage of several reports: a line is covered if it is
+    by any of the pages."""
+    files = {}
+    for report in reports:
+        for name, coverage in report["coverage"].items():
+            merged = files.setdefault(name, {"lines": coverage["lines"],
+                                             "covered": set()})
+            merged["covered"].update(coverage["covered"])
+    return files
+
+
+def format_coverage(files):
+    lines = sum(coverage["lines"] for coverage in files.values())
+    covered = sum(len(coverage["covered"]) for coverage in files.values())
+    if not lines:
+        return "n/a"
+    return "%.2f %% (%d/%d lines)" % (covered * 100. / lines, covered, lines)
 
 
 class FrontEndSuite(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        # XXX: we should DRY-ify the server startup via python
-        # scripts. For now we do that in:
-        #   - test/frontend/test_frontend_all.py
-        #   - test/functional/browser_test.py
-        cmd = ("node", "app.js")
-        env = os.environ.copy()
-        env.update({"PORT": "3000",
-                    "NO_LOCAL_CONFIG": "true",
-                    "NODE_ENV": "test",
-                    "SESSION_SECRET": "unguessable"})
-        cls.node_app = subprocess.Popen(cmd, env=env)
-        cls.drvr = driver.create()
-        cls.drvr.implicitly_wait(20)
+        cls.node_app = NodeServer().start()
+        cls.drvr = None
+        cls.reports = {}
+        if FRONTEND_JOBS > 1:
+            cls.reports.update(run_pages(PAGES, FRONTEND_JOBS))
+        else:
+            cls.drvr = create_driver()
 
     @classmethod
     def tearDownClass(cls):
-        cls.drvr.quit()
-        os.kill(cls.node_app.pid, signal.SIGTERM)
-
-    def check_page(self, url):
-        self.drvr.get(url)
-        self.drvr.find_element_by_id('complete')
-        self.check_coverage()
-        failNode = self.drvr.find_element_by_css_selector('.failures > em')
-        if failNode.text == "0":
-            return
-        raise AssertionError(self.get_failure_details())
-
-    def check_coverage(self):
-        coverage = self.drvr.find_element_by_css_selector(
-            '.grand-total .bl-cl.rs').text
-        print("\n  Code coverage: %s" % coverage)
-
-    def get_failure_details(self):
-        fail_nodes = self.drvr.find_elements_by_css_selector('.test.fail')
-        details = ["%d failure(s) encountered:" % len(fail_nodes)]
-        for node in fail_nodes:
-            details.append(
-                node.find_element_by_tag_name('h2').text.split("\n")[0])
-            details.append(
-                node.find_element_by_css_selector('.error').text)
+        if cls.drvr is not None:
+            cls.drvr.quit()
+        cls.node_app.stop()
+        reports = [report for report in cls.reports.values()
+                   if isinstance(report, dict)]
+        if len(reports) > 1:
+            print("\n  Code coverage of %d pages: %s" % (
+                len(reports), format_coverage(merge_coverage(reports))))
+
+    def check_page(self, page):
+        if page not in self.reports:
+            self.reports[page] = run_page(self.drvr, page)
+        report = self.reports[page]
+        if isinstance(report, Exception):
+            raise report
+
+        print("\n  Code coverage: %s" % format_coverage(
+            merge_coverage([report])))
+        if report["failures"]:
+            raise AssertionError(self.get_failure_details(report))
+
+    def get_failure_details(self, report):
+        details = ["%d failure(s) encountered:" % report["failures"]]
+        for error in report["errors"]:
+            details.append(error["title"])
+            details.append(error["message"])
         return "\n".join(details)
 
     def test_index_html(self):
-        self.check_page(SERVER_PREFIX + "index.html")
+        self.check_page("index.html")
 
     def test_addressbook_index_html(self):
-        self.check_page(SERVER_PREFIX + "addressbook/index.html")
+        self.check_page("addressbook/index.html")
 
     def test_chat_index_html(self):
-        self.check_page(SERVER_PREFIX + "chat/index.html")
+        self.check_page("chat/index.html")
 
     def test_port_html(self):
-        self.check_page(SERVER_PREFIX + "appport/index.html")
+        self.check_page("appport/index.html")
 
     def test_sidebar_html(self):
-        self.check_page(SERVER_PREFIX + "sidebar/index.html")
+        self.check_page("sidebar/index.html")
 
     def test_webrtc_index_html(self):
-        self.check_page(SERVER_PREFIX + "webrtc/index.html")
+        self.check_page("webrtc/index.html")
 
     def test_worker_index_html(self):
-        self.check_page(SERVER_PREFIX + "worker/index.html")
+        self.check_page("worker/index.html")
 
     def test_spa_index_html(self):
-        self.check_page(SERVER_PREFIX + "spa/index.html")
+        self.check_page("spa/index.html")
 
     def test_instant_share_index_html(self):
-        self.check_page(SERVER_PREFIX + "instant-share/index.html")
+        self.check_page("instant-share/index.html")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
-import signal
-import subprocess
 import unittest
 import functools
 import ipdb
@@ -11,6 +8,10 @@ import sys
 
 from selenium.common.exceptions import TimeoutException
 
+from node_server import NodeServer
+import budgets
+import profiler
+
 
 # With debug_on, you can add a line prior to your test function
 # which will enable you to catch test exceptions, and automatically
@@ -45,11 +46,54 @@ def output_base64_screenshot(driver):
     print("data:image/png;base64," + driver.get_screenshot_as_base64())
 
 
-def kill_app(app):
-    os.kill(app.pid, signal.SIGTERM)
+# Failure messages of the checks of BrowserTest.assertElements, formatted
+# with the selector, the arguments of the check and the actual value.
+CHECK_MESSAGES = {
+    "count": u"{0} does not contain {1} elements; got {2}",
+    "visible": u"{0} is not visible, it should be",
+    "notVisible": u"{0} is visible, it shouldn't be",
+    "inView": u"{0} is completely out of view",
+    "textContains": u'{0} inner text does not contain "{1}"; got "{2}"',
+    "textEquals": u'{0} inner text does not equal "{1}"; got "{2}"',
+    "attributeEquals": u'{0} attribute {1} does not equal "{2}"; got "{3}"',
+    "hasClass": u'{0} does not contain class name {1}; got "{2}"',
+    "hasNoClass": u"{0} contains class name {1}",
+    "property": u'{0} property {1} does not equal "{2}"; got "{3}"',
+}
 
 
 class BrowserTest(unittest.TestCase):
+    def run(self, result=None):
+        if not profiler.enabled:
+            return super(BrowserTest, self).run(result)
+        return profiler.profile_test(
+            self, lambda: super(BrowserTest, self).run(result))
+
+    def assertElements(self, driver, checks, timeout=None):
+        """ Asserts a list of expectations on the DOM of the current frame
+        at once, in a single round trip to the browser rather than a few for
+        each of them (see Driver.checkElements for the checks). Waits for
+        the checks to pass like the individual assertions wait for their
+        element, and reports every check which failed:
+
+            self.assertElements(driver, [
+                (".alert-info", "count", 0),
+                ("strong.username", "textEquals", "bob"),
+                ("#signout", "visible")])
+        """
+        results = driver.checkElements(checks, timeout=timeout)
+        failures = []
+        for check, result in zip(checks, results):
+            if result["ok"]:
+                continue
+            if not result["found"]:
+                failures.append(u"No element matching %s" % check[0])
+                continue
+            args = (check[0],) + tuple(check[2:]) + (result["actual"],)
+            failures.append(CHECK_MESSAGES[check[1]].format(*args))
+        if failures:
+            raise AssertionError(u"\n".join(failures))
+
     def assertChatMessageContains(self, driver, message, nick, line=1):
         driver.switchToChatWindow(nick)
         css_selector = "#textchat li"
@@ -247,15 +291,18 @@ class BrowserTest(unittest.TestCase):
                 css_selector, length))
 
     def assertIncomingCall(self, driver):
-        self.assertElementVisible(driver, ".incoming-text")
+        self.assertElements(driver, [(".incoming-text", "visible")],
+                            timeout=budgets.current.get("call"))
 
     def assertOngoingCall(self, driver):
-        self.assertElementVisible(driver, "#call")
-        self.assertElementVisible(driver, "#local-media")
-        self.assertElementVisible(driver, "#remote-media")
+        self.assertElements(driver, [("#call", "visible"),
+                                     ("#local-media", "visible"),
+                                     ("#remote-media", "visible")],
+                            timeout=budgets.current.get("call"))
 
     def assertPendingOutgoingCall(self, driver):
-        self.assertElementVisible(driver, ".btn-abort")
+        self.assertElements(driver, [(".btn-abort", "visible")],
+                            timeout=budgets.current.get("call"))
 
     def assertConversationPresenceIconShows(self, driver, state):
         self.assertElementsCount(
@@ -264,15 +311,18 @@ class BrowserTest(unittest.TestCase):
             1)
 
     def assertCallTimedOut(self, driver):
-        self.assertElementVisible(driver, ".btn-call-again")
+        self.assertElements(driver, [(".btn-call-again", "visible")],
+                            timeout=budgets.current.callTimeout())
 
     def assertSignedInAs(self, driver, username):
         driver.switchToSidebar()
         # We might have just reloaded, so wait a bit in case it
         # isn't there yet.
         driver.clickElement("#gear-menu-tab>a")
-        self.assertElementTextEquals(driver, "strong.username", username, True)
-        self.assertElementVisible(driver, "#signout")
+        self.assertElements(driver, [
+            ("strong.username", "visible"),
+            ("strong.username", "textEquals", username),
+            ("#signout", "visible")])
 
     def assertSignedOut(self, driver):
         driver.switchToSidebar()
@@ -285,26 +335,26 @@ class BrowserTest(unittest.TestCase):
 
     def assertChatWindowOpen(self, driver, nick):
         try:
-            driver.switchToChatWindow(nick, timeout=1)
+            driver.switchToChatWindow(nick, timeout=1, cached=False)
         except TimeoutException:
             raise AssertionError('The Chat Window is not open')
 
     def assertChatWindowClosed(self, driver, nick):
         try:
-            driver.switchToChatWindow(nick, timeout=1)
+            driver.switchToChatWindow(nick, timeout=1, cached=False)
             raise AssertionError('The Chat Window is not closed')
         except TimeoutException:
             pass
 
     def assertUsersListed(self, driver, users):
         driver.switchToSidebar()
-        for user in users:
-            self.assertElementVisible(driver, '#users a[rel="%s"]' % user)
+        self.assertElements(driver, [('#users a[rel="%s"]' % user, "visible")
+                                     for user in users])
 
     def assertUsersNotListed(self, driver, users):
         driver.switchToSidebar()
-        for user in users:
-            self.assertElementNotVisible(driver, '#users a[rel="%s"]' % user)
+        self.assertElements(driver, [('#users a[rel="%s"]' % user,
+                                      "notVisible") for user in users])
 
     def getInstantShareLink(self, driver):
         element = driver.find_element_by_id("link-share-input")
@@ -312,28 +362,16 @@ class BrowserTest(unittest.TestCase):
         return link
 
 
-# XXX: we should DRY-ify the server startup via python
-# scripts. For now we do that in:
-#   - test/frontend/test_frontend_all.py
-#   - test/functional/browser_test.py
-SERVER_COMMAND = ("node", "app.js")
-SERVER_ENV = os.environ.copy()
-SERVER_ENV.update({"PORT": "3000",
-                   "NO_LOCAL_CONFIG": "true",
-                   "NODE_ENV": "test",
-                   "SESSION_SECRET": "unguessable"})
-
-
 # SingleNodeBrowserTest is used for starting up a single
 # node instance that is used for all tests in a test class.
 class SingleNodeBrowserTest(BrowserTest):
     @classmethod
     def setUpClass(cls):
-        cls.node_app = subprocess.Popen(SERVER_COMMAND, env=SERVER_ENV)
+        cls.node_app = NodeServer().start()
 
     @classmethod
     def tearDownClass(cls):
-        os.kill(cls.node_app.pid, signal.SIGTERM)
+        cls.node_app.stop()
 
 
 # MultipleNodeBrowserTest is used for starting up a
@@ -342,8 +380,8 @@ class MultipleNodeBrowserTest(BrowserTest):
     node_app = None
 
     def setUp(self):
-        self.node_app = subprocess.Popen(SERVER_COMMAND, env=SERVER_ENV)
-        self.addCleanup(kill_app, self.node_app)
+        self.node_app = NodeServer().start()
+        self.addCleanup(self.node_app.stop)
 
     def tearDown(self):
-        kill_app(self.node_app)
+        self.node_app.stop()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""How long the functional tests wait for things, on this machine.
+
+Without calibration, every wait gets the static DEFAULT_WAIT_TIMEOUT, which
+has to fit the slowest machine the tests run on. `calibrate.py` measures how
+long signing in, loading a frame, updating an element and setting up a call
+take here, and saves it; the waits of each kind then get a few times that:
+
+    $ make selenium-calibrate
+
+Waits which take a good share of their budget are reported on stderr, so
+that budgets getting tight show up before the tests start failing.
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+from config import testConfig
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CALIBRATION_FILE = os.getenv("TALKILLA_CALIBRATION",
+                             os.path.join(HERE, "calibration.json"))
+
+# What calibrate.py measures.
+OPERATIONS = ("signin", "frame", "element", "call")
+
+DEFAULT_WAIT_TIMEOUT = testConfig['DEFAULT_WAIT_TIMEOUT']
+PENDING_CALL_TIMEOUT = testConfig['PENDING_CALL_TIMEOUT'] / 1000.
+
+# An operation may take this many times its measured latency...
+MARGIN = 5
+# ...but is always given at least this, in seconds.
+MINIMUM = 1.
+# Waits taking more than this share of their budget are reported.
+WARN_RATIO = .5
+
+
+class Budgets(object):
+    """ The wait budgets, in seconds, from the latencies measured by
+        calibrate.py.
+    """
+    def __init__(self, measured=None, default=DEFAULT_WAIT_TIMEOUT):
+        self.measured = measured or {}
+        self.default = default
+
+    def get(self, operation):
+        if operation not in self.measured:
+            return self.default
+        return max(self.measured[operation] * MARGIN, MINIMUM)
+
+    def callTimeout(self):
+        """ How long to wait for a call to time out, which happens after
+            PENDING_CALL_TIMEOUT in the app.
+        """
+        return PENDING_CALL_TIMEOUT + self.get("call")
+
+    def check(self, operation, what, elapsed, budget):
+        if elapsed > budget * WARN_RATIO:
+            sys.stderr.write("%s took %.2fs out of its %.2fs %s budget\n" % (
+                what, elapsed, budget, operation))
+
+    @contextlib.contextmanager
+    def timing(self, operation, what, budget):
+        """ Reports the wrapped wait if it gets close to `budget`, or goes
+            over it.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.check(operation, what, time.time() - start, budget)
+
+
+def load(path=CALIBRATION_FILE):
+    """ Returns the budgets from the calibration file, or the static ones
+        if there's none.
+    """
+    if not os.path.exists(path):
+        return Budgets()
+    with open(path) as calibration:
+        return Budgets(json.load(calibration)["measured"])
+
+
+def save(measured, path=CALIBRATION_FILE):
+    with open(path, "w") as calibration:
+        json.dump({"measured": measured, "date": time.time()}, calibration,
+                  indent=2)
+
+
+current = load()
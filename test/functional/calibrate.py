@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures how long the functional tests have to wait on this machine.
+
+Runs a few calls between two browsers, timing signing in, loading a chat
+window, updating the UI and setting up a call, and saves the slowest of
+each to the calibration file the wait budgets are read from (see
+budgets.py)::
+
+    $ python test/functional/calibrate.py -n 3
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import budgets  # NOQA
+import driver  # NOQA
+from node_server import NodeServer  # NOQA
+
+
+def timed(samples, operation, f, *args, **kwargs):
+    start = time.time()
+    f(*args, **kwargs)
+    samples[operation].append(time.time() - start)
+
+
+def measure(runs):
+    """Returns the longest time each operation took over `runs` calls."""
+    samples = dict((operation, []) for operation in budgets.OPERATIONS)
+    # Measure with the static timeouts, whatever was calibrated before.
+    budgets.current = budgets.Budgets()
+
+    server = NodeServer().start()
+    bob = larry = None
+    try:
+        bob = driver.create("bob")
+        larry = driver.create("larry")
+        for run in range(runs):
+            # reset() forgets the nicks at the end of every call.
+            bob.nick, larry.nick = "bob", "larry"
+            timed(samples, "signin", bob.signin)
+            timed(samples, "signin", larry.signin)
+
+            bob.openConversationWith("larry")
+            bob.startCall(True)
+            timed(samples, "element", bob.waitForElement, ".btn-abort",
+                  visible=True)
+
+            timed(samples, "frame", larry.switchToChatWindow, "bob")
+            timed(samples, "call", larry.waitForElement, ".incoming-text",
+                  visible=True)
+            larry.acceptCall()
+            timed(samples, "call", bob.waitForElement, "#remote-media",
+                  visible=True)
+
+            bob.hangupCall()
+            bob.reset()
+            larry.reset()
+    finally:
+        for browser in bob, larry:
+            if browser is not None:
+                browser.quit()
+        server.stop()
+
+    return dict((operation, max(times))
+                for operation, times in samples.items())
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--runs', type=int, default=3,
+                        help='number of calls to measure '
+                             '(default: %(default)s)')
+    parser.add_argument('-o', '--output', default=budgets.CALIBRATION_FILE,
+                        help='calibration file (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    measured = measure(options.runs)
+    budgets.save(measured, options.output)
+
+    calibrated = budgets.Budgets(measured)
+    for operation in budgets.OPERATIONS:
+        print('%-8s %6.2fs, budget %6.2fs (was %.2fs)' % (
+            operation, measured[operation], calibrated.get(operation),
+            budgets.DEFAULT_WAIT_TIMEOUT))
+    print('Saved to %s' % options.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,31 +1,365 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import contextlib
+import json
 import os
+import re
+import time
 
 from selenium.common.exceptions import NoSuchElementException, \
-    InvalidElementStateException, TimeoutException, WebDriverException
+    InvalidElementStateException, NoSuchFrameException, \
+    NoSuchWindowException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.remote.command import Command
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.support.ui import WebDriverWait
-from config import testConfig
+from node_server import SERVER_PORT
+import budgets
+import profiler
 
 SELENIUM_COMMAND_EXECUTOR = os.getenv("SELENIUM_COMMAND_EXECUTOR",
                                       "http://127.0.0.1:4444/wd/hub")
-BASE_APP_URL = "http://localhost:3000"
-DEFAULT_WAIT_TIMEOUT = testConfig['DEFAULT_WAIT_TIMEOUT']
+# The server the tests run against can be on another port, e.g. to run
+# several of them at the same time (see parallel.py).
+DEFAULT_APP_URL = "http://localhost:3000"
+BASE_APP_URL = "http://localhost:%d" % SERVER_PORT
+USER_PREFS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "user.js")
+# Set REUSE_BROWSERS=0 to get a new browser for every test, e.g. when
+# tracking down state leaking from one test to the next.
+REUSE_BROWSERS = os.getenv("REUSE_BROWSERS", "1") != "0"
+# How the waits for elements are done: "observe" lets the page tell us
+# when the condition is met, "poll" checks it every .25s over the wire.
+WAIT_MODE = os.getenv("WAIT_MODE", "observe")
+
+# Commands after which we can't tell which frame the driver is in.
+CONTEXT_COMMANDS = (Command.SWITCH_TO_FRAME, Command.SWITCH_TO_WINDOW,
+                    Command.GET, Command.REFRESH, Command.GO_BACK,
+                    Command.GO_FORWARD, Command.CLOSE, Command.QUIT)
+
+# WebDriver's default timeout for asynchronous scripts, in seconds, which
+# the waits restore once they are done.
+DEFAULT_SCRIPT_TIMEOUT = 30
+
+# Whether an element is displayed, shared by WAIT_SCRIPT and CHECK_SCRIPT.
+IS_VISIBLE_SCRIPT = """
+    function isVisible(el) {
+      if (!el.offsetWidth && !el.offsetHeight && !el.getClientRects().length)
+        return false;
+      for (var node = el; node && node.nodeType === 1;
+           node = node.parentNode) {
+        var style = window.getComputedStyle(node);
+        if (style.display === "none" || style.opacity === "0")
+          return false;
+      }
+      return window.getComputedStyle(el).visibility !== "hidden";
+    }
+"""
+
+# Waits in the page for a condition on the DOM, and calls back once it is
+# true. A MutationObserver catches the DOM changes, and a short timer the
+# changes which aren't mutations (layout, media element properties...).
+# WebDriver gives up when the script timeout is reached.
+WAIT_SCRIPT = """
+    var kind = arguments[0], selector = arguments[1],
+        done = arguments[arguments.length - 1];
+""" + IS_VISIBLE_SCRIPT + """
+    var conditions = {
+      elements: function(visible) {
+        var el = document.querySelector(selector);
+        if (visible === true)
+          return !!el && isVisible(el);
+        if (visible === false)
+          return !el || !isVisible(el);
+        return !!el;
+      },
+      property: function(name, value) {
+        var el = document.querySelector(selector);
+        return !!el && String(el[name]) === value;
+      }
+    };
+
+    var args = Array.prototype.slice.call(arguments, 2, -1);
+    function check() {
+      return conditions[kind].apply(null, args);
+    }
+
+    if (check())
+      return done(true);
+
+    var observer, interval;
+    function recheck() {
+      if (!check())
+        return;
+      observer.disconnect();
+      clearInterval(interval);
+      done(true);
+    }
+    observer = new MutationObserver(recheck);
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true, characterData: true});
+    interval = setInterval(recheck, 50);
+"""
+
+# Checks a list of expectations on the DOM in one go, see checkElements.
+# Each check is [selector, name, args...]; the script calls back with one
+# {ok, found, actual} result per check, once they all pass or after `wait`
+# milliseconds.
+CHECK_SCRIPT = """
+    var checks = arguments[0], wait = arguments[1],
+        done = arguments[arguments.length - 1];
+""" + IS_VISIBLE_SCRIPT + """
+    // At least one of the corners of the element can be seen, see
+    // BrowserTest.assertElementVisibleAndInView.
+    function isInView(el) {
+      var rect = el.getBoundingClientRect(),
+          docEl = document.documentElement,
+          vWidth = window.innerWidth || docEl.clientWidth,
+          vHeight = window.innerHeight || docEl.clientHeight;
+      if (rect.right < 0 || rect.bottom < 0 || rect.left > vWidth ||
+          rect.top > vHeight)
+        return false;
+      return [[rect.left, rect.top], [rect.right, rect.top],
+              [rect.right, rect.bottom], [rect.left, rect.bottom]]
+        .some(function(point) {
+          var eap = document.elementFromPoint(point[0], point[1]);
+          return eap === el || el.contains(eap);
+        });
+    }
+
+    function text(el) {
+      return el.textContent.replace(/\\s+/g, " ").trim();
+    }
+
+    function classes(el) {
+      return el.getAttribute("class") || "";
+    }
+
+    // Each check gets the matching elements and returns [ok, actual].
+    var checkers = {
+      count: function(els, length) {
+        return [els.length === length, els.length];
+      },
+      visible: function(els) {
+        return [isVisible(els[0]), false];
+      },
+      notVisible: function(els) {
+        return [!isVisible(els[0]), true];
+      },
+      inView: function(els) {
+        return [isVisible(els[0]) && isInView(els[0]), false];
+      },
+      textContains: function(els, value) {
+        return [text(els[0]).indexOf(value) !== -1, text(els[0])];
+      },
+      textEquals: function(els, value) {
+        return [text(els[0]) === value, text(els[0])];
+      },
+      attributeEquals: function(els, name, value) {
+        var attr = els[0].getAttribute(name);
+        return [attr === value, attr];
+      },
+      hasClass: function(els, name) {
+        return [classes(els[0]).split(" ").indexOf(name) !== -1,
+                classes(els[0])];
+      },
+      hasNoClass: function(els, name) {
+        return [classes(els[0]).split(" ").indexOf(name) === -1,
+                classes(els[0])];
+      },
+      property: function(els, name, value) {
+        return [String(els[0][name]) === value, String(els[0][name])];
+      }
+    };
+
+    function run() {
+      return checks.map(function(check) {
+        var els = document.querySelectorAll(check[0]);
+        // all the checks but count need an element to look at
+        if (check[1] !== "count" && !els.length)
+          return {ok: false, found: false, actual: null};
+        var result = checkers[check[1]].apply(
+          null, [els].concat(check.slice(2)));
+        return {ok: result[0], found: true, actual: result[1]};
+      });
+    }
+
+    function passed(results) {
+      return results.every(function(result) {
+        return result.ok;
+      });
+    }
+
+    var results = run(), observer, interval, timeout;
+    if (passed(results) || !wait)
+      return done(results);
+
+    function finish() {
+      observer.disconnect();
+      clearInterval(interval);
+      clearTimeout(timeout);
+      done(run());
+    }
+    function recheck() {
+      if (passed(run()))
+        finish();
+    }
+    observer = new MutationObserver(recheck);
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true, characterData: true});
+    interval = setInterval(recheck, 50);
+    timeout = setTimeout(finish, wait);
+"""
+
+
+def is_page_unload(exception):
+    """ Returns whether a WebDriverException was raised because the page
+        went away while a script was running in it.
+    """
+    # XXX Using detection of a string may be flakey. Hopefully Marionette
+    # will provide us with a proper exception we can catch.
+    return "Detected a page unload event" in exception.msg
 
 
 class Driver(WebDriver):
     nick = None
+    base_url = BASE_APP_URL
 
     def __init__(self, *args, **kwargs):
         if "nick" in kwargs and kwargs["nick"] is not None:
             self.nick = kwargs["nick"]
         del kwargs["nick"]
+        self.base_url = kwargs.pop("base_url", BASE_APP_URL)
+        self.wait_mode = kwargs.pop("wait_mode", WAIT_MODE)
+        self._script_timeout = None
+        # The (locator, expected_url) of the frame we last switched to with
+        # switchToFrame, as long as we know we're still in it.
+        self._frame = None
         super(Driver, self).__init__(*args, **kwargs)
 
+    def execute(self, driver_command, params=None):
+        if driver_command in CONTEXT_COMMANDS:
+            self._frame = None
+        try:
+            with profiler.timed("webdriver:" + driver_command):
+                return super(Driver, self).execute(driver_command, params)
+        except (NoSuchFrameException, NoSuchWindowException):
+            # The frame we thought we were in has been closed by the page
+            # (e.g. a chat window after a hangup from the peer), and another
+            # one with the same url may have been opened since: switch
+            # again and retry.
+            if self._frame is None:
+                raise
+            locator, expected_url = self._frame
+            self._frame = None
+            self.switchToFrame(locator, expected_url)
+            with profiler.timed("webdriver:" + driver_command):
+                return super(Driver, self).execute(driver_command, params)
+
+    def waitInPage(self, kind, args, timeout, message):
+        """ Waits for a condition on the DOM of the current frame, checked
+            by the page itself (see WAIT_SCRIPT).
+
+            Args:
+            - kind: "elements" or "property"
+            - args: the selector, followed by the arguments of the condition
+            - timeout: Operation timeout in seconds
+            - message: Message of the TimeoutException
+
+            Returns: True if the condition was met, False if the page went
+            away in the meantime, in which case we can't tell.
+        """
+        with self._scriptTimeout(timeout):
+            try:
+                self.execute_async_script(WAIT_SCRIPT, kind, *args)
+            except TimeoutException:
+                raise TimeoutException(message)
+            except WebDriverException as e:
+                if not is_page_unload(e):
+                    raise
+                return False
+        return True
+
+    def _setScriptTimeout(self, timeout):
+        if self._script_timeout != timeout:
+            self.set_script_timeout(timeout)
+            self._script_timeout = timeout
+
+    @contextlib.contextmanager
+    def _scriptTimeout(self, timeout):
+        """ Sets the script timeout for the duration of the block, and
+            restores the previous one afterwards so that other scripts
+            (e.g. detectWindowClose) don't get the waits' timeout.
+        """
+        previous = self._script_timeout
+        if previous is None:
+            previous = DEFAULT_SCRIPT_TIMEOUT
+        self._setScriptTimeout(timeout)
+        try:
+            yield
+        finally:
+            self._setScriptTimeout(previous)
+
+    def checkElements(self, checks, timeout=None):
+        """ Checks a list of expectations on the DOM of the current frame,
+            in a single script execution (see CHECK_SCRIPT). The checks are
+            done again as the DOM changes until they all pass, or `timeout`
+            is reached.
+
+            Args:
+            - checks: list of (css_selector, check, args...) tuples, where
+              check is one of:
+              * "count", length: number of elements matching the selector
+              * "visible" / "notVisible": the first element is displayed
+                or not
+              * "inView": the first element can be seen in the viewport
+              * "textContains" / "textEquals", text: text of the first
+                element, with its whitespace collapsed
+              * "attributeEquals", name, value
+              * "hasClass" / "hasNoClass", class_name
+              * "property", name, value: JS property as a unicode string
+
+            Kwargs:
+            - timeout: Operation timeout in seconds, the element budget by
+              default
+
+            Returns: one {ok, found, actual} dict per check, where found
+            tells whether an element matched and actual is the value that
+            was checked.
+        """
+        if timeout is None:
+            timeout = budgets.current.get("element")
+        checks = [list(check) for check in checks]
+        if self.wait_mode != "observe":
+            results = []
+
+            def check(_):
+                results[:] = self.execute_async_script(CHECK_SCRIPT, checks,
+                                                       0)
+                return all(result["ok"] for result in results)
+
+            try:
+                WebDriverWait(self, timeout, poll_frequency=.25).until(check)
+            except TimeoutException:
+                pass
+            return results
+
+        # Leave the page some time to call back once it has given up.
+        with self._scriptTimeout(timeout + 5):
+            try:
+                return self.execute_async_script(CHECK_SCRIPT, checks,
+                                                 int(timeout * 1000))
+            except WebDriverException as e:
+                if not is_page_unload(e):
+                    raise
+                # We were in the middle of a page load: check the new one.
+                return self.execute_async_script(CHECK_SCRIPT, checks,
+                                                 int(timeout * 1000))
+
     def openConversationWith(self, nick):
         """ Opens a new conversation window with the user matching the provided
             nick.
@@ -69,6 +403,7 @@ class Driver(WebDriver):
         """ Signs the user in."""
         if not self.nick:
             raise RuntimeError("No nick provided")
+        start = time.time()
         self.switchToSidebar()
         # Wait for everything to be loaded before we proceed, this hopefully
         # ensures we don't get into issues with cookies being loaded
@@ -79,8 +414,11 @@ class Driver(WebDriver):
         self.waitForElement("#talkilla-signin", visible=True)
         self.clickElement("#talkilla-signin")
         # Ensure we've completed logging in before proceeding
+        budget = budgets.current.get("signin")
         self.switchToSidebar()
-        self.waitForElement("#subpanels", visible=True)
+        self.waitForElement("#subpanels", visible=True, timeout=budget)
+        budgets.current.check("signin", "signin of %s" % self.nick,
+                              time.time() - start, budget)
         return self
 
     def signout(self):
@@ -90,6 +428,34 @@ class Driver(WebDriver):
         self.clickElement('#signout button')
         return self
 
+    def closeChatWindows(self, timeout=1):
+        """ Closes all the open chat windows.
+
+            Kwargs:
+            - timeout: How long to wait for a chat window, in seconds
+        """
+        while True:
+            try:
+                WebDriverWait(self, timeout).until(
+                    EC.frame_to_be_available_and_switch_to_it("//chatbox"))
+            except TimeoutException:
+                return self
+            self.closeConversationWindow()
+
+    def reset(self):
+        """ Gets the browser back to a signed out state, so that it can be
+            used by another test: closes the chat windows, signs the user
+            out and clears the cookies.
+        """
+        self.closeChatWindows()
+        self.switchToSidebar()
+        if self.find_element_by_css_selector("#subpanels").is_displayed():
+            self.signout()
+        self.delete_all_cookies()
+        self.waitForElement("#signin", visible=True)
+        self.nick = None
+        return self
+
     def startCall(self, video):
         """ Starts a new call.
 
@@ -136,10 +502,8 @@ class Driver(WebDriver):
         if send is True:
             input_text.send_keys(Keys.RETURN)
 
-    # We use double the default timeout here as we've seen slow startup times
-    # on Travis but we don't want to extend the timeout for everything.
-    def switchToFrame(self, locator, expected_url,
-                      timeout=DEFAULT_WAIT_TIMEOUT * 2):
+    def switchToFrame(self, locator, expected_url, timeout=None,
+                      cached=True):
         """ Wait for a frame to become available, then switch to it.
 
             Args:
@@ -151,10 +515,19 @@ class Driver(WebDriver):
                 right thing.
 
             Kwargs:
-            - timeout: Operation timeout in seconds
+            - timeout: Operation timeout in seconds, the frame budget by
+                default
+            - cached: Don't switch if we're already in that frame. Pass
+                False to check that the frame is still there.
 
             Returns: Driver
         """
+        if cached and self._frame == (locator, expected_url):
+            return self
+        if timeout is None:
+            timeout = budgets.current.get("frame")
+        start = time.time()
+
         wait = WebDriverWait(self, timeout)
         wait.until(EC.frame_to_be_available_and_switch_to_it(locator))
 
@@ -178,7 +551,7 @@ class Driver(WebDriver):
                 # unnecessary.  yuck.  ideally, Marionette won't have this
                 # problem, and when we switch to it, we'll be able to ditch
                 # this nested wait.  we'll see).
-                wait2 = WebDriverWait(self, DEFAULT_WAIT_TIMEOUT)
+                wait2 = WebDriverWait(self, timeout)
                 wait2.until(EC.frame_to_be_available_and_switch_to_it(locator))
                 return False
 
@@ -188,21 +561,23 @@ class Driver(WebDriver):
             locator, expected_url, timeout)
         WebDriverWait(self, timeout, poll_frequency=.25).until(
             wait_for_correct_document, message=msg)
+        self._frame = (locator, expected_url)
+        budgets.current.check("frame", "switching to %s" % expected_url,
+                              time.time() - start, timeout)
         return self
 
-    def switchToChatWindow(self, nick, timeout=DEFAULT_WAIT_TIMEOUT):
+    def switchToChatWindow(self, nick, timeout=None, cached=True):
         """Switches to the Social API chat window."""
         return self.switchToFrame("//chatbox",
-                                  BASE_APP_URL + "/chat.html#" + nick,
-                                  timeout=timeout)
+                                  self.base_url + "/chat.html#" + nick,
+                                  timeout=timeout, cached=cached)
 
     def switchToSidebar(self):
         """Switches to the Social API sidebar."""
         return self.switchToFrame("//#social-sidebar-browser",
-                                  BASE_APP_URL + "/sidebar.html")
+                                  self.base_url + "/sidebar.html")
 
-    def waitForElement(self, css_selector, timeout=DEFAULT_WAIT_TIMEOUT,
-                       visible=None):
+    def waitForElement(self, css_selector, timeout=None, visible=None):
         """ Waits for a single DOM element matching the provided CSS selector
             do be available.
 
@@ -210,7 +585,8 @@ class Driver(WebDriver):
         - css_selector: CSS selector string
 
         Kwargs:
-        - timeout: Operation timeout in seconds
+        - timeout: Operation timeout in seconds, the element budget by
+          default
         - visible: Ensure elements visibility status:
                    * True: wait for visible elements only
                    * False: wait for invisible elements only
@@ -224,8 +600,7 @@ class Driver(WebDriver):
             return elements[0]
         raise NoSuchElementException("No element matching " + css_selector)
 
-    def waitForElements(self, css_selector, timeout=DEFAULT_WAIT_TIMEOUT,
-                        visible=None):
+    def waitForElements(self, css_selector, timeout=None, visible=None):
         """ Waits for DOM elements matching the provided CSS selector to be
             available.
 
@@ -233,7 +608,8 @@ class Driver(WebDriver):
             - css_selector: CSS selector string
 
             Kwargs:
-            - timeout: Operation timeout in seconds
+            - timeout: Operation timeout in seconds, the element budget by
+              default
             - visible: Ensure elements visibility status:
                        * True: wait for visible elements only
                        * False: wait for invisible elements only
@@ -249,17 +625,23 @@ class Driver(WebDriver):
                 return EC.invisibility_of_element_located(locator)
             return lambda _: driver.find_elements_by_css_selector(css_selector)
 
+        if timeout is None:
+            timeout = budgets.current.get("element")
+        start = time.time()
         message = u"Couldn't find elems matching %s (visibility check: %s)" % (
             css_selector, visible)
-        WebDriverWait(self, timeout, poll_frequency=.25).until(
-            get_element_checker(self, visible), message=message)
+        if self.wait_mode != "observe" or not self.waitInPage(
+                "elements", [css_selector, visible], timeout, message):
+            WebDriverWait(self, timeout, poll_frequency=.25).until(
+                get_element_checker(self, visible), message=message)
+        budgets.current.check("element", "waiting for %s" % css_selector,
+                              time.time() - start, timeout)
 
         return self.find_elements_by_css_selector(css_selector)
 
     def waitForElementWithPropertyValue(self, css_selector,
                                         property_name,
-                                        property_value,
-                                        timeout=DEFAULT_WAIT_TIMEOUT):
+                                        property_value, timeout=None):
         """ Waits for DOM element matching the provided CSS selector to be
             available and to have the given attribute or property set to
             the given value
@@ -270,7 +652,8 @@ class Driver(WebDriver):
             - property_value: Unicode string representing expected JS value
 
             Kwargs:
-            - timeout: Operation timeout in seconds
+            - timeout: Operation timeout in seconds, the element budget by
+              default
 
             Returns: a single WebElement
         """
@@ -292,13 +675,18 @@ class Driver(WebDriver):
 
             return find_element_by_selector_and_prop_value
 
+        if timeout is None:
+            timeout = budgets.current.get("element")
         message = u"Couldn't find elem matching %s with property '%s' set " \
                   u"to '%s')" % (css_selector, property_name,
                                  property_value)
 
         try:
-            WebDriverWait(self, timeout, poll_frequency=.25).until(
-                get_element_checker(), message=message)
+            if self.wait_mode != "observe" or not self.waitInPage(
+                    "property", [css_selector, property_name,
+                                 property_value], timeout, message):
+                WebDriverWait(self, timeout, poll_frequency=.25).until(
+                    get_element_checker(), message=message)
         except TimeoutException:
             raise InvalidElementStateException(message)
 
@@ -312,16 +700,14 @@ class Driver(WebDriver):
                                  to close
         """
         pageUnloadEventFired = False
+        # the window is going away, and us with it
+        self._frame = None
         try:
             self.execute_async_script(javascriptAction)
         except WebDriverException as e:
-            # XXX Using detection of a string may be flakey. Hopefully
-            # Marionette will provide us with a proper exception we can
-            # catch.
-            if not "Detected a page unload event" in e.msg:
+            if not is_page_unload(e):
                 raise
-            else:
-                pageUnloadEventFired = True
+            pageUnloadEventFired = True
 
         # This ensures that the exception has actually fired, and didn't
         # just get passed by, or a timeout exception
@@ -337,8 +723,84 @@ class Driver(WebDriver):
         search_input.send_keys(term)
 
 
-def create(nick=None):
+def read_user_prefs(base_url=BASE_APP_URL):
+    """ Returns the Firefox preferences of user.js, with the Social API
+        provider served from base_url.
+    """
+    prefs = {}
+    with open(USER_PREFS) as f:
+        for line in f:
+            match = re.match(r'user_pref\("([^"]+)", (.*)\);$', line.strip())
+            if match:
+                value = match.group(2).replace(DEFAULT_APP_URL, base_url)
+                prefs[match.group(1)] = json.loads(value)
+    return prefs
+
+
+@profiler.profiled("driver.create")
+def create(nick=None, base_url=BASE_APP_URL):
+    # bin/firefox sets the preferences of user.js up for the default
+    # server; for another one we send a profile with the right ones.
+    profile = None
+    if base_url != DEFAULT_APP_URL:
+        profile = FirefoxProfile()
+        for name, value in read_user_prefs(base_url).items():
+            profile.set_preference(name, value)
+
     driver = Driver(command_executor=SELENIUM_COMMAND_EXECUTOR,
                     desired_capabilities={"browserName": "firefox"},
-                    nick=nick)
+                    browser_profile=profile, nick=nick, base_url=base_url)
     return driver
+
+
+class DriverPool(object):
+    """ Keeps the browsers running between tests, as starting one takes
+        much longer than most tests.
+
+        Browsers are reset when they are released; the ones which can't be
+        are quit, and a new one is started next time.
+    """
+    def __init__(self, reuse=REUSE_BROWSERS):
+        self.reuse = reuse
+        self.idle = []
+
+    def acquire(self, nick=None):
+        """ Returns a signed out browser for the given nick."""
+        if not self.idle:
+            return create(nick)
+        driver = self.idle.pop()
+        driver.nick = nick
+        return driver
+
+    def release(self, driver):
+        """ Gives a browser back to the pool once a test is done with it.
+            This has to be called while the server is still running, so
+            that the user can be signed out.
+        """
+        if not self.reuse:
+            driver.quit()
+            return
+        try:
+            driver.reset()
+        except Exception:
+            self.discard(driver)
+        else:
+            self.idle.append(driver)
+
+    def discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """ Quits all the idle browsers."""
+        while self.idle:
+            self.discard(self.idle.pop())
+
+
+profiler.instrument(Driver, exclude=("execute",))
+profiler.instrument(DriverPool)
+
+pool = DriverPool()
+atexit.register(pool.close)
@@ -3,48 +3,52 @@
 import driver
 
 
-# WithSingleBob runs a single instance of the browser over the
-# entire set of tests in a class. This should become the default
-# in future.
+# The browsers come from driver.pool: they are kept running between tests
+# and signed out when a test is done with them, which has to happen
+# before the server is stopped.
+
+
+# WithSingleBob uses a single browser over the entire set of tests in a
+# class.
 class WithSingleBob(object):
     @classmethod
     def setUpClass(cls):
         super(WithSingleBob, cls).setUpClass()
-        cls.bob = driver.create("bob")
+        cls.bob = driver.pool.acquire("bob")
 
     @classmethod
     def tearDownClass(cls):
+        driver.pool.release(cls.bob)
         super(WithSingleBob, cls).tearDownClass()
-        cls.bob.quit()
 
 
-# WithBob and WithLarry run a new instance of the browser for each
-# test in a class.
+# WithBob, WithLarry and WithAlice use a signed out browser for each test
+# in a class.
 class WithBob(object):
     def setUp(self):
         super(WithBob, self).setUp()
-        self.bob = driver.create("bob")
+        self.bob = driver.pool.acquire("bob")
 
     def tearDown(self):
+        driver.pool.release(self.bob)
         super(WithBob, self).tearDown()
-        self.bob.quit()
 
 
 class WithLarry(object):
     def setUp(self):
         super(WithLarry, self).setUp()
-        self.larry = driver.create("larry")
+        self.larry = driver.pool.acquire("larry")
 
     def tearDown(self):
+        driver.pool.release(self.larry)
         super(WithLarry, self).tearDown()
-        self.larry.quit()
 
 
 class WithAlice(object):
     def setUp(self):
         super(WithAlice, self).setUp()
-        self.alice = driver.create("alice")
+        self.alice = driver.pool.acquire("alice")
 
     def tearDown(self):
+        driver.pool.release(self.alice)
         super(WithAlice, self).tearDown()
-        self.alice.quit()
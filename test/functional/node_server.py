@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Starts the Talkilla server for the functional and front-end tests."""
+import os
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+import urllib2
+
+import profiler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# Set TALKILLA_TEST_PORT to run the server on another port, see
+# parallel.py.
+SERVER_PORT = int(os.getenv("TALKILLA_TEST_PORT", 3000))
+
+SERVER_COMMAND = ("node", "app.js")
+SERVER_ENV = os.environ.copy()
+SERVER_ENV.update({"NO_LOCAL_CONFIG": "true",
+                   "NODE_ENV": "test",
+                   "SESSION_SECRET": "unguessable"})
+
+# Hard deadline for the server to answer, in seconds, and how often we
+# check.
+STARTUP_TIMEOUT = 10
+PROBE_INTERVAL = .05
+
+
+class NodeServer(object):
+    """ A Talkilla server running in a child process.
+
+        `start` only returns once the server answers HTTP requests. The
+        output of the server is kept, see `output`.
+    """
+    def __init__(self, port=SERVER_PORT):
+        self.port = port
+        self.process = None
+        self.log = None
+
+    @property
+    def url(self):
+        return "http://localhost:%d" % self.port
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        env = SERVER_ENV.copy()
+        env["PORT"] = str(self.port)
+        self.log = tempfile.NamedTemporaryFile(prefix="talkilla-server-",
+                                               suffix=".log")
+        self.process = subprocess.Popen(SERVER_COMMAND, cwd=ROOT, env=env,
+                                        stdout=self.log,
+                                        stderr=subprocess.STDOUT)
+        try:
+            self.wait_until_ready(timeout)
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def wait_until_ready(self, timeout=STARTUP_TIMEOUT):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Server exited with status %d:\n%s" % (
+                    self.process.returncode, self.output()))
+            try:
+                urllib2.urlopen(self.url + "/config.js", timeout=1).read()
+                return
+            except (urllib2.URLError, socket.error):
+                time.sleep(PROBE_INTERVAL)
+        raise RuntimeError("Server not ready after %ds:\n%s" % (
+            timeout, self.output()))
+
+    def output(self):
+        """ Returns what the server printed so far."""
+        if self.log is None:
+            return ""
+        with open(self.log.name) as log:
+            return log.read()
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.kill(self.process.pid, signal.SIGTERM)
+        self.process.wait()
+
+
+profiler.instrument(NodeServer)
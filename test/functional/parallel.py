@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Runs the functional tests in parallel.
+
+The tests are split between several workers. Each worker is a separate
+process with its own server port, so its own server and browsers, and
+runs its share of the tests one after the other::
+
+    $ python test/functional/parallel.py -j 4
+
+Tests of classes sharing a server or a browser between their tests
+(setUpClass) are kept in the same worker.
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from browser_test import SingleNodeBrowserTest  # NOQA
+from driver import SERVER_PORT  # NOQA
+
+
+def iter_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for sub in iter_tests(test):
+                yield sub
+        else:
+            yield test
+
+
+def collect(pattern='test_*.py'):
+    """Returns the ids of the tests to run, grouped by the tests which have
+    to run in the same process."""
+    suite = unittest.TestLoader().discover(HERE, pattern=pattern)
+    units = []
+    classes = {}
+    for test in iter_tests(suite):
+        if isinstance(test, SingleNodeBrowserTest):
+            cls = type(test)
+            if cls not in classes:
+                classes[cls] = []
+                units.append(classes[cls])
+            classes[cls].append(test.id())
+        else:
+            units.append([test.id()])
+    return units
+
+
+def shard(units, count):
+    """Splits the units of tests into `count` shards of similar sizes."""
+    shards = [[] for i in range(count)]
+    for unit in sorted(units, key=len, reverse=True):
+        min(shards, key=len).extend(unit)
+    return [tests for tests in shards if tests]
+
+
+class Worker(object):
+    def __init__(self, tests, port):
+        self.tests = tests
+        self.port = port
+        self.output = tempfile.TemporaryFile()
+        env = os.environ.copy()
+        env['TALKILLA_TEST_PORT'] = str(port)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [HERE] + filter(None, [env.get('PYTHONPATH')]))
+        # the tests expect to be run from the root of the repository
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'unittest', '-v'] + tests, cwd=ROOT,
+            env=env, stdout=self.output, stderr=subprocess.STDOUT)
+
+    def wait(self):
+        status = self.process.wait()
+        self.output.seek(0)
+        return status, self.output.read()
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of workers, 0 for one per CPU core '
+                             '(default: %(default)s)')
+    parser.add_argument('-p', '--port', type=int, default=SERVER_PORT,
+                        help='server port of the first worker, the next '
+                             'ones use the following ports '
+                             '(default: %(default)s)')
+    parser.add_argument('--pattern', default='test_*.py',
+                        help='test files to run (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    jobs = options.jobs or multiprocessing.cpu_count()
+    shards = shard(collect(options.pattern), jobs)
+    start = time.time()
+    workers = [Worker(tests, options.port + i)
+               for i, tests in enumerate(shards)]
+
+    failed = 0
+    for worker in workers:
+        status, output = worker.wait()
+        print('=' * 70)
+        print('Worker on port %d: %d test(s), %s' % (
+            worker.port, len(worker.tests), 'FAILED' if status else 'OK'))
+        print('=' * 70)
+        print(output)
+        if status:
+            failed += 1
+
+    print('Ran %d worker(s) in %.1fs, %d failed' % (
+        len(workers), time.time() - start, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
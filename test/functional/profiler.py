@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Opt-in profiling of the functional tests.
+
+Set PROFILE_TESTS to a directory to get, for each test, the number of calls
+and the cumulative time of the Driver helpers, of the WebDriver commands
+they send, and of the phases of the test (setUp, the test itself, tearDown
+and cleanups). Each test process writes its report to
+PROFILE_TESTS/profile-<pid>.txt when it exits:
+
+    $ PROFILE_TESTS=/tmp/profile make selenium
+
+Times are inclusive: a call to waitForElement also counts in
+waitForElements and in the WebDriver commands it ends up sending.
+"""
+import atexit
+import contextlib
+import functools
+import os
+import time
+
+# Keeps the wrappers out of the tracebacks of failing tests.
+__unittest = True
+
+PROFILE_DIR = os.getenv("PROFILE_TESTS")
+enabled = PROFILE_DIR is not None
+
+# What's recorded while no test is running, e.g. in setUpClass.
+OUTSIDE_TESTS = "(outside of tests)"
+
+
+class Profiler(object):
+    def __init__(self):
+        self.reports = []
+        self.test = None
+        self.calls = {}
+        self.started = None
+
+    def start(self, test_id):
+        self.stop()
+        self.test = test_id
+        self.calls = {}
+        self.started = time.time()
+
+    def stop(self):
+        if self.calls:
+            duration = time.time() - self.started \
+                if self.started is not None else None
+            self.reports.append((self.test or OUTSIDE_TESTS, duration,
+                                 self.calls))
+        self.test = None
+        self.calls = {}
+        self.started = None
+
+    def record(self, name, duration):
+        count, total = self.calls.get(name, (0, 0))
+        self.calls[name] = (count + 1, total + duration)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def format(self):
+        lines = []
+        totals = {}
+        for test, duration, calls in self.reports:
+            lines.append(format_calls(test, duration, calls))
+            for name, (count, total) in calls.items():
+                all_count, all_total = totals.get(name, (0, 0))
+                totals[name] = (all_count + count, all_total + total)
+        if len(self.reports) > 1:
+            lines.append(format_calls("All tests", None, totals))
+        return "\n".join(lines)
+
+    def write(self, directory=PROFILE_DIR):
+        self.stop()
+        if not self.reports:
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "profile-%d.txt" % os.getpid())
+        with open(path, "w") as report:
+            report.write(self.format())
+
+
+def format_calls(title, duration, calls):
+    if duration is not None:
+        title = "%s (%.2fs)" % (title, duration)
+    lines = ["== " + title,
+             "%8s %10s %10s  %s" % ("calls", "total s", "mean ms", "name")]
+    for name, (count, total) in sorted(calls.items(),
+                                       key=lambda item: -item[1][1]):
+        lines.append("%8d %10.3f %10.1f  %s" % (
+            count, total, total * 1000 / count, name))
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def _untimed(name):
+    yield
+
+
+def profiled(name):
+    """Decorator recording the calls to a function under `name`."""
+    def decorator(f):
+        if not enabled:
+            return f
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with profiler.timed(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(cls, exclude=()):
+    """Records the calls to the public methods of a class, under
+    <class name>.<method name>."""
+    if not enabled:
+        return cls
+    for name, value in vars(cls).items():
+        if name.startswith("_") or name in exclude or not callable(value):
+            continue
+        setattr(cls, name, profiled(cls.__name__ + "." + name)(value))
+    return cls
+
+
+def profile_test(test, run):
+    """Runs a unittest test, recording its phases. Returns the result of
+    `run`."""
+    phases = {"setUp": "test:setUp", test._testMethodName: "test:test",
+              "tearDown": "test:tearDown", "doCleanups": "test:cleanups"}
+    for attr, name in phases.items():
+        setattr(test, attr, profiled(name)(getattr(test, attr)))
+    profiler.start(test.id())
+    try:
+        return run()
+    finally:
+        profiler.stop()
+
+
+profiler = Profiler()
+timed = profiler.timed if enabled else _untimed
+
+if enabled:
+    atexit.register(profiler.write)
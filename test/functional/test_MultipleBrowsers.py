@@ -66,10 +66,9 @@ class MultipleBrowsersTest(mixins.WithBob, mixins.WithLarry, mixins.WithAlice,
         self.larry.signin()
         self.assertSignedInAs(self.larry, "larry")
 
-        self.assertElementsCount(self.bob, ".alert-info", 0)
-        self.assertElementsCount(self.larry, ".alert-info", 0)
-        self.assertElementsCount(self.bob, ".user", 1)
-        self.assertElementsCount(self.larry, ".user", 1)
+        for driver in self.bob, self.larry:
+            self.assertElements(driver, [(".alert-info", "count", 0),
+                                         (".user", "count", 1)])
 
         self.bob.signout()
         self.assertElementsCount(self.bob, ".alert-info", 0)
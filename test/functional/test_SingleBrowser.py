@@ -9,7 +9,7 @@ from browser_test import SingleNodeBrowserTest, debug_on  # NOQA
 
 class SingleBrowserTest(mixins.WithSingleBob, SingleNodeBrowserTest):
     def test_1_public_homepage(self):
-        self.bob.get("http://127.0.0.1:3000/")
+        self.bob.get(self.bob.base_url + "/")
         self.bob.find_element_by_css_selector("button")
 
     def test_2_sidebar(self):
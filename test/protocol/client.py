@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""A headless Talkilla client, speaking the signaling protocol of the server
+directly.
+
+It does what the sidebar and the conversation windows do over HTTP, without
+a browser, so that the protocol can be tested in seconds and with many
+users::
+
+    bob = SignalingClient(url, "bob").signin()
+    larry = SignalingClient(url, "larry").signin()
+    bob.callOffer("larry", {"sdp": "..."})
+    larry.waitForEvent("offer", peer="bob")
+"""
+import json
+import threading
+import time
+import urllib2
+
+
+class SignalingError(Exception):
+    """The server didn't answer a request the way it should have."""
+
+
+class SignalingClient(object):
+    """ One user of the server, identified by its session cookie.
+
+        Events read from the stream and not waited for yet are kept in
+        `events`, in the order they were received.
+    """
+    def __init__(self, base_url, nick):
+        self.base_url = base_url
+        self.nick = nick
+        self.cookie = None
+        self.events = []
+
+    def request(self, path, data=None, method="POST"):
+        """ Sends a request with the session of the user.
+
+            Returns: (status, body)
+        """
+        body = json.dumps(data) if data is not None else ""
+        request = urllib2.Request(self.base_url + path, body,
+                                  {"Content-Type": "application/json"})
+        request.get_method = lambda: method
+        if self.cookie:
+            request.add_header("Cookie", self.cookie)
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as response:
+            pass
+        cookie = response.info().getheader("set-cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.code, response.read()
+
+    def _expect(self, status, path, data=None, method="POST"):
+        code, body = self.request(path, data, method)
+        if code != status:
+            raise SignalingError("%s %s as %s: got %d, expected %d" % (
+                method, path, self.nick, code, status))
+        return body
+
+    # Sidebar
+
+    def signin(self):
+        """ Signs in and connects, like the sidebar does."""
+        body = json.loads(self._expect(200, "/signin",
+                                       {"assertion": self.nick}))
+        if body["nick"] != self.nick:
+            raise SignalingError("signed in as %s instead of %s" % (
+                body["nick"], self.nick))
+        self.stream(firstRequest=True)
+        return self
+
+    def signout(self):
+        self._expect(200, "/signout", {"nick": self.nick})
+        return self
+
+    def stream(self, firstRequest=False):
+        """ Makes a single long polling request, and keeps the events it
+            got.
+
+            Returns: the events
+        """
+        data = {"nick": self.nick}
+        if firstRequest:
+            data["firstRequest"] = True
+        events = json.loads(self._expect(200, "/stream", data))
+        self.events.extend(events)
+        return events
+
+    def presenceRequest(self):
+        self._expect(204, "/presenceRequest", {"nick": self.nick})
+        return self
+
+    def presence(self, timeout=5):
+        """ Asks for the list of the connected users.
+
+            Returns: their nicks, sorted
+        """
+        self.presenceRequest()
+        users = self.waitForEvent("users", timeout=timeout)
+        return sorted(user["nick"] for user in users)
+
+    # Conversation windows
+
+    def _send(self, path, peer, data=None):
+        data = dict(data or {}, peer=peer)
+        self._expect(204, path, {"nick": self.nick, "data": data})
+        return self
+
+    def callOffer(self, peer, offer=None):
+        return self._send("/calloffer", peer, {"offer": offer})
+
+    def callAccepted(self, peer, answer=None):
+        return self._send("/callaccepted", peer, {"answer": answer})
+
+    def callHangup(self, peer):
+        return self._send("/callhangup", peer)
+
+    def iceCandidate(self, peer, candidate):
+        return self._send("/icecandidate", peer, {"candidate": candidate})
+
+    # Instant share
+
+    def instantShare(self, peer):
+        """ Clicks the instant share link of `peer`."""
+        self._expect(200, "/instant-share/" + peer, method="GET")
+        self._expect(200, "/instant-share/" + peer)
+        return self
+
+    # Waiting for events
+
+    def takeEvent(self, topic, peer=None):
+        """ Removes and returns the first event received so far with the
+            given topic, and peer if given, or None. The peer of presence
+            events is their data, the nick of the user who came or left.
+        """
+        for index, event in enumerate(self.events):
+            if event["topic"] != topic:
+                continue
+            data = event["data"]
+            sender = data.get("peer") if isinstance(data, dict) else data
+            if peer is not None and sender != peer:
+                continue
+            del self.events[index]
+            return event
+        return None
+
+    def waitForEvent(self, topic, peer=None, timeout=5):
+        """ Reads the stream until an event with the given topic, and peer
+            if given, comes in.
+
+            Returns: the data of the event
+        """
+        deadline = time.time() + timeout
+        while True:
+            event = self.takeEvent(topic, peer)
+            if event is not None:
+                return event["data"]
+            if time.time() > deadline:
+                raise SignalingError(
+                    "%s got no %s event%s in %ss" % (
+                        self.nick, topic,
+                        " from %s" % peer if peer else "", timeout))
+            self.stream()
+
+
+def run_all(functions, timeout=60):
+    """ Runs the functions at the same time, each in a thread.
+
+        Returns: their results, in order. Raises the first exception one of
+        them raised.
+    """
+    results = [None] * len(functions)
+    errors = []
+
+    def run(index, function):
+        try:
+            results[index] = function()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(index, function))
+               for index, function in enumerate(functions)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+    if errors:
+        raise errors[0]
+    if any(thread.is_alive() for thread in threads):
+        raise SignalingError("still running after %ds" % timeout)
+    return results
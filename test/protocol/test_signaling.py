@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+# NodeServer is shared with the functional tests
+sys.path.insert(1, os.path.join(HERE, "..", "functional"))
+
+from client import SignalingClient, SignalingError, run_all  # NOQA
+from node_server import NodeServer  # NOQA
+
+with open(os.path.join(ROOT, "config", "test.json")) as config_file:
+    config = json.load(config_file)
+
+# How many users test_many_users simulates.
+USERS = int(os.getenv("TALKILLA_PROTOCOL_USERS", 200))
+
+
+class SignalingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.node_app = NodeServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.node_app.stop()
+
+    def client(self, name):
+        """ Returns a client for a user of this test only, so that the
+            tests don't see each other's users. They are signed out at the
+            end of the test.
+        """
+        client = SignalingClient(self.node_app.url,
+                                 "%s-%s" % (name, self._testMethodName))
+        self.addCleanup(self.signout, client)
+        return client
+
+    def signout(self, client):
+        if client.cookie:
+            client.request("/signout", {"nick": client.nick})
+
+    def test_signin_presence(self):
+        bob = self.client("bob").signin()
+        larry = self.client("larry").signin()
+
+        self.assertEqual(bob.waitForEvent("userJoined", peer=larry.nick),
+                         larry.nick)
+        self.assertEqual(larry.presence(), sorted([bob.nick, larry.nick]))
+
+    def test_signout(self):
+        bob = self.client("bob").signin()
+        larry = self.client("larry").signin()
+
+        larry.signout()
+
+        self.assertEqual(bob.waitForEvent("userLeft", peer=larry.nick),
+                         larry.nick)
+        self.assertEqual(bob.presence(), [bob.nick])
+        self.assertEqual(larry.request("/stream", {"nick": larry.nick})[0],
+                         400)
+
+    def test_requests_need_a_session(self):
+        anonymous = self.client("anonymous")
+
+        for path in ("/stream", "/calloffer", "/callaccepted", "/callhangup",
+                     "/icecandidate", "/presenceRequest", "/signout"):
+            status, _ = anonymous.request(path, {"data": {"peer": "bob"}})
+            self.assertEqual(status, 400, path)
+
+    def test_call(self):
+        bob = self.client("bob").signin()
+        larry = self.client("larry").signin()
+
+        bob.callOffer(larry.nick, {"sdp": "offer"})
+        offer = larry.waitForEvent("offer", peer=bob.nick)
+        self.assertEqual(offer["offer"], {"sdp": "offer"})
+
+        larry.callAccepted(bob.nick, {"sdp": "answer"})
+        answer = bob.waitForEvent("answer", peer=larry.nick)
+        self.assertEqual(answer["answer"], {"sdp": "answer"})
+
+        for i in range(5):
+            bob.iceCandidate(larry.nick, {"candidate": i})
+            larry.iceCandidate(bob.nick, {"candidate": i})
+        for i in range(5):
+            candidate = larry.waitForEvent("ice:candidate", peer=bob.nick)
+            self.assertEqual(candidate["candidate"], {"candidate": i})
+            candidate = bob.waitForEvent("ice:candidate", peer=larry.nick)
+            self.assertEqual(candidate["candidate"], {"candidate": i})
+
+        bob.callHangup(larry.nick)
+        larry.waitForEvent("hangup", peer=bob.nick)
+
+    def test_call_unknown_peer(self):
+        bob = self.client("bob").signin()
+
+        # The server drops the offer, but doesn't fail.
+        bob.callOffer("nobody")
+        bob.callHangup("nobody")
+
+    def test_instant_share(self):
+        bob = self.client("bob").signin()
+        larry = self.client("larry").signin()
+
+        larry.instantShare(bob.nick)
+
+        self.assertEqual(larry.waitForEvent("instantshare", peer=bob.nick),
+                         {"peer": bob.nick})
+
+    def test_instant_share_needs_a_connected_user(self):
+        larry = self.client("larry")
+
+        self.assertRaises(SignalingError, larry.instantShare, "bob")
+
+    def test_connection_timeout(self):
+        bob = self.client("bob").signin()
+        larry = self.client("larry").signin()
+
+        # larry stops polling: the server forgets about them once the
+        # connection times out, after twice the long polling timeout.
+        start = time.time()
+        timeout = config["LONG_POLLING_TIMEOUT"] * 2 / 1000.
+        bob.waitForEvent("userLeft", peer=larry.nick, timeout=timeout + 5)
+
+        self.assertGreaterEqual(time.time() - start, timeout - .5)
+        self.assertEqual(bob.presence(), [bob.nick])
+
+    def test_many_users(self):
+        clients = [self.client("user%d" % i) for i in range(USERS)]
+
+        run_all([client.signin for client in clients])
+        self.assertEqual(clients[0].presence(timeout=10),
+                         sorted(client.nick for client in clients))
+
+        def call(caller, callee):
+            caller.callOffer(callee.nick)
+            callee.waitForEvent("offer", peer=caller.nick)
+            callee.callAccepted(caller.nick)
+            caller.waitForEvent("answer", peer=callee.nick)
+            caller.callHangup(callee.nick)
+            callee.waitForEvent("hangup", peer=caller.nick)
+
+        # All the users are in a call at the same time.
+        run_all([lambda i=i: call(clients[i], clients[i + 1])
+                 for i in range(0, len(clients) - 1, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main(catchbreak=True)
@@ -14,6 +14,7 @@ chai.Assertion.includeStack = true;
 
 var api = require("../../server/server").api;
 var middlewares = require("../../server/server").middlewares;
+var clientConfig = require("../../server/server").clientConfig;
 var merge = require("../../server/config").merge;
 var config = require("../../server/config");
 
@@ -83,6 +84,90 @@ describe("Server", function() {
           expect(testConfig.ROOTURL).to.be.equal('http://example2.com');
         });
 
+      it("should override the coalescing window from the environment",
+        function() {
+          process.env.LONG_POLLING_COALESCING_WINDOW = "25";
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.LONG_POLLING_COALESCING_WINDOW;
+          expect(testConfig.LONG_POLLING_COALESCING_WINDOW).to.equal(25);
+        });
+
+      it("should override the timer resolution from the environment",
+        function() {
+          process.env.TIMER_RESOLUTION = "0";
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.TIMER_RESOLUTION;
+          expect(testConfig.TIMER_RESOLUTION).to.equal(0);
+        });
+
+      it("should set the number of cluster workers from the environment",
+        function() {
+          process.env.CLUSTER_WORKERS = "0";
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.CLUSTER_WORKERS;
+          expect(testConfig.CLUSTER_WORKERS).to.equal(0);
+        });
+
+      it("should set the presence backend from the environment",
+        function() {
+          process.env.PRESENCE_BACKEND = "network";
+          process.env.PRESENCE_HUB = "localhost:5100";
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.PRESENCE_BACKEND;
+          delete process.env.PRESENCE_HUB;
+          expect(testConfig.PRESENCE_BACKEND).to.equal("network");
+          expect(testConfig.PRESENCE_HUB).to.equal("localhost:5100");
+        });
+
+      it("should enable the metrics api from the environment",
+        function() {
+          process.env.METRICS = "1";
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.METRICS;
+          expect(testConfig.METRICS).to.equal(true);
+        });
+
+      it("should set the logging options from the environment",
+        function() {
+          process.env.LOG_LEVEL = "info";
+          process.env.LOG_FLUSH_INTERVAL = "100";
+          process.env.LOG_RATE_LIMIT = "1000";
+          process.env.LOG_SAMPLING = '{"ice:candidate": 100}';
+
+          var testConfig =
+            config.getConfigFromFile(path.join(testConfigRoot,
+                                               'test3.json'), PORT);
+
+          delete process.env.LOG_LEVEL;
+          delete process.env.LOG_FLUSH_INTERVAL;
+          delete process.env.LOG_RATE_LIMIT;
+          delete process.env.LOG_SAMPLING;
+          expect(testConfig.LOG_LEVEL).to.equal("info");
+          expect(testConfig.LOG_FLUSH_INTERVAL).to.equal(100);
+          expect(testConfig.LOG_RATE_LIMIT).to.equal(1000);
+          expect(testConfig.LOG_SAMPLING).to.deep.equal({"ice:candidate": 100});
+        });
+
       it("should load the spa config", function() {
         var testConfig =
             config.getConfigFromFile(path.join(testConfigRoot,
@@ -120,10 +205,25 @@ describe("Server", function() {
         sinon.assert.calledOnce(res.send);
         sinon.assert.calledWithExactly(res.send, 200,
                                        'function loadConfig() { return ' +
-                                       JSON.stringify(config.config) +
+                                       JSON.stringify(clientConfig()) +
                                        '; }');
       });
 
+      it("should only send the settings the clients use", function() {
+        var req = {};
+        var res = {header: sinon.spy(), send: sinon.spy()};
+        config.config.PRESENCE_HUB = "10.0.0.1:5100";
+
+        api.config(req, res);
+
+        delete config.config.PRESENCE_HUB;
+
+        var sent = res.send.args[0][1];
+        expect(sent).to.contain('"ROOTURL"');
+        expect(sent).to.not.contain("PRESENCE_HUB");
+        expect(sent).to.not.contain("10.0.0.1:5100");
+      });
+
     });
 
   });
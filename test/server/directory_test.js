@@ -0,0 +1,549 @@
+/* jshint expr:true */
+"use strict";
+
+var EventEmitter = require("events").EventEmitter;
+
+var chai = require("chai");
+var expect = chai.expect;
+var sinon = require("sinon");
+
+chai.Assertion.includeStack = true;
+
+var bus = require("../../server/bus");
+var Directory = require("../../server/directory").Directory;
+var RemoteUser = require("../../server/directory").RemoteUser;
+var UserList = require("../../server/users").UserList;
+var timers = require("../../server/users")._timers;
+var logger = require("../../server/logger");
+var config = require("../../server/config").config;
+
+// Messages between local buses are delivered after the current tick.
+function flush(callback) {
+  setImmediate(callback);
+}
+
+describe("bus", function() {
+
+  describe("LocalHub", function() {
+    var hub, a, b, c;
+
+    beforeEach(function() {
+      hub = new bus.LocalHub();
+      a = hub.connect("a");
+      b = hub.connect("b");
+      c = hub.connect("c");
+    });
+
+    it("should publish messages to the other nodes", function(done) {
+      var received = [];
+      [a, b, c].forEach(function(node) {
+        node.on("message", function(message, from) {
+          received.push([node.id, message, from]);
+        });
+      });
+
+      a.publish({type: "hello"});
+
+      flush(function() {
+        expect(received).to.deep.equal([["b", {type: "hello"}, "a"],
+                                         ["c", {type: "hello"}, "a"]]);
+        done();
+      });
+    });
+
+    it("should send messages to the given node only", function(done) {
+      var onB = sinon.spy(), onC = sinon.spy();
+      b.on("message", onB);
+      c.on("message", onC);
+
+      a.send("b", {type: "send"});
+
+      flush(function() {
+        sinon.assert.calledOnce(onB);
+        sinon.assert.calledWithExactly(onB, {type: "send"}, "a");
+        sinon.assert.notCalled(onC);
+        done();
+      });
+    });
+
+    it("should tell the other nodes when one is disconnected",
+      function(done) {
+        var onB = sinon.spy();
+        b.on("message", onB);
+
+        hub.disconnect("a");
+
+        flush(function() {
+          sinon.assert.calledWithExactly(onB, {type: "gone", node: "a"},
+                                         null);
+          done();
+        });
+      });
+
+  });
+
+  describe("ClusterBus", function() {
+    var channel, clusterBus;
+
+    beforeEach(function() {
+      channel = new EventEmitter();
+      channel.send = sinon.spy();
+      clusterBus = new bus.ClusterBus(channel, 1);
+    });
+
+    it("should send published messages to the master", function() {
+      clusterBus.publish({type: "hello"});
+
+      sinon.assert.calledWithExactly(channel.send, {
+        talkillaBus: true, from: 1, message: {type: "hello"}
+      });
+    });
+
+    it("should send messages for a given worker to the master", function() {
+      clusterBus.send(2, {type: "send"});
+
+      sinon.assert.calledWithExactly(channel.send, {
+        talkillaBus: true, from: 1, to: 2, message: {type: "send"}
+      });
+    });
+
+    it("should emit the messages relayed by the master", function() {
+      var onMessage = sinon.spy();
+      clusterBus.on("message", onMessage);
+
+      channel.emit("message", {talkillaBus: true, from: 2,
+                               message: {type: "hello"}});
+      channel.emit("message", {something: "else"});
+
+      sinon.assert.calledOnce(onMessage);
+      sinon.assert.calledWithExactly(onMessage, {type: "hello"}, 2);
+    });
+
+  });
+
+  describe("#create", function() {
+
+    afterEach(function() {
+      delete config.PRESENCE_BACKEND;
+    });
+
+    it("should not return a bus for a single in-memory node", function() {
+      expect(bus.create()).to.equal(undefined);
+    });
+
+    it("should throw on unknown presence backends", function() {
+      config.PRESENCE_BACKEND = "carrier-pigeon";
+
+      expect(bus.create).to.Throw(/carrier-pigeon/);
+    });
+
+  });
+
+  describe("#relay", function() {
+    var master;
+
+    function fork(id) {
+      var worker = new EventEmitter();
+      worker.id = id;
+      worker.send = sinon.spy();
+      master.workers[id] = worker;
+      master.emit("fork", worker);
+      return worker;
+    }
+
+    beforeEach(function() {
+      master = new EventEmitter();
+      master.workers = {};
+      bus.relay(master);
+    });
+
+    it("should relay published messages to the other workers", function() {
+      var one = fork(1), two = fork(2), three = fork(3);
+      var envelope = {talkillaBus: true, from: 1, message: {type: "hello"}};
+
+      one.emit("message", envelope);
+
+      sinon.assert.notCalled(one.send);
+      sinon.assert.calledWithExactly(two.send, envelope);
+      sinon.assert.calledWithExactly(three.send, envelope);
+    });
+
+    it("should relay messages for a given worker to that worker only",
+      function() {
+        var one = fork(1), two = fork(2), three = fork(3);
+        var envelope = {talkillaBus: true, from: 1, to: 3,
+                        message: {type: "send"}};
+
+        one.emit("message", envelope);
+
+        sinon.assert.notCalled(two.send);
+        sinon.assert.calledWithExactly(three.send, envelope);
+      });
+
+    it("should tell the other workers when one dies", function() {
+      var one = fork(1), two = fork(2);
+      delete master.workers[1];
+
+      master.emit("exit", one);
+
+      sinon.assert.calledWithExactly(two.send, {
+        talkillaBus: true, from: null, message: {type: "gone", node: 1}
+      });
+    });
+
+  });
+
+});
+
+describe("Directory", function() {
+
+  var sandbox, hub, nodes;
+
+  function node(id) {
+    var users = new UserList();
+    nodes[id] = {users: users,
+                 directory: new Directory(users, hub.connect(id))};
+    return nodes[id];
+  }
+
+  beforeEach(function() {
+    sandbox = sinon.sandbox.create();
+    hub = new bus.LocalHub();
+    nodes = {};
+    node("a");
+    node("b");
+  });
+
+  afterEach(function() {
+    timers.clear();
+    sandbox.restore();
+  });
+
+  describe("without a bus", function() {
+
+    it("should emit join and leave events for the local users", function() {
+      var users = new UserList();
+      var directory = new Directory(users);
+      var onJoin = sinon.spy(), onLeave = sinon.spy();
+      directory.on("join", onJoin);
+      directory.on("leave", onLeave);
+
+      users.add("foo").remove("foo");
+
+      sinon.assert.calledWithExactly(onJoin, "foo");
+      sinon.assert.calledWithExactly(onLeave, "foo");
+    });
+
+    it("should return the presence list of the local users", function() {
+      var users = new UserList().add("foo");
+      var directory = new Directory(users);
+
+      expect(directory.presence()).to.equal(users.presence());
+    });
+
+  });
+
+  describe("#get", function() {
+
+    it("should return local users", function() {
+      var foo = nodes.a.users.add("foo").get("foo");
+
+      expect(nodes.a.directory.get("foo")).to.equal(foo);
+    });
+
+    it("should return users of the other nodes", function(done) {
+      nodes.a.users.add("foo");
+
+      flush(function() {
+        var foo = nodes.b.directory.get("foo");
+        expect(foo).to.be.an.instanceOf(RemoteUser);
+        expect(foo.node).to.equal("a");
+        done();
+      });
+    });
+
+    it("should return undefined for unknown users", function() {
+      expect(nodes.a.directory.get("foo")).to.equal(undefined);
+    });
+
+  });
+
+  describe("#presence", function() {
+
+    it("should list the users of all the nodes", function(done) {
+      nodes.a.users.add("foo");
+      nodes.b.users.add("bar");
+
+      flush(function() {
+        var presence = nodes.b.directory.presence();
+        expect(presence).to.deep.equal([{nick: "bar"}, {nick: "foo"}]);
+        expect(presence._json).to.equal(JSON.stringify(presence));
+        done();
+      });
+    });
+
+    it("should return the same list until a user joins or leaves",
+      function(done) {
+        nodes.a.users.add("foo");
+
+        flush(function() {
+          var presence = nodes.b.directory.presence();
+          expect(nodes.b.directory.presence()).to.equal(presence);
+
+          nodes.a.users.remove("foo");
+          flush(function() {
+            expect(nodes.b.directory.presence()).to.deep.equal([]);
+            done();
+          });
+        });
+      });
+
+  });
+
+  describe("events", function() {
+
+    it("should emit join when a user joins another node", function(done) {
+      var onJoin = sinon.spy();
+      nodes.b.directory.on("join", onJoin);
+
+      nodes.a.users.add("foo");
+
+      flush(function() {
+        sinon.assert.calledOnce(onJoin);
+        sinon.assert.calledWithExactly(onJoin, "foo");
+        done();
+      });
+    });
+
+    it("should emit leave when a user leaves another node", function(done) {
+      var onLeave = sinon.spy();
+      nodes.b.directory.on("leave", onLeave);
+      nodes.a.users.add("foo");
+
+      nodes.a.users.remove("foo");
+
+      flush(function() {
+        sinon.assert.calledOnce(onLeave);
+        sinon.assert.calledWithExactly(onLeave, "foo");
+        done();
+      });
+    });
+
+    it("should emit leave for the users of a node which is gone",
+      function(done) {
+        var onLeave = sinon.spy();
+        nodes.b.directory.on("leave", onLeave);
+        nodes.a.users.add("foo").add("bar");
+
+        flush(function() {
+          hub.disconnect("a");
+
+          flush(function() {
+            sinon.assert.calledTwice(onLeave);
+            sinon.assert.calledWith(onLeave, "foo");
+            sinon.assert.calledWith(onLeave, "bar");
+            expect(nodes.b.directory.get("foo")).to.equal(undefined);
+            done();
+          });
+        });
+      });
+
+    it("should get the users of the nodes started before", function(done) {
+      nodes.a.users.add("foo");
+
+      flush(function() {
+        var c = node("c");
+
+        flush(function() {
+          expect(c.directory.get("foo")).to.be.an.instanceOf(RemoteUser);
+          done();
+        });
+      });
+    });
+
+  });
+
+  describe("reconnection", function() {
+
+    it("should forget the users of the other nodes and ask for them again",
+      function(done) {
+        var onLeave = sinon.spy();
+        nodes.a.users.add("foo");
+        nodes.b.users.add("bar");
+
+        flush(function() {
+          nodes.b.directory.on("leave", onLeave);
+          sandbox.spy(nodes.b.directory.bus, "publish");
+
+          nodes.b.directory.bus.emit("reconnect");
+
+          sinon.assert.calledWithExactly(onLeave, "foo");
+          sinon.assert.calledWithExactly(nodes.b.directory.bus.publish,
+                                         {type: "users", nicks: ["bar"]});
+          sinon.assert.calledWithExactly(nodes.b.directory.bus.publish,
+                                         {type: "hello"});
+          flush(function() {
+            expect(nodes.b.directory.get("foo").node).to.equal("a");
+            done();
+          });
+        });
+      });
+
+    it("should keep the users two nodes have on only one of them",
+      function(done) {
+        var fooA = nodes.a.users.add("foo").get("foo");
+
+        flush(function() {
+          // b has its own foo, and a didn't hear about it
+          var publish = sandbox.stub(nodes.b.directory.bus, "publish");
+          var fooB = nodes.b.users.add("foo").get("foo");
+          publish.restore();
+          sandbox.stub(fooA, "send");
+          fooB.touch();
+          fooB.send("offer", {peer: "bar"});
+
+          nodes.a.directory.bus.emit("reconnect");
+          nodes.b.directory.bus.emit("reconnect");
+
+          flush(function() {
+            flush(function() {
+              expect(nodes.a.users.get("foo")).to.equal(fooA);
+              expect(nodes.b.users.get("foo")).to.equal(undefined);
+              expect(nodes.b.directory.get("foo").node).to.equal("a");
+              sinon.assert.calledOnce(fooA.send);
+              sinon.assert.calledWithExactly(fooA.send, "offer",
+                                             {peer: "bar"});
+              done();
+            });
+          });
+        });
+      });
+
+  });
+
+  describe("forwarding", function() {
+
+    it("should send events to the users of other nodes", function(done) {
+      var bar = nodes.b.users.add("bar").get("bar");
+      sandbox.stub(bar, "send");
+
+      flush(function() {
+        nodes.a.directory.get("bar").send("offer", {peer: "foo"});
+
+        flush(function() {
+          sinon.assert.calledOnce(bar.send);
+          sinon.assert.calledWithExactly(bar.send, "offer", {peer: "foo"});
+          done();
+        });
+      });
+    });
+
+    it("should disconnect the users of other nodes", function(done) {
+      var bar = nodes.b.users.add("bar").get("bar");
+      sandbox.stub(bar, "disconnect");
+
+      flush(function() {
+        nodes.a.directory.get("bar").disconnect();
+
+        flush(function() {
+          sinon.assert.calledOnce(bar.disconnect);
+          done();
+        });
+      });
+    });
+
+    it("should warn when the user is gone", function(done) {
+      sandbox.stub(logger, "warn");
+      nodes.b.users.add("bar");
+
+      flush(function() {
+        var bar = nodes.a.directory.get("bar");
+        nodes.b.users.get("bar").disconnect();
+        nodes.b.users.remove("bar");
+        bar.send("offer", {peer: "foo"});
+
+        flush(function() {
+          sinon.assert.calledOnce(logger.warn);
+          done();
+        });
+      });
+    });
+
+  });
+
+  describe("moving users", function() {
+
+    it("should forget users who moved to another node", function(done) {
+      nodes.a.users.add("foo");
+
+      flush(function() {
+        nodes.b.users.add("foo");
+
+        flush(function() {
+          expect(nodes.a.users.get("foo")).to.equal(undefined);
+          expect(nodes.a.directory.get("foo").node).to.equal("b");
+          done();
+        });
+      });
+    });
+
+    it("should not tell anybody they left or joined", function(done) {
+      var c = node("c");
+      var onJoin = sinon.spy(), onLeave = sinon.spy();
+      nodes.a.users.add("foo");
+
+      flush(function() {
+        [nodes.a, nodes.b, c].forEach(function(node) {
+          node.directory.on("join", onJoin);
+          node.directory.on("leave", onLeave);
+        });
+
+        nodes.b.users.add("foo");
+
+        flush(function() {
+          sinon.assert.notCalled(onJoin);
+          sinon.assert.notCalled(onLeave);
+          expect(c.directory.get("foo").node).to.equal("b");
+          done();
+        });
+      });
+    });
+
+    it("should hand their queued events over", function(done) {
+      var foo = nodes.a.users.add("foo").get("foo");
+      foo.touch();
+      foo.send("offer", {peer: "bar"});
+
+      flush(function() {
+        var movedFoo = nodes.b.users.add("foo").get("foo");
+        movedFoo.touch();
+
+        flush(function() {
+          expect(movedFoo.events).to.deep.equal([
+            {topic: "offer", data: {peer: "bar"}}
+          ]);
+          done();
+        });
+      });
+    });
+
+    it("should answer their pending long polling request", function(done) {
+      var foo = nodes.a.users.add("foo").get("foo");
+      var callback = sinon.spy();
+      foo.touch();
+      foo.waitForEvents(callback);
+
+      flush(function() {
+        nodes.b.users.add("foo");
+
+        flush(function() {
+          sinon.assert.calledOnce(callback);
+          sinon.assert.calledWithExactly(callback, []);
+          done();
+        });
+      });
+    });
+
+  });
+
+});
@@ -0,0 +1,140 @@
+/* jshint expr:true */
+"use strict";
+
+var chai = require("chai");
+var expect = chai.expect;
+var sinon = require("sinon");
+
+chai.Assertion.includeStack = true;
+
+var Hub = require("../../server/hub").Hub;
+var NetworkBus = require("../../server/bus").NetworkBus;
+var Directory = require("../../server/directory").Directory;
+var UserList = require("../../server/users").UserList;
+var timers = require("../../server/users")._timers;
+
+describe("Hub", function() {
+
+  var hub, address, buses;
+
+  // Connects a node to the hub, and calls back once it is connected.
+  function connect(id, callback) {
+    var bus = new NetworkBus(address, id);
+    buses.push(bus);
+    bus.socket.on("connect", function() {
+      // let the hub register the node
+      setTimeout(callback, 20);
+    });
+    return bus;
+  }
+
+  // Calls back once `count` messages were received by `bus`.
+  function receive(bus, count, callback) {
+    var received = [];
+    bus.on("message", function(message, from) {
+      received.push([message, from]);
+      if (received.length === count)
+        callback(received);
+    });
+  }
+
+  beforeEach(function(done) {
+    buses = [];
+    hub = new Hub().listen(0, "127.0.0.1", function() {
+      address = "127.0.0.1:" + hub.server.address().port;
+      done();
+    });
+  });
+
+  afterEach(function(done) {
+    buses.forEach(function(bus) {
+      bus.close();
+    });
+    timers.clear();
+    hub.close(function() {
+      done();
+    });
+  });
+
+  it("should relay published messages to the other nodes", function(done) {
+    var a = connect("a", function() {
+      var b = connect("b", function() {
+        receive(b, 1, function(received) {
+          expect(received).to.deep.equal([[{type: "hello"}, "a"]]);
+          done();
+        });
+        a.publish({type: "hello"});
+      });
+    });
+  });
+
+  it("should relay messages for a given node to that node only",
+    function(done) {
+      var onB = sinon.spy();
+      var a = connect("a", function() {
+        var b = connect("b", function() {
+          var c = connect("c", function() {
+            b.on("message", onB);
+            receive(c, 1, function(received) {
+              expect(received).to.deep.equal([[{type: "send"}, "a"]]);
+              sinon.assert.notCalled(onB);
+              done();
+            });
+            a.send("c", {type: "send"});
+          });
+        });
+      });
+    });
+
+  it("should tell the other nodes when one is gone", function(done) {
+    var a = connect("a", function() {
+      var b = connect("b", function() {
+        receive(b, 1, function(received) {
+          expect(received).to.deep.equal([[{type: "gone", node: "a"},
+                                            null]]);
+          done();
+        });
+        a.close();
+      });
+    });
+  });
+
+  it("should keep the messages sent until the node is connected",
+    function(done) {
+      var b = connect("b", function() {
+        receive(b, 1, function(received) {
+          expect(received).to.deep.equal([[{type: "hello"}, "a"]]);
+          done();
+        });
+        var a = new NetworkBus(address, "a");
+        buses.push(a);
+        a.publish({type: "hello"});
+      });
+    });
+
+  it("should share the users of several nodes", function(done) {
+    var usersA = new UserList(), usersB = new UserList();
+
+    connect("a", function() {
+      connect("b", function() {
+        var directoryA = new Directory(usersA, buses[0]);
+        var directoryB = new Directory(usersB, buses[1]);
+        var bar = usersB.add("bar").get("bar");
+        bar.touch();
+
+        directoryA.on("join", function(nick) {
+          expect(nick).to.equal("bar");
+          directoryA.get("bar").send("offer", {peer: "foo"});
+        });
+
+        sinon.stub(bar, "send", function(topic, data) {
+          expect(topic).to.equal("offer");
+          expect(data).to.deep.equal({peer: "foo"});
+          expect(directoryB.presence()).to.deep.equal([{nick: "bar"}]);
+          done();
+        });
+      });
+    });
+  });
+
+});
@@ -0,0 +1,187 @@
+/* jshint expr:true */
+"use strict";
+
+var EventEmitter = require("events").EventEmitter;
+
+var chai = require("chai");
+var expect = chai.expect;
+var sinon = require("sinon");
+
+chai.Assertion.includeStack = true;
+
+var LogSink = require("../../server/logsink").LogSink;
+var BUFFER_MAX = require("../../server/logsink").BUFFER_MAX;
+
+describe("LogSink", function() {
+
+  var stream, clock;
+
+  // What was written to the stream, as records.
+  function written() {
+    return stream.write.args.reduce(function(records, args) {
+      return records.concat(args[0].split("\n").filter(function(line) {
+        return line;
+      }).map(JSON.parse));
+    }, []);
+  }
+
+  function record(type, level) {
+    return {name: "talkilla", level: level || 30, type: type, v: 0};
+  }
+
+  beforeEach(function() {
+    clock = sinon.useFakeTimers(10000);
+    stream = new EventEmitter();
+    stream.write = sinon.stub().returns(true);
+  });
+
+  afterEach(function() {
+    clock.restore();
+  });
+
+  describe("#write", function() {
+
+    it("should write the records right away without a flush interval",
+      function() {
+        var sink = new LogSink(stream);
+
+        sink.write(record("signin"));
+
+        expect(written()).to.deep.equal([record("signin")]);
+      });
+
+    it("should write the records in batches", function() {
+      var sink = new LogSink(stream, {flushInterval: 100});
+
+      sink.write(record("signin"));
+      sink.write(record("connection"));
+      sinon.assert.notCalled(stream.write);
+
+      clock.tick(100);
+
+      sinon.assert.calledOnce(stream.write);
+      expect(written()).to.deep.equal([record("signin"),
+                                       record("connection")]);
+    });
+
+    it("should write the errors right away", function() {
+      var sink = new LogSink(stream, {flushInterval: 100});
+
+      sink.write(record("signin"));
+      sink.write(record("uncaught", 50));
+
+      expect(written()).to.have.length.of(2);
+    });
+
+    it("should keep one record out of the sampling rate", function() {
+      var sink = new LogSink(stream, {sampling: {"ice:candidate": 10}});
+
+      for (var i = 0; i < 25; i++)
+        sink.write(record("ice:candidate"));
+
+      expect(written()).to.have.length.of(3);
+      expect(written()[0].sampled).to.equal(10);
+    });
+
+    it("should not sample the warnings", function() {
+      var sink = new LogSink(stream, {sampling: {"ice:candidate": 10}});
+
+      sink.write(record("ice:candidate", 40));
+      sink.write(record("ice:candidate", 40));
+
+      expect(written()).to.have.length.of(2);
+    });
+
+    it("should drop the records over the rate limit", function() {
+      var sink = new LogSink(stream, {rateLimit: 2});
+
+      sink.write(record("call:offer"));
+      sink.write(record("call:offer"));
+      sink.write(record("call:offer"));
+      sink.write(record("signin"));
+
+      expect(written().map(function(record) {
+        return record.type;
+      })).to.deep.equal(["call:offer", "call:offer", "signin"]);
+    });
+
+    it("should log how many records were dropped", function() {
+      var sink = new LogSink(stream, {rateLimit: 1});
+
+      sink.write(record("call:offer"));
+      sink.write(record("call:offer"));
+      sink.write(record("call:offer"));
+      clock.tick(1000);
+      sink.write(record("signin"));
+
+      var dropped = written()[1];
+      expect(dropped.type).to.equal("log:dropped");
+      expect(dropped.level).to.equal(40);
+      expect(dropped.dropped).to.deep.equal({"call:offer": 2});
+    });
+
+    it("should write the dropped records warning even if only dropped " +
+       "records follow", function() {
+        var sink = new LogSink(stream, {flushInterval: 100, rateLimit: 1});
+
+        sink.write(record("call:offer"));
+        sink.write(record("call:offer"));
+        clock.tick(1000);
+        stream.write.reset();
+        sink.write(record("call:offer"));
+        sink.write(record("call:offer"));
+
+        clock.tick(100);
+
+        var written = stream.write.args[0][0].split("\n");
+        expect(JSON.parse(written[0]).type).to.equal("log:dropped");
+      });
+
+    it("should write the dropped records warning right away without a " +
+       "flush interval", function() {
+        var sink = new LogSink(stream, {sampling: {"ice:candidate": 10},
+                                        rateLimit: 1});
+
+        sink.write(record("ice:candidate"));
+        sink.write(record("call:offer"));
+        sink.write(record("call:offer"));
+        clock.tick(1000);
+        stream.write.reset();
+        sink.write(record("ice:candidate"));
+        sink.write(record("ice:candidate"));
+
+        sinon.assert.calledOnce(stream.write);
+        expect(JSON.parse(stream.write.args[0][0]).type)
+          .to.equal("log:dropped");
+      });
+
+    it("should keep the records while the stream drains", function() {
+      var sink = new LogSink(stream);
+      stream.write.returns(false);
+      sink.write(record("signin"));
+      stream.write.returns(true);
+
+      sink.write(record("connection"));
+      sinon.assert.calledOnce(stream.write);
+
+      stream.emit("drain");
+
+      expect(written()).to.deep.equal([record("signin"),
+                                       record("connection")]);
+    });
+
+    it("should drop the records once the buffer is full", function() {
+      var sink = new LogSink(stream);
+      stream.write.returns(false);
+      sink.write(record("signin"));
+
+      for (var i = 0; i < BUFFER_MAX + 5; i++)
+        sink.write(record("connection"));
+
+      expect(sink.buffer).to.have.length.of(BUFFER_MAX);
+      expect(sink.dropped).to.deep.equal({connection: 5});
+    });
+
+  });
+
+});
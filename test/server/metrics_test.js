@@ -0,0 +1,159 @@
+/* jshint expr:true */
+"use strict";
+
+var EventEmitter = require("events").EventEmitter;
+
+var chai = require("chai");
+var expect = chai.expect;
+var sinon = require("sinon");
+
+chai.Assertion.includeStack = true;
+
+var Metrics = require("../../server/metrics").Metrics;
+var RouteStats = require("../../server/metrics").RouteStats;
+
+describe("RouteStats", function() {
+
+  describe("#record", function() {
+
+    it("should count the requests and the errors", function() {
+      var stats = new RouteStats();
+
+      stats.record(2, false);
+      stats.record(4, true);
+
+      var json = stats.toJSON();
+      expect(json.count).to.equal(2);
+      expect(json.errors).to.equal(1);
+      expect(json.mean).to.equal(3);
+      expect(json.max).to.equal(4);
+    });
+
+    it("should put the latencies in buckets", function() {
+      var stats = new RouteStats();
+
+      stats.record(0, false);
+      stats.record(1, false);
+      stats.record(7, false);
+      stats.record(60000, false);
+
+      var buckets = stats.toJSON().buckets;
+      expect(buckets["<=1"]).to.equal(2);
+      expect(buckets["<=5"]).to.equal(0);
+      expect(buckets["<=10"]).to.equal(1);
+      expect(buckets[">30000"]).to.equal(1);
+    });
+
+  });
+
+});
+
+describe("Metrics", function() {
+
+  var metrics, sandbox;
+
+  beforeEach(function() {
+    sandbox = sinon.sandbox.create();
+    metrics = new Metrics();
+  });
+
+  afterEach(function() {
+    metrics.stop();
+    sandbox.restore();
+  });
+
+  describe("#middleware", function() {
+
+    var req, res, next;
+
+    beforeEach(function() {
+      req = {method: "POST"};
+      res = new EventEmitter();
+      res.statusCode = 200;
+      next = sinon.spy();
+    });
+
+    it("should call the next middleware", function() {
+      metrics.middleware(req, res, next);
+
+      sinon.assert.calledOnce(next);
+    });
+
+    it("should record the request once answered", function() {
+      sandbox.stub(metrics, "record");
+
+      metrics.middleware(req, res, next);
+      req.route = {path: "/calls/offer"};
+      res.emit("finish");
+
+      sinon.assert.calledOnce(metrics.record);
+      sinon.assert.calledWith(metrics.record, "POST /calls/offer",
+                              sinon.match.number, false);
+    });
+
+    it("should record the requests without a route as other", function() {
+      sandbox.stub(metrics, "record");
+      res.statusCode = 404;
+
+      metrics.middleware(req, res, next);
+      res.emit("finish");
+
+      sinon.assert.calledWith(metrics.record, "other",
+                              sinon.match.number, true);
+    });
+
+  });
+
+  describe("#start", function() {
+
+    var clock;
+
+    beforeEach(function() {
+      clock = sinon.useFakeTimers();
+    });
+
+    afterEach(function() {
+      clock.restore();
+    });
+
+    it("should measure the event loop lag regularly", function() {
+      metrics.start();
+
+      clock.tick(1000);
+
+      expect(metrics.lag).to.deep.equal([0, 0]);
+    });
+
+    it("should only keep the last measures", function() {
+      metrics.start();
+
+      clock.tick(60000);
+
+      expect(metrics.lag).to.have.length.of(20);
+    });
+
+  });
+
+  describe("#report", function() {
+
+    it("should report the event loop lag", function() {
+      metrics.lag = [3, 12, 5];
+
+      expect(metrics.report().eventLoop).to.deep.equal({lag: 5, maxLag: 12});
+    });
+
+    it("should report the memory usage", function() {
+      expect(metrics.report().memory).to.have.property("heapUsed");
+    });
+
+    it("should report the routes", function() {
+      metrics.record("GET /stream", 10, false);
+
+      var report = JSON.parse(JSON.stringify(metrics.report()));
+
+      expect(report.routes["GET /stream"].count).to.equal(1);
+    });
+
+  });
+
+});
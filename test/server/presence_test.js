@@ -19,6 +19,7 @@ chai.Assertion.includeStack = true;
 require("../../server/server");
 var presence = require("../../server/presence");
 var User = require("../../server/users").User;
+var timers = require("../../server/users")._timers;
 var logger = require("../../server/logger");
 var config = require('../../server/config').config;
 
@@ -37,6 +38,7 @@ describe("presence", function() {
     users.forEach(function(user) {
       users.remove(user.nick);
     });
+    timers.clear();
     sandbox.restore();
   });
 
@@ -144,6 +146,15 @@ describe("presence", function() {
         sinon.assert.calledOnce(user.clearPending);
       });
 
+      it("should reset the overflow flag on firstRequest", function() {
+        var user = users.add(fakeId).get(fakeId);
+        user.overflowed = true;
+
+        api._setupUser(users, fakeId, firstRequest);
+
+        expect(user.overflowed).to.equal(false);
+      });
+
     });
 
     // XXX: this method is private but critical. That's why we have
@@ -393,6 +404,18 @@ describe("presence", function() {
         ]));
       });
 
+      it("should ask the client to reconnect if events were dropped",
+        function() {
+          var user = users.add(fakeId).get(fakeId);
+          user.overflowed = true;
+
+          api.stream(req, res);
+
+          sinon.assert.calledOnce(res.send);
+          sinon.assert.calledWithExactly(res.send, 409);
+          expect(user.overflowed).to.equal(false);
+        });
+
       it("should send an empty list of events if the timeout is reached",
         function() {
           users.add(fakeId).get(fakeId);
@@ -423,6 +446,129 @@ describe("presence", function() {
 
     });
 
+    describe("#events", function() {
+      var fakeId, clock, req, res;
+
+      beforeEach(function() {
+        fakeId = '123123';
+        clock = sinon.useFakeTimers();
+
+        req = new EventEmitter();
+        req.session = {email: fakeId};
+        req.socket = {setTimeout: sinon.spy()};
+        res = {
+          send: sinon.spy(),
+          writeHead: sinon.spy(),
+          write: sinon.spy(),
+          end: sinon.spy()
+        };
+      });
+
+      afterEach(function() {
+        clock.restore();
+      });
+
+      it("should return a 400 if the user is not signed in", function() {
+        req.session = {};
+
+        api.events(req, res);
+
+        sinon.assert.calledOnce(res.send);
+        sinon.assert.calledWithExactly(res.send, 400);
+      });
+
+      it("should open an event stream", function() {
+        api.events(req, res);
+
+        sinon.assert.calledOnce(res.writeHead);
+        sinon.assert.calledWith(res.writeHead, 200);
+        expect(res.writeHead.args[0][1]["Content-Type"])
+          .to.equal("text/event-stream");
+        sinon.assert.calledWithExactly(req.socket.setTimeout, 0);
+      });
+
+      it("should setup the user", function() {
+        sandbox.stub(api, "_setupUser").returns(users.add(fakeId).get(fakeId));
+
+        api.events(req, res);
+
+        sinon.assert.calledOnce(api._setupUser);
+        sinon.assert.calledWithExactly(api._setupUser, users, fakeId, true);
+      });
+
+      it("should write the events as they are sent", function() {
+        api.events(req, res);
+        res.write.reset();
+
+        users.get(fakeId).send("some", "data");
+
+        sinon.assert.calledOnce(res.write);
+        sinon.assert.calledWithExactly(res.write, "data: " +
+          JSON.stringify([{topic: "some", data: "data"}]) + "\n\n");
+      });
+
+      it("should write a heartbeat every long polling timeout", function() {
+        api.events(req, res);
+        res.write.reset();
+
+        clock.tick(config.LONG_POLLING_TIMEOUT + config.TIMER_RESOLUTION);
+
+        sinon.assert.calledOnce(res.write);
+        sinon.assert.calledWithExactly(res.write, ":\n\n");
+      });
+
+      it("should stop pushing when the connection closes", function() {
+        api.events(req, res);
+        var user = users.get(fakeId);
+
+        req.emit("close");
+        user.send("some", "data");
+
+        expect(user.events).to.deep.equal([{topic: "some", data: "data"}]);
+      });
+
+      it("should end the stream when the user disconnects", function() {
+        api.events(req, res);
+
+        users.get(fakeId).disconnect();
+
+        sinon.assert.calledOnce(res.end);
+      });
+
+      it("should end the stream when another one replaces it", function() {
+        var newReq = new EventEmitter();
+        newReq.session = req.session;
+        newReq.socket = {setTimeout: sinon.spy()};
+        var newRes = {writeHead: sinon.spy(), write: sinon.spy(),
+                      end: sinon.spy()};
+        api.events(req, res);
+
+        api.events(newReq, newRes);
+
+        sinon.assert.calledOnce(res.end);
+        sinon.assert.notCalled(newRes.end);
+      });
+
+      it("should end the stream when a long polling request replaces it",
+        function() {
+          api.events(req, res);
+
+          api.stream({session: req.session, body: {}},
+                     {send: sinon.spy()});
+
+          sinon.assert.calledOnce(res.end);
+        });
+
+      it("should not end the stream when it closes", function() {
+        api.events(req, res);
+
+        req.emit("close");
+
+        sinon.assert.notCalled(res.end);
+      });
+
+    });
+
     describe("#callOffer", function() {
       var req, res;
 
@@ -653,6 +799,55 @@ describe("presence", function() {
 
     });
 
+    describe("#metrics", function() {
+
+      var req, res;
+
+      beforeEach(function() {
+        req = {};
+        res = {send: sinon.spy(), header: sinon.spy()};
+      });
+
+      afterEach(function() {
+        config.METRICS = true;
+      });
+
+      it("should send the metrics of the server as JSON", function() {
+        users.add("foo").add("bar");
+        users.get("foo").events = [{topic: "a", data: 1}];
+        users.get("bar").waitForEvents(function() {});
+
+        api.metrics(req, res);
+
+        sinon.assert.calledOnce(res.send);
+        sinon.assert.calledWith(res.header, 'Content-Type',
+                                'application/json');
+        var report = JSON.parse(res.send.args[0][1]);
+        expect(report.users).to.deep.equal({
+          connected: 2,
+          remote: 0,
+          anons: anons.all().length,
+          pushed: 0
+        });
+        expect(report.waiters).to.equal(1);
+        expect(report.queues.events).to.equal(1);
+        expect(report.queues.depths).to.deep.equal({"0": 1, "1": 1});
+        expect(report).to.have.property("eventLoop");
+        expect(report.memory).to.have.property("heapUsed");
+        expect(report).to.have.property("routes");
+      });
+
+      it("should return a 404 if the metrics are disabled", function() {
+        config.METRICS = false;
+
+        api.metrics(req, res);
+
+        sinon.assert.calledOnce(res.send);
+        sinon.assert.calledWithExactly(res.send, 404);
+      });
+
+    });
+
     describe("#instantShare", function() {
 
       var req, res;
@@ -0,0 +1,222 @@
+/* jshint expr:true */
+"use strict";
+
+var chai = require("chai");
+var expect = chai.expect;
+var sinon = require("sinon");
+
+chai.Assertion.includeStack = true;
+
+var timers = require("../../server/timers");
+var TimerWheel = timers.TimerWheel;
+var NativeTimers = timers.NativeTimers;
+
+describe("TimerWheel", function() {
+
+  var wheel, clock;
+
+  beforeEach(function() {
+    clock = sinon.useFakeTimers();
+    wheel = new TimerWheel(100, 8);
+  });
+
+  afterEach(function() {
+    wheel.clear();
+    clock.restore();
+  });
+
+  describe("#add", function() {
+
+    it("should call the callback once the delay is over", function() {
+      var callback = sinon.spy();
+
+      wheel.add(1000, callback);
+
+      clock.tick(999);
+      sinon.assert.notCalled(callback);
+      clock.tick(1);
+      sinon.assert.calledOnce(callback);
+    });
+
+    it("should not call the callback earlier than the delay", function() {
+      var callback = sinon.spy();
+      clock.tick(50);
+
+      wheel.add(120, callback);
+
+      clock.tick(119);
+      sinon.assert.notCalled(callback);
+      clock.tick(100);
+      sinon.assert.calledOnce(callback);
+    });
+
+    it("should handle delays longer than a whole round", function() {
+      var callback = sinon.spy();
+
+      wheel.add(2000, callback);
+
+      clock.tick(1999);
+      sinon.assert.notCalled(callback);
+      clock.tick(1);
+      sinon.assert.calledOnce(callback);
+    });
+
+    it("should call the callbacks in the order they expire", function() {
+      var first = sinon.spy();
+      var second = sinon.spy();
+
+      wheel.add(500, second);
+      wheel.add(200, first);
+
+      clock.tick(500);
+      sinon.assert.callOrder(first, second);
+    });
+
+    it("should count the timers which are still to fire", function() {
+      wheel.add(100, function() {});
+      wheel.add(200, function() {});
+
+      clock.tick(100);
+
+      expect(wheel.size).to.equal(1);
+    });
+
+    it("should stop sweeping when there are no timers left", function() {
+      wheel.add(100, function() {});
+
+      clock.tick(100);
+
+      expect(wheel._timeout).to.equal(undefined);
+    });
+
+    it("should accept timers added by a callback", function() {
+      var callback = sinon.spy();
+
+      wheel.add(100, function() {
+        wheel.add(100, callback);
+      });
+
+      clock.tick(200);
+      sinon.assert.calledOnce(callback);
+    });
+
+  });
+
+  describe("#cancel", function() {
+
+    it("should prevent the callback from being called", function() {
+      var callback = sinon.spy();
+
+      wheel.cancel(wheel.add(100, callback));
+
+      clock.tick(1000);
+      sinon.assert.notCalled(callback);
+      expect(wheel.size).to.equal(0);
+    });
+
+    it("should not fail with a timer which already fired", function() {
+      var timer = wheel.add(100, function() {});
+      clock.tick(100);
+
+      wheel.cancel(timer);
+
+      expect(wheel.size).to.equal(0);
+    });
+
+    it("should not fail without a timer", function() {
+      expect(wheel.cancel.bind(wheel, undefined)).not.to.Throw();
+    });
+
+  });
+
+  describe("#clear", function() {
+
+    it("should cancel all the timers", function() {
+      var callback = sinon.spy();
+      wheel.add(100, callback);
+      wheel.add(200, callback);
+
+      wheel.clear();
+
+      clock.tick(1000);
+      sinon.assert.notCalled(callback);
+      expect(wheel.size).to.equal(0);
+    });
+
+  });
+
+});
+
+describe("NativeTimers", function() {
+
+  var native, clock;
+
+  beforeEach(function() {
+    clock = sinon.useFakeTimers();
+    native = new NativeTimers();
+  });
+
+  afterEach(function() {
+    native.clear();
+    clock.restore();
+  });
+
+  it("should call the callback after the delay", function() {
+    var callback = sinon.spy();
+
+    native.add(100, callback);
+
+    clock.tick(100);
+    sinon.assert.calledOnce(callback);
+  });
+
+  it("should cancel a timer", function() {
+    var callback = sinon.spy();
+
+    native.cancel(native.add(100, callback));
+
+    clock.tick(100);
+    sinon.assert.notCalled(callback);
+  });
+
+  it("should not fail with a timer which already fired", function() {
+    var timer = native.add(100, function() {});
+    clock.tick(100);
+
+    native.cancel(timer);
+
+    expect(native.size).to.equal(0);
+  });
+
+  it("should cancel all the timers on clear", function() {
+    var callback = sinon.spy();
+    native.add(100, callback);
+    native.add(200, callback);
+
+    native.clear();
+
+    clock.tick(200);
+    sinon.assert.notCalled(callback);
+    expect(native.size).to.equal(0);
+  });
+
+});
+
+describe("timers", function() {
+
+  describe("#create", function() {
+
+    it("should create a timer wheel with the given resolution", function() {
+      var wheel = timers.create(250);
+
+      expect(wheel).to.be.an.instanceOf(TimerWheel);
+      expect(wheel.resolution).to.equal(250);
+    });
+
+    it("should use native timers if the resolution is 0", function() {
+      expect(timers.create(0)).to.be.an.instanceOf(NativeTimers);
+    });
+
+  });
+
+});
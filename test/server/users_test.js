@@ -12,6 +12,8 @@ var logger = require('../../server/logger');
 var Users = require("../../server/users").UserList;
 var User = require("../../server/users").User;
 var Waiter = require("../../server/users").Waiter;
+var timers = require("../../server/users")._timers;
+var serializeEvents = require("../../server/users").serializeEvents;
 
 describe("User", function() {
 
@@ -23,6 +25,7 @@ describe("User", function() {
   });
 
   afterEach(function() {
+    timers.clear();
     sandbox.restore();
   });
 
@@ -78,6 +81,183 @@ describe("User", function() {
       expect(user.events).to.deep.equal([]);
       sinon.assert.calledOnce(logger.warn);
     });
+
+    describe("with a coalescing window", function() {
+      var clock, oldWindow, callback;
+
+      beforeEach(function() {
+        clock = sinon.useFakeTimers();
+        oldWindow = config.LONG_POLLING_COALESCING_WINDOW;
+        config.LONG_POLLING_COALESCING_WINDOW = 10;
+        callback = sinon.spy();
+        user.waitForEvents(callback);
+      });
+
+      afterEach(function() {
+        config.LONG_POLLING_COALESCING_WINDOW = oldWindow;
+        clock.restore();
+      });
+
+      it("should not resolve the pending wait right away", function() {
+        user.send("some", "data");
+
+        sinon.assert.notCalled(callback);
+      });
+
+      it("should resolve the pending wait with all the events sent " +
+         "during the window", function() {
+        user.send("foo", "oof");
+        clock.tick(5);
+        user.send("bar", "rab");
+        clock.tick(5);
+
+        sinon.assert.calledOnce(callback);
+        sinon.assert.calledWithExactly(callback, [
+          {topic: "foo", data: "oof"},
+          {topic: "bar", data: "rab"}
+        ]);
+        expect(user.events).to.deep.equal([]);
+      });
+
+      it("should not extend the window when new events come in", function() {
+        user.send("foo", "oof");
+        clock.tick(9);
+        user.send("bar", "rab");
+        clock.tick(1);
+
+        sinon.assert.calledOnce(callback);
+      });
+
+      it("should keep the events queued if the pending wait is cleared",
+        function() {
+          user.send("foo", "oof");
+          user.clearPending();
+          clock.tick(10);
+
+          sinon.assert.notCalled(callback);
+          expect(user.events).to.deep.equal([{topic: "foo", data: "oof"}]);
+        });
+
+      it("should only resolve once if it times out during the window",
+        function() {
+          // the wait times out before the window is over
+          config.LONG_POLLING_COALESCING_WINDOW =
+            config.LONG_POLLING_TIMEOUT * 2;
+          user.send("offer", "sdp");
+
+          clock.tick(config.LONG_POLLING_TIMEOUT * 3);
+
+          sinon.assert.calledOnce(callback);
+          sinon.assert.calledWithExactly(callback, []);
+          expect(user.events).to.deep.equal([{topic: "offer", data: "sdp"}]);
+        });
+
+      it("should not resolve a previous wait once a new one started",
+        function() {
+          var newCallback = sinon.spy();
+          user.send("foo", "oof");
+
+          user.waitForEvents(newCallback);
+          clock.tick(10);
+
+          sinon.assert.notCalled(callback);
+          sinon.assert.calledOnce(newCallback);
+          sinon.assert.calledWithExactly(newCallback, [
+            {topic: "foo", data: "oof"}
+          ]);
+        });
+    });
+  });
+
+  describe("#_enqueue", function() {
+    var oldMax, oldPolicy;
+
+    beforeEach(function() {
+      oldMax = config.EVENT_QUEUE_MAX_LENGTH;
+      oldPolicy = config.EVENT_QUEUE_OVERFLOW;
+      config.EVENT_QUEUE_MAX_LENGTH = 3;
+    });
+
+    afterEach(function() {
+      config.EVENT_QUEUE_MAX_LENGTH = oldMax;
+      config.EVENT_QUEUE_OVERFLOW = oldPolicy;
+    });
+
+    function enqueue(topics) {
+      topics.forEach(function(topic) {
+        user._enqueue({topic: topic[0], data: topic[1]});
+      });
+    }
+
+    it("should not limit the queue if there is no maximum length",
+      function() {
+        config.EVENT_QUEUE_MAX_LENGTH = 0;
+
+        enqueue([["a", 1], ["b", 2], ["c", 3], ["d", 4]]);
+
+        expect(user.events).to.have.length(4);
+      });
+
+    it("should drop the oldest events with the drop-oldest policy",
+      function() {
+        config.EVENT_QUEUE_OVERFLOW = "drop-oldest";
+
+        enqueue([["a", 1], ["b", 2], ["c", 3], ["d", 4]]);
+
+        expect(user.events).to.deep.equal([
+          {topic: "b", data: 2},
+          {topic: "c", data: 3},
+          {topic: "d", data: 4}
+        ]);
+      });
+
+    it("should only keep the last presence event about each user with " +
+       "the collapse-presence policy", function() {
+        config.EVENT_QUEUE_OVERFLOW = "collapse-presence";
+
+        enqueue([["userJoined", "bob"], ["offer", {peer: "bob"}],
+                 ["userLeft", "bob"], ["userJoined", "bob"]]);
+
+        expect(user.events).to.deep.equal([
+          {topic: "offer", data: {peer: "bob"}},
+          {topic: "userJoined", data: "bob"}
+        ]);
+      });
+
+    it("should drop the oldest events if collapsing is not enough",
+      function() {
+        config.EVENT_QUEUE_OVERFLOW = "collapse-presence";
+
+        enqueue([["a", 1], ["userJoined", "bob"], ["c", 3], ["d", 4]]);
+
+        expect(user.events).to.deep.equal([
+          {topic: "userJoined", data: "bob"},
+          {topic: "c", data: 3},
+          {topic: "d", data: 4}
+        ]);
+      });
+
+    it("should empty the queue and flag the user with the reconnect " +
+       "policy", function() {
+        config.EVENT_QUEUE_OVERFLOW = "reconnect";
+
+        enqueue([["a", 1], ["b", 2], ["c", 3], ["d", 4]]);
+
+        expect(user.events).to.deep.equal([]);
+        expect(user.overflowed).to.equal(true);
+      });
+
+    it("should emit an overflow event with the number of dropped events",
+      function() {
+        var callback = sinon.spy();
+        config.EVENT_QUEUE_OVERFLOW = "drop-oldest";
+        user.on("overflow", callback);
+
+        enqueue([["a", 1], ["b", 2], ["c", 3], ["d", 4]]);
+
+        sinon.assert.calledOnce(callback);
+        sinon.assert.calledWithExactly(callback, 1);
+      });
   });
 
   describe("#clearPending", function() {
@@ -178,6 +358,136 @@ describe("User", function() {
 
   });
 
+  describe("#attach", function() {
+    var clock, push;
+
+    beforeEach(function() {
+      clock = sinon.useFakeTimers();
+      push = sinon.spy();
+    });
+
+    afterEach(function() {
+      clock.restore();
+    });
+
+    it("should push the events as they are sent", function() {
+      user.attach(push);
+
+      user.send("foo", "oof");
+      user.send("bar", "rab");
+
+      sinon.assert.calledTwice(push);
+      sinon.assert.calledWithExactly(push, [{topic: "foo", data: "oof"}]);
+      sinon.assert.calledWithExactly(push, [{topic: "bar", data: "rab"}]);
+      expect(user.events).to.deep.equal([]);
+    });
+
+    it("should push the queued events right away", function() {
+      user.connect();
+      user.send("foo", "oof");
+
+      user.attach(push);
+
+      sinon.assert.calledOnce(push);
+      sinon.assert.calledWithExactly(push, [{topic: "foo", data: "oof"}]);
+    });
+
+    it("should clear the pending long polling request", function() {
+      sandbox.stub(user, "clearPending");
+
+      user.attach(push);
+
+      sinon.assert.calledOnce(user.clearPending);
+    });
+
+    it("should push an empty list of events every long polling timeout",
+      function() {
+        user.attach(push);
+
+        clock.tick(config.LONG_POLLING_TIMEOUT * 2 + config.TIMER_RESOLUTION);
+
+        sinon.assert.calledTwice(push);
+        sinon.assert.alwaysCalledWithExactly(push, []);
+      });
+
+    it("should keep the user connected", function() {
+      var disconnect = sinon.spy();
+      user.on("disconnect", disconnect);
+
+      user.attach(push);
+      clock.tick(config.LONG_POLLING_TIMEOUT * 10);
+
+      sinon.assert.notCalled(disconnect);
+    });
+
+  });
+
+  describe("#detach", function() {
+    var clock, push;
+
+    beforeEach(function() {
+      clock = sinon.useFakeTimers();
+      push = sinon.spy();
+      user.attach(push);
+    });
+
+    afterEach(function() {
+      clock.restore();
+    });
+
+    it("should queue the events again", function() {
+      user.detach();
+
+      user.send("foo", "oof");
+
+      sinon.assert.notCalled(push);
+      expect(user.events).to.deep.equal([{topic: "foo", data: "oof"}]);
+    });
+
+    it("should let the user time out", function() {
+      var disconnect = sinon.spy();
+      user.on("disconnect", disconnect);
+
+      user.detach();
+      clock.tick(config.LONG_POLLING_TIMEOUT * 2 + config.TIMER_RESOLUTION);
+
+      sinon.assert.calledOnce(disconnect);
+    });
+
+    it("should not detach another push function", function() {
+      user.detach(function() {});
+
+      user.send("foo", "oof");
+
+      sinon.assert.calledOnce(push);
+    });
+
+    it("should be called on disconnect", function() {
+      user.disconnect();
+
+      expect(user._push).to.equal(undefined);
+    });
+
+    it("should end the push connection when it is replaced", function() {
+      var end = sinon.spy();
+      user.attach(push, end);
+
+      user.attach(function() {});
+
+      sinon.assert.calledOnce(end);
+    });
+
+    it("should not end the push connection detaching itself", function() {
+      var end = sinon.spy();
+      user.attach(push, end);
+
+      user.detach(push);
+
+      sinon.assert.notCalled(end);
+    });
+
+  });
+
   describe("#touch", function() {
 
     it("should reset the current timeout", function() {
@@ -218,6 +528,29 @@ describe("User", function() {
 
 });
 
+describe("serializeEvents", function() {
+
+  it("should serialize the events like JSON.stringify", function() {
+    var events = [
+      {topic: "foo", data: "oof"},
+      {topic: "bar", data: {peer: "rab"}},
+      {topic: "disconnect", data: null}
+    ];
+
+    expect(serializeEvents(events)).to.equal(JSON.stringify(events));
+    expect(serializeEvents([])).to.equal("[]");
+  });
+
+  it("should reuse the serialized form of the data if any", function() {
+    var data = [{nick: "foo"}];
+    Object.defineProperty(data, "_json", {value: '[{"nick":"cached"}]'});
+
+    expect(serializeEvents([{topic: "users", data: data}])).to.equal(
+      '[{"topic":"users","data":[{"nick":"cached"}]}]');
+  });
+
+});
+
 describe("UserList", function() {
 
   var users;
@@ -226,6 +559,10 @@ describe("UserList", function() {
     users = new Users();
   });
 
+  afterEach(function() {
+    timers.clear();
+  });
+
   describe("#hasNick", function() {
 
     it("should return false if the nick does not exist", function() {
@@ -354,4 +691,107 @@ describe("UserList", function() {
 
   });
 
+  describe("#presence", function() {
+
+    it("should return the list of the users", function() {
+      users.add("foo").add("bar");
+
+      expect(users.presence()).to.deep.equal([{nick: "foo"}, {nick: "bar"}]);
+    });
+
+    it("should return the same list until a user is added", function() {
+      users.add("foo");
+      var presence = users.presence();
+
+      expect(users.presence()).to.equal(presence);
+      users.add("bar");
+      expect(users.presence()).to.not.equal(presence);
+      expect(presence).to.deep.equal([{nick: "foo"}]);
+    });
+
+    it("should return the same list until a user is removed", function() {
+      users.add("foo").add("bar");
+      var presence = users.presence();
+
+      expect(users.presence()).to.equal(presence);
+      users.remove("foo");
+      expect(users.presence()).to.not.equal(presence);
+      expect(users.presence()).to.deep.equal([{nick: "bar"}]);
+    });
+
+    it("should keep track of the users as they are added and removed",
+      function() {
+        users.add("foo").add("bar").add("goo").add("bar");
+        users.remove("foo");
+        users.remove("unknown");
+
+        expect(users.presence().map(function(user) {
+          return user.nick;
+        }).sort()).to.deep.equal(["bar", "goo"]);
+        users.remove("goo");
+        expect(users.presence()).to.deep.equal([{nick: "bar"}]);
+      });
+
+    it("should come with its serialized form", function() {
+      users.add("foo").add("bar");
+
+      expect(users.presence()._json).to.equal(
+        JSON.stringify([{nick: "foo"}, {nick: "bar"}]));
+    });
+
+  });
+
+  describe("#queueStats", function() {
+
+    it("should return statistics about the queues of the users", function() {
+      users.add("foo").add("bar");
+      users.get("foo").events = [{topic: "a", data: 1}, {topic: "b", data: 2}];
+      users.get("bar").events = [{topic: "c", data: 3}];
+
+      var stats = users.queueStats();
+
+      expect(stats.users).to.equal(2);
+      expect(stats.events).to.equal(3);
+      expect(stats.maxDepth).to.equal(2);
+      expect(stats.bytes).to.equal(
+        JSON.stringify(users.get("foo").events).length +
+        JSON.stringify(users.get("bar").events).length);
+    });
+
+    it("should count the events dropped by the users", function() {
+      users.add("foo").add("bar");
+
+      users.get("foo").emit("overflow", 2);
+      users.get("bar").emit("overflow", 3);
+
+      expect(users.queueStats().dropped).to.equal(5);
+    });
+
+    it("should return the distribution of the queue depths", function() {
+      users.add("foo").add("bar").add("baz").add("qux");
+      users.get("foo").events = [1, 2, 3, 4, 5];
+      users.get("bar").events = [1, 2, 3];
+      users.get("baz").events = [1];
+
+      expect(users.queueStats().depths).to.deep.equal({
+        "0": 1,
+        "1": 1,
+        "2-3": 1,
+        "4-7": 1
+      });
+    });
+
+    it("should count the pending requests and the pushed users", function() {
+      users.add("foo").add("bar").add("baz");
+      users.get("foo").waitForEvents(function() {});
+      users.get("bar").attach(function() {});
+
+      var stats = users.queueStats();
+
+      expect(stats.pending).to.equal(1);
+      expect(stats.pushed).to.equal(1);
+    });
+
+  });
+
 });